@@ -0,0 +1,81 @@
+"""
+一次性把 Cityscapes / VOC 的某个划分解码成 DatasetCache (uint8 图像 + 已映射的 uint8 标注), 训练时加上 --data_cache 读取.
+
+    python -m Datasets.build_cache --data_path cityscapes --list train.txt --out ../../input/cache
+    python -m Datasets.build_cache --data_path pascal-voc-2012 --list trainaug.txt --out ../../input/cache
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch.utils.data as data
+
+from .cache import write_cache, cache_path
+from .cityscapes_gf import Cityscapes
+from .pascal_voc import VOCSegmentation
+
+
+class RawSamples(data.Dataset):
+    # 只解码, 不做增强; 用 DataLoader 的多个 worker 并行解码
+    def __init__(self, dataset, names):
+        self.dataset = dataset
+        self.names = names
+
+    def __getitem__(self, index):
+        if isinstance(self.dataset, Cityscapes):
+            image, label = self.dataset.read_image(index), self.dataset.read_label(index)
+        else:
+            image = np.array(self.dataset.read_image(index), dtype=np.uint8)
+            label = np.array(self.dataset.read_target(index), dtype=np.uint8)
+        return self.names[index], image, label
+
+    def __len__(self):
+        return len(self.names)
+
+
+def keep_numpy(sample):
+    # 不让 DataLoader 把 numpy 转成 tensor
+    return sample
+
+
+def raw_dataset(data_path, list_name):
+    if "cityscapes" in data_path:
+        dataset = Cityscapes(root=data_path, list_path="Datasets/list/" + list_name, ignore_label=255)
+        names = [item["name"] for item in dataset.files]
+    elif "pascal-voc-2012" in data_path:
+        dataset = VOCSegmentation(data_path, year="2012", transforms=None, txt_name=list_name)
+        names = [os.path.splitext(os.path.basename(x))[0] for x in dataset.images]
+    else:
+        raise ValueError("unknown dataset: {}".format(data_path))
+    return RawSamples(dataset, names)
+
+
+def main(args):
+    data_path = os.path.join(args.input_root, args.data_path)
+    dataset = raw_dataset(data_path, args.list)
+    out_dir = cache_path(args.out, args.data_path, args.list)
+    loader = data.DataLoader(dataset, batch_size=None, shuffle=False, num_workers=args.workers, collate_fn=keep_numpy)
+
+    start = time.time()
+
+    def samples():
+        for i, sample in enumerate(loader):
+            if i % 100 == 0:
+                print("[{}/{}] {}".format(i, len(dataset), sample[0]))
+            yield sample
+
+    index = write_cache(out_dir, samples(), meta={"data_path": args.data_path, "list": args.list})
+    size = (sum(int(np.prod(s)) for s in index["image_shape"]) + sum(int(np.prod(s)) for s in index["label_shape"])) / 2 ** 30
+    print("wrote {} samples ({:.2f} GB) to {} in {:.1f}s".format(len(index["names"]), size, out_dir, time.time() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--data_path", default="cityscapes", help="cityscapes or pascal-voc-2012")
+    parser.add_argument("--input_root", default="../../input", help="directory that holds the datasets")
+    parser.add_argument("--list", default="train.txt", help="split file, e.g. train.txt val.txt trainaug.txt")
+    parser.add_argument("--out", default="../../input/cache", help="cache root, one sub directory per dataset split")
+    parser.add_argument("-j", "--workers", default=8, type=int, help="decode workers")
+
+    main(parser.parse_args())
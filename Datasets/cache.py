@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from .cityscapes_gf import Cityscapes
+from .pascal_voc import VOCSegmentation
+
+INDEX_FILE = "index.json"
+IMAGE_FILE = "images.bin"
+LABEL_FILE = "labels.bin"
+
+
+class DatasetCache(object):
+    """
+    预先解码好的数据集缓存 (build_cache 生成), 目录结构:
+
+        index.json   每个样本的名字、在 .bin 中的偏移和形状
+        images.bin   所有图像 (uint8, HWC) 依次紧密排列
+        labels.bin   所有标注 (uint8, HW, 已经映射为训练 id) 依次紧密排列
+
+    .bin 通过 np.memmap 只读映射, 取样本只是对映射区域切片, 不拷贝也不解码.
+    多个 DataLoader worker、同一台机器上的多个 rank 共享操作系统的 page cache, 不会各自占一份内存.
+    映射在每个进程第一次读取时才打开, pickle 到 worker 时只传路径和索引.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        index_path = os.path.join(cache_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            raise FileNotFoundError("dataset cache '{}' does not exist, run: python -m Datasets.build_cache".format(index_path))
+        with open(index_path, "r") as f:
+            index = json.load(f)
+        self.names = index["names"]
+        self.image_offset = index["image_offset"]
+        self.image_shape = [tuple(s) for s in index["image_shape"]]
+        self.label_offset = index["label_offset"]
+        self.label_shape = [tuple(s) for s in index["label_shape"]]
+        self.meta = index.get("meta", {})
+        self._images = None
+        self._labels = None
+
+    def _open(self):
+        self._images = np.memmap(os.path.join(self.cache_dir, IMAGE_FILE), dtype=np.uint8, mode="r")
+        self._labels = np.memmap(os.path.join(self.cache_dir, LABEL_FILE), dtype=np.uint8, mode="r")
+
+    def image(self, index):
+        if self._images is None:
+            self._open()
+        shape = self.image_shape[index]
+        start = self.image_offset[index]
+        return self._images[start:start + int(np.prod(shape))].reshape(shape)
+
+    def label(self, index):
+        if self._labels is None:
+            self._open()
+        shape = self.label_shape[index]
+        start = self.label_offset[index]
+        return self._labels[start:start + int(np.prod(shape))].reshape(shape)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        # 不把映射本身 (以及其中的数据) pickle 给 worker
+        state = self.__dict__.copy()
+        state["_images"] = None
+        state["_labels"] = None
+        return state
+
+
+def write_cache(cache_dir, samples, meta=None):
+    """
+    把 (name, image, label) 依次写入 cache_dir. image / label 为 uint8 numpy 数组.
+    index.json 最后写入 (先写临时文件再 rename), 中途中断不会留下看起来完整的缓存.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index = {"names": [], "image_offset": [], "image_shape": [], "label_offset": [], "label_shape": [],
+             "meta": meta or {}}
+    image_pos, label_pos = 0, 0
+    with open(os.path.join(cache_dir, IMAGE_FILE), "wb") as f_image, \
+            open(os.path.join(cache_dir, LABEL_FILE), "wb") as f_label:
+        for name, image, label in samples:
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            label = np.ascontiguousarray(label, dtype=np.uint8)
+            f_image.write(image.tobytes())
+            f_label.write(label.tobytes())
+            index["names"].append(name)
+            index["image_offset"].append(image_pos)
+            index["image_shape"].append(list(image.shape))
+            index["label_offset"].append(label_pos)
+            index["label_shape"].append(list(label.shape))
+            image_pos += image.nbytes
+            label_pos += label.nbytes
+
+    tmp_path = os.path.join(cache_dir, INDEX_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(cache_dir, INDEX_FILE))
+    return index
+
+
+def cache_path(cache_root, data_path, list_name):
+    # 每个数据集的每个划分一个子目录, 如 cache/cityscapes/train
+    return os.path.join(cache_root, os.path.basename(os.path.normpath(data_path)), os.path.splitext(list_name)[0])
+
+
+def check_names(cache, names):
+    # 允许只使用缓存的前 num_samples 个样本
+    if list(cache.names[:len(names)]) != list(names):
+        raise ValueError("dataset cache '{}' ({} samples) does not match the file list ({} samples), "
+                         "rebuild it with python -m Datasets.build_cache".format(cache.cache_dir, len(cache), len(names)))
+
+
+class CachedCityscapes(Cityscapes):
+    """从 DatasetCache 读取图像和已映射的标注, 其余 (增强、归一化) 与 Cityscapes 相同"""
+    def __init__(self, cache_dir, *args, **kwargs):
+        super(CachedCityscapes, self).__init__(*args, **kwargs)
+        self.cache = DatasetCache(cache_dir)
+        check_names(self.cache, [item["name"] for item in self.files])
+
+    def read_image(self, index):
+        return self.cache.image(index)
+
+    def read_label(self, index):
+        return self.cache.label(index)
+
+
+class CachedVOCSegmentation(VOCSegmentation):
+    """从 DatasetCache 读取图像和标注, 不需要原始 VOC 目录"""
+    def __init__(self, cache_dir, transforms=None):
+        self.cache = DatasetCache(cache_dir)
+        self.transforms = transforms
+
+    def read_image(self, index):
+        return Image.fromarray(self.cache.image(index))
+
+    def read_target(self, index):
+        # 原始标注是调色板 PNG, 这里直接以类别 id 的灰度图给 transforms, 数值相同
+        return Image.fromarray(self.cache.label(index))
+
+    def get_height_and_width(self, index):
+        return self.cache.image_shape[index][:2]
+
+    def __len__(self):
+        return len(self.cache)
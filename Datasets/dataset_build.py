@@ -1,16 +1,29 @@
 from .pascal_voc import VOCSegmentation, get_transform
 from .cityscapes_gf import Cityscapes
+from .synthetic import SyntheticSegmentation
+from .cache import CachedCityscapes, CachedVOCSegmentation, cache_path
+from .gpu_transforms import DecodeOnly, DeviceAugmentLoader, build_gpu_augment
+from .group_by_aspect_ratio import GroupedBatchSampler, create_aspect_ratio_groups
 import os, torch
 
 def Pre_datasets(args):
+    if getattr(args, "smoke_steps", 0):
+        return smoke_datasets(args)
+
     data_path = "../../input/" + args.data_path
     # check voc root
-    if os.path.exists(os.path.join(data_path)) is False:
+    if os.path.exists(os.path.join(data_path)) is False and not getattr(args, "data_cache", ""):
         raise FileNotFoundError("VOCdevkit dose not in path:'{}'.".format(data_path))
 
     # load train data set
     train_dataset, val_dataset = datasets_load(args, data_path)
 
+    # --gpu_aug: worker 只解码, 训练集的随机缩放/裁剪/翻转/归一化在 device 上按 batch 完成
+    gpu_aug = getattr(args, "gpu_aug", False)
+    if gpu_aug:
+        gpu_augment = build_gpu_augment(train_dataset)
+        train_dataset = DecodeOnly(train_dataset)
+
     print("Creating data loaders")
     if args.distributed:
         train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset)
@@ -20,33 +33,82 @@ def Pre_datasets(args):
         test_sampler = torch.utils.data.SequentialSampler(val_dataset)
 
     if 'pascal-voc-2012' in data_path :
+        # --aspect_ratio_group_factor >= 0: 长宽比相近的图像组成一个 batch, 减少 cat_list 补齐的面积.
+        # 验证集短边缩放到 513 后尺寸各不相同, 训练集只有 --gpu_aug 时 (整图送到 device) 才需要分组
+        group_factor = getattr(args, "aspect_ratio_group_factor", -1)
+        if group_factor >= 0 and gpu_aug:
+            train_batch_sampler = GroupedBatchSampler(train_sampler, create_aspect_ratio_groups(train_dataset, k=group_factor),
+                                                      args.batch_size, drop_last=True)
+        else:
+            train_batch_sampler = torch.utils.data.BatchSampler(train_sampler, args.batch_size, drop_last=True)
+        if group_factor >= 0:
+            val_batch_sampler = GroupedBatchSampler(test_sampler, create_aspect_ratio_groups(val_dataset, k=group_factor),
+                                                    args.batch_size_val)
+        else:
+            val_batch_sampler = torch.utils.data.BatchSampler(test_sampler, args.batch_size_val, drop_last=False)
+
         train_data_loader = torch.utils.data.DataLoader(
-            train_dataset, batch_size=args.batch_size,
-            sampler=train_sampler, num_workers=args.workers,
-            pin_memory=True, drop_last=True,
+            train_dataset, batch_sampler=train_batch_sampler,
+            num_workers=args.workers, pin_memory=True,
             collate_fn=train_dataset.collate_fn)
 
         val_data_loader = torch.utils.data.DataLoader(
-            val_dataset, batch_size=args.batch_size_val,
-            sampler=test_sampler, num_workers=args.workers,
-            pin_memory=True,
-            collate_fn=train_dataset.collate_fn)
+            val_dataset, batch_sampler=val_batch_sampler,
+            num_workers=args.workers, pin_memory=True,
+            collate_fn=val_dataset.collate_fn)
     elif 'cityscapes' in data_path :
         train_data_loader = torch.utils.data.DataLoader(
             train_dataset, batch_size=args.batch_size,
             sampler=train_sampler, num_workers=args.workers,
-            pin_memory=True, drop_last=True)
+            pin_memory=True, drop_last=True,
+            collate_fn=DecodeOnly.collate_fn if gpu_aug else None)
 
         val_data_loader = torch.utils.data.DataLoader(
             val_dataset, batch_size=args.batch_size_val,
             sampler=test_sampler, num_workers=args.workers,
             pin_memory=True)
+
+    if gpu_aug:
+        device = torch.device(args.device if torch.cuda.is_available() else "cpu")
+        train_data_loader = DeviceAugmentLoader(train_data_loader, gpu_augment, device)
     
     return train_data_loader, val_data_loader, train_sampler
 
 
+def smoke_datasets(args):
+    # 冒烟训练: 每个 epoch 只跑 smoke_steps 个 step, 数据随机生成, 不读取 ../../input
+    print("Creating synthetic data loaders for smoke training")
+    train_dataset = SyntheticSegmentation(args.smoke_steps * args.batch_size, args.num_classes,
+                                          crop_size=args.smoke_size, seed=args.seed)
+    val_dataset = SyntheticSegmentation(max(args.smoke_steps // 2, 1) * args.batch_size_val, args.num_classes,
+                                        crop_size=args.smoke_size, seed=args.seed + len(train_dataset))
+
+    if args.distributed:
+        train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset)
+        test_sampler = torch.utils.data.distributed.DistributedSampler(val_dataset)
+    else:
+        train_sampler = torch.utils.data.RandomSampler(train_dataset)
+        test_sampler = torch.utils.data.SequentialSampler(val_dataset)
+
+    train_data_loader = torch.utils.data.DataLoader(
+        train_dataset, batch_size=args.batch_size,
+        sampler=train_sampler, num_workers=args.workers,
+        drop_last=True)
+
+    val_data_loader = torch.utils.data.DataLoader(
+        val_dataset, batch_size=args.batch_size_val,
+        sampler=test_sampler, num_workers=args.workers)
+
+    return train_data_loader, val_data_loader, train_sampler
+
+
 
 def datasets_load(args, data_path):
+    # --data_cache: 从 build_cache 生成的 memmap 缓存读取, 不再每个 epoch 解码 jpg / png
+    data_cache = getattr(args, "data_cache", "")
+    if data_cache:
+        return cached_datasets_load(args, data_path, data_cache)
+
     # load train data set
     if "pascal-voc-2012" in data_path:
         # VOCdevkit -> VOC2012 -> ImageSets -> Segmentation -> train.txt
@@ -96,3 +158,41 @@ def datasets_load(args, data_path):
 
     return train_dataset, val_dataset
 
+
+def cached_datasets_load(args, data_path, data_cache):
+    print("Loading datasets from cache: {}".format(data_cache))
+    if "pascal-voc-2012" in data_path:
+        train_dataset = CachedVOCSegmentation(cache_path(data_cache, data_path, args.data_train_type),
+                                              transforms=get_transform(train=True))
+        val_dataset = CachedVOCSegmentation(cache_path(data_cache, data_path, "val.txt"),
+                                            transforms=get_transform(train=False))
+    elif "cityscapes" in data_path:
+        train_dataset = CachedCityscapes(
+                            cache_path(data_cache, data_path, args.data_train_type),
+                            root=data_path,
+                            list_path="Datasets/list/"+args.data_train_type,
+                            num_samples=None,
+                            num_classes=19,
+                            multi_scale=True,
+                            flip=True,
+                            ignore_label=255,
+                            base_size=2048,
+                            crop_size=(1024, 512),
+                            downsample_rate=1,
+                            scale_factor=16)
+        val_dataset = CachedCityscapes(
+                            cache_path(data_cache, data_path, "val.txt"),
+                            root=data_path,
+                            list_path="Datasets/list/val.txt",
+                            num_samples=None,
+                            num_classes=19,
+                            multi_scale=False,
+                            flip=False,
+                            ignore_label=255,
+                            base_size=2048,
+                            crop_size=(2048, 1024),
+                            downsample_rate=1)
+    else:
+        raise ValueError("unknown dataset: {}".format(data_path))
+
+    return train_dataset, val_dataset
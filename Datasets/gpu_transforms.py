@@ -0,0 +1,182 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.utils.data as data
+
+from .cityscapes_gf import Cityscapes
+from .config import config
+from .pascal_voc import cat_list
+
+
+class DecodeOnly(data.Dataset):
+    """
+    只解码, 不做增强: 返回 uint8 的 RGB 图像 [3, H, W] 和 uint8 标注 [H, W].
+    用 dataset 的 read_image / read_label (read_target) 读取, 所以对 memmap 缓存 (--data_cache) 同样适用.
+    随机缩放、裁剪、翻转、归一化都交给 GPUSegmentationAugment 在 device 上按 batch 完成.
+    """
+    def __init__(self, dataset):
+        super(DecodeOnly, self).__init__()
+        self.dataset = dataset
+
+    def __getitem__(self, index):
+        if isinstance(self.dataset, Cityscapes):
+            # cv2 读出来是 BGR
+            image = self.dataset.read_image(index)[:, :, ::-1]
+            label = self.dataset.read_label(index)
+        else:
+            image = np.asarray(self.dataset.read_image(index))
+            label = np.asarray(self.dataset.read_target(index))
+        image = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1)
+        label = torch.from_numpy(np.ascontiguousarray(label, dtype=np.uint8))
+        return image, label
+
+    def get_height_and_width(self, index):
+        return self.dataset.get_height_and_width(index)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    @staticmethod
+    def collate_fn(batch):
+        # 尺寸不同的图像补到同一大小 (右下方补图像 0 / 标注 255), 同时记下每张图像的实际大小
+        images, labels = list(zip(*batch))
+        sizes = torch.tensor([img.shape[1:] for img in images], dtype=torch.long)
+        return cat_list(images, fill_value=0), cat_list(labels, fill_value=255), sizes
+
+
+class GPUSegmentationAugment(object):
+    """
+    在 device 上对一个 batch 做随机缩放 + 裁剪 + 水平翻转 (+ 亮度) + 归一化, 每个样本的随机参数独立.
+    缩放和裁剪合成一次 grid_sample: 输出的每个像素直接算出它在原图中的坐标, 图像 bilinear, 标注 nearest.
+    裁剪区域超出缩放后图像的部分与 CPU 版本一致: 补在右下方, 图像补 0, 标注补 ignore_label.
+
+    resize:
+        None:    不缩放
+        "short": 短边缩放到 [min_size, max_size] 中的随机整数 (SegmentationPresetTrain / T.RandomResize)
+        "long":  长边缩放到 base_size * (0.5 + randint(0, scale_factor) / 10) (BaseDataset.multi_scale_aug)
+    flip_before_crop: VOC 先翻转再裁剪 (补边总在右侧); Cityscapes 先裁剪补边再翻转.
+    与 CPU 版本的差别: 缩小时 bilinear 没有 PIL 的抗锯齿.
+    """
+    def __init__(self, crop_size, resize="short", min_size=256, max_size=1026, base_size=2048, scale_factor=16,
+                 hflip_prob=0.5, flip_before_crop=True, brightness_shift=0,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), ignore_label=255):
+        self.crop_size = (crop_size, crop_size) if isinstance(crop_size, int) else tuple(crop_size)
+        self.resize = resize
+        self.min_size = min_size
+        self.max_size = max_size
+        self.base_size = base_size
+        self.scale_factor = scale_factor
+        self.hflip_prob = hflip_prob
+        self.flip_before_crop = flip_before_crop
+        self.brightness_shift = brightness_shift
+        self.mean = mean
+        self.std = std
+        self.ignore_label = ignore_label
+
+    def _resized_size(self, sizes):
+        h, w = sizes[:, 0], sizes[:, 1]
+        device = sizes.device
+        if self.resize is None:
+            return h, w
+        if self.resize == "short":
+            size = torch.randint(self.min_size, self.max_size + 1, h.shape, device=device)
+            short, long = torch.min(h, w), torch.max(h, w)
+            new_long = size * long // short
+            new_h = torch.where(h <= w, size, new_long)
+            new_w = torch.where(h <= w, new_long, size)
+        else:
+            rand_scale = 0.5 + torch.randint(0, self.scale_factor + 1, h.shape, device=device).double() / 10.0
+            long_size = (self.base_size * rand_scale + 0.5).long()
+            new_h = torch.where(h > w, long_size, (h.double() * long_size / w + 0.5).long())
+            new_w = torch.where(h > w, (w.double() * long_size / h + 0.5).long(), long_size)
+        return new_h, new_w
+
+    def _source_coords(self, offset, out_size, new_size, size, canvas, flip=None):
+        # 输出的第 i 个像素 -> 缩放后图像中的坐标 -> 原图中的坐标 (像素中心对齐), 再换成 grid_sample 的 [-1, 1]
+        i = torch.arange(out_size, device=offset.device).view(1, -1)
+        if flip is not None and not self.flip_before_crop:
+            i = torch.where(flip.view(-1, 1), out_size - 1 - i, i)
+        resized = offset.view(-1, 1) + i
+        inside = resized < new_size.view(-1, 1)
+        if flip is not None and self.flip_before_crop:
+            resized = torch.where(flip.view(-1, 1), new_size.view(-1, 1) - 1 - resized, resized)
+        src = (resized.float() + 0.5) * (size.float() / new_size.float()).view(-1, 1) - 0.5
+        src = torch.min(src.clamp(min=0), (size - 1).float().view(-1, 1))
+        # 超出缩放后图像的部分取到画布外, grid_sample 补 0
+        src = torch.where(inside, src, torch.full_like(src, -2.0))
+        return (2 * src + 1) / canvas - 1
+
+    @torch.no_grad()
+    def __call__(self, images, labels, sizes):
+        """
+        Args:
+            images (Tensor[B, 3, H, W] uint8): DecodeOnly.collate_fn 补齐后的图像
+            labels (Tensor[B, H, W] uint8)
+            sizes (Tensor[B, 2]): 每张图像的实际 (h, w)
+        Returns:
+            images (Tensor[B, 3, crop_h, crop_w] float), labels (Tensor[B, crop_h, crop_w] int64)
+        """
+        device = images.device
+        b, _, canvas_h, canvas_w = images.shape
+        crop_h, crop_w = self.crop_size
+        sizes = sizes.to(device)
+        new_h, new_w = self._resized_size(sizes)
+
+        # 每个样本独立的裁剪位置和翻转
+        y0 = (torch.rand(b, device=device) * (new_h - crop_h + 1).clamp(min=1).float()).long()
+        x0 = (torch.rand(b, device=device) * (new_w - crop_w + 1).clamp(min=1).float()).long()
+        flip = torch.rand(b, device=device) < self.hflip_prob
+
+        ys = self._source_coords(y0, crop_h, new_h, sizes[:, 0], canvas_h)
+        xs = self._source_coords(x0, crop_w, new_w, sizes[:, 1], canvas_w, flip)
+        grid = torch.stack([xs.view(b, 1, crop_w).expand(b, crop_h, crop_w),
+                            ys.view(b, crop_h, 1).expand(b, crop_h, crop_w)], dim=-1)
+
+        images = F.grid_sample(images.float(), grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+        # 标注 +1 之后采样, 画布外补的 0 变回 -1, 和画布里补的 255 一起记为 ignore_label
+        labels = F.grid_sample(labels.unsqueeze(1).float() + 1, grid, mode="nearest", padding_mode="zeros",
+                               align_corners=False).squeeze(1).long() - 1
+        labels = torch.where((labels < 0) | (labels == 255), torch.full_like(labels, self.ignore_label), labels)
+
+        if self.brightness_shift > 0:
+            # BaseDataset.random_brightness: 一半的样本整体加一个 [-shift, shift] 的整数
+            shift = torch.randint(-self.brightness_shift, self.brightness_shift + 1, (b,), device=device).float()
+            shift = torch.where(torch.rand(b, device=device) < 0.5, torch.zeros_like(shift), shift)
+            images = (images + shift.view(b, 1, 1, 1)).round().clamp(0, 255)
+
+        mean = torch.as_tensor(self.mean, dtype=images.dtype, device=device).view(1, 3, 1, 1)
+        std = torch.as_tensor(self.std, dtype=images.dtype, device=device).view(1, 3, 1, 1)
+        images = (images / 255.0 - mean) / std
+        return images, labels
+
+
+def build_gpu_augment(dataset):
+    # 与各数据集原来 CPU 上的训练增强参数相同
+    if isinstance(dataset, Cityscapes):
+        if dataset.downsample_rate != 1:
+            raise ValueError("gpu augmentation does not support downsample_rate != 1")
+        return GPUSegmentationAugment(dataset.crop_size, resize="long" if dataset.multi_scale else None,
+                                      base_size=dataset.base_size, scale_factor=dataset.scale_factor,
+                                      hflip_prob=0.5 if dataset.flip else 0, flip_before_crop=False,
+                                      brightness_shift=config.TRAIN.RANDOM_BRIGHTNESS_SHIFT_VALUE
+                                      if config.TRAIN.RANDOM_BRIGHTNESS else 0,
+                                      mean=dataset.mean, std=dataset.std, ignore_label=dataset.ignore_label)
+    # get_transform(train=True): SegmentationPresetTrain(base_size=513, crop_size=513)
+    return GPUSegmentationAugment(513, resize="short", min_size=int(0.5 * 513), max_size=int(2.0 * 513))
+
+
+class DeviceAugmentLoader(object):
+    """包装 DataLoader: 把 uint8 batch 拷到 device 之后再做增强, 训练循环拿到的已经是 device 上的 float 图像"""
+    def __init__(self, loader, transform, device):
+        self.loader = loader
+        self.transform = transform
+        self.device = device
+
+    def __iter__(self):
+        for images, labels, sizes in self.loader:
+            images = images.to(self.device, non_blocking=True)
+            labels = labels.to(self.device, non_blocking=True)
+            yield self.transform(images, labels, sizes)
+
+    def __len__(self):
+        return len(self.loader)
@@ -0,0 +1,73 @@
+import bisect
+import math
+import time
+from collections import defaultdict
+
+import numpy as np
+from torch.utils.data.sampler import BatchSampler, Sampler
+
+
+class GroupedBatchSampler(BatchSampler):
+    """
+    把 sampler 给出的下标按 group_ids 分组, 每个 batch 只取同一组 (长宽比相近) 的图像, 减少 cat_list 补齐的面积.
+    sampler 可以是 RandomSampler / SequentialSampler / DistributedSampler: 每个 rank 取哪些样本、set_epoch
+    的打乱方式都不变, 这里只改变同一个 rank 内样本组成 batch 的方式.
+
+    每个样本只出现一次. 各组最后凑不满 batch_size 的样本按组的顺序合在一起再组成 batch,
+    drop_last=True 时丢掉最后不满的一个 batch, 因此 batch 个数与普通 BatchSampler 完全相同.
+    """
+    def __init__(self, sampler, group_ids, batch_size, drop_last=False):
+        if not isinstance(sampler, Sampler):
+            raise ValueError("sampler should be an instance of torch.utils.data.Sampler, but got sampler={}".format(sampler))
+        self.sampler = sampler
+        self.group_ids = group_ids
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        buffer_per_group = defaultdict(list)
+        for idx in self.sampler:
+            group_id = self.group_ids[idx]
+            buffer_per_group[group_id].append(idx)
+            if len(buffer_per_group[group_id]) == self.batch_size:
+                yield buffer_per_group[group_id]
+                del buffer_per_group[group_id]
+
+        remaining = [idx for group_id in sorted(buffer_per_group) for idx in buffer_per_group[group_id]]
+        for i in range(0, len(remaining), self.batch_size):
+            batch = remaining[i:i + self.batch_size]
+            if len(batch) == self.batch_size or not self.drop_last:
+                yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.sampler) // self.batch_size
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
+
+
+def _quantize(x, bins):
+    bins = sorted(bins)
+    return [bisect.bisect_right(bins, y) for y in x]
+
+
+def compute_aspect_ratios(dataset):
+    # dataset 需要提供 get_height_and_width(index), 只读图像文件头或缓存索引, 不解码
+    start = time.time()
+    aspect_ratios = []
+    for i in range(len(dataset)):
+        height, width = dataset.get_height_and_width(i)
+        aspect_ratios.append(float(width) / float(height))
+    print("Computed aspect ratios of {} images in {:.1f}s".format(len(aspect_ratios), time.time() - start))
+    return aspect_ratios
+
+
+def create_aspect_ratio_groups(dataset, k=0):
+    # 长宽比在 [0.5, 2] 之间按对数均匀切成 2k 段, 加上两端共 2k + 2 组
+    aspect_ratios = compute_aspect_ratios(dataset)
+    bins = (2 ** np.linspace(-1, 1, 2 * k + 1)).tolist() if k > 0 else [1.0]
+    groups = _quantize(aspect_ratios, bins)
+    counts = np.unique(groups, return_counts=True)[1]
+    fbins = [0] + bins + [math.inf]
+    print("Using {} as bins for aspect ratio quantization".format(fbins))
+    print("Count of instances per bin: {}".format(counts))
+    return groups
@@ -1,5 +1,7 @@
 import os
 
+import numpy as np
+import torch
 import torch.utils.data as data
 from PIL import Image
 import Datasets.transforms as T
@@ -27,6 +29,18 @@ class VOCSegmentation(data.Dataset):
         assert (len(self.images) == len(self.masks))
         self.transforms = transforms
 
+    def read_image(self, index):
+        return Image.open(self.images[index]).convert('RGB')
+
+    def read_target(self, index):
+        return Image.open(self.masks[index])
+
+    def get_height_and_width(self, index):
+        # 只读取文件头, 用于按长宽比分组
+        with Image.open(self.images[index]) as img:
+            width, height = img.size
+        return height, width
+
     def __getitem__(self, index):
         """
         Args:
@@ -35,8 +49,8 @@ class VOCSegmentation(data.Dataset):
         Returns:
             tuple: (image, target) where target is the image segmentation.
         """
-        img = Image.open(self.images[index]).convert('RGB')
-        target = Image.open(self.masks[index])
+        img = self.read_image(index)
+        target = self.read_target(index)
 
         if self.transforms is not None:
             img, target = self.transforms(img, target)
@@ -58,11 +72,27 @@ def cat_list(images, fill_value=0):
     # 计算该batch数据中，channel, h, w的最大值
     max_size = tuple(max(s) for s in zip(*[img.shape for img in images]))
     batch_shape = (len(images),) + max_size
-    batched_imgs = images[0].new(*batch_shape).fill_(fill_value)
+    batched_imgs = batch_buffer(images[0], batch_shape)
+    # 每张图像直接拷到输出中对应的位置, 只把右侧和下方补齐的部分填成 fill_value
     for img, pad_img in zip(images, batched_imgs):
-        pad_img[..., :img.shape[-2], :img.shape[-1]].copy_(img)
+        h, w = img.shape[-2:]
+        pad_img[..., :h, :w].copy_(img)
+        pad_img[..., :h, w:].fill_(fill_value)
+        pad_img[..., h:, :].fill_(fill_value)
     return batched_imgs
 
+
+def batch_buffer(elem, batch_shape):
+    # 与 default_collate 相同: 在 worker 中直接分配到共享内存, 传回主进程时不用再拷贝一次;
+    # 在主进程 (num_workers=0) 中分配到锁页内存, 之后 pin_memory / .to(device, non_blocking=True) 不用再拷贝
+    numel = int(np.prod(batch_shape))
+    if data.get_worker_info() is not None:
+        storage = elem.storage()._new_shared(numel)
+        return elem.new(storage).resize_(batch_shape)
+    if torch.cuda.is_available():
+        return torch.empty(batch_shape, dtype=elem.dtype, pin_memory=True)
+    return elem.new_empty(batch_shape)
+
 class SegmentationPresetTrain:
     def __init__(self, base_size, crop_size, hflip_prob=0.5, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
         min_size = int(0.5 * base_size)
@@ -0,0 +1,34 @@
+import torch
+import torch.nn.functional as F
+import torch.utils.data as data
+
+
+class SyntheticSegmentation(data.Dataset):
+    """
+    随机生成的块状分割数据, 用于没有 GPU / 数据集的机器上做端到端冒烟训练 (--smoke_steps).
+    每个 index 的样本由 seed + index 决定, 多次运行结果一致.
+    """
+    def __init__(self, num_samples, num_classes, crop_size=128, block=16, ignore_ratio=0.05, seed=0):
+        super(SyntheticSegmentation, self).__init__()
+        self.num_samples = num_samples
+        self.num_classes = num_classes
+        self.crop_size = crop_size
+        self.block = block
+        self.ignore_ratio = ignore_ratio
+        self.seed = seed
+
+    def __getitem__(self, index):
+        g = torch.Generator().manual_seed(self.seed + index)
+        size = self.crop_size
+        coarse = torch.randint(0, self.num_classes, (1, 1, max(size // self.block, 1), max(size // self.block, 1)), generator=g)
+        target = F.interpolate(coarse.float(), size=(size, size), mode='nearest').long()[0, 0]
+        target[torch.rand(target.shape, generator=g) < self.ignore_ratio] = 255
+
+        # 图像与类别相关, 让损失能够下降
+        img = torch.randn(3, size, size, generator=g) * 0.5
+        img += (target.clamp(max=self.num_classes - 1).float() / self.num_classes).unsqueeze(0)
+
+        return img, target
+
+    def __len__(self):
+        return self.num_samples
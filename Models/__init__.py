@@ -2,8 +2,11 @@ from .dc_net import dcnet_resnet50, dcnet_resnet101
 from .deeplabv3_model import deeplabv3_resnet50, deeplabv3_resnet101, deeplabv3_mobilenetv3_large
 from .fcn_model import fcn_resnet50, fcn_resnet101
 from .model_build import create_model
+from .memory_bank import MemoryBank, PrototypeBank, build_memory_bank, use_memory_bank, upgrade_queue_state_dict
 from .aspp_contrast import aspp_contrast_resnet50, aspp_contrast_resnet101
 from .mep import mep_resnet50, mep_resnet101
 
 from .mep_res import mep_res
-from .mep_sk import mep_sk
\ No newline at end of file
+from .mep_sk import mep_sk
+from .base import reparameterize
+from .inference_model import prepare_inference
@@ -1,4 +1,5 @@
 from collections import OrderedDict
+import torch
 from torch import nn, Tensor
 from typing import Dict
 
@@ -47,4 +48,24 @@ class FCNHead(nn.Sequential):
             nn.ReLU(inplace=True),
             nn.Dropout(0.1),
             nn.Conv2d(inter_channels, channels, 1)
-        )
\ No newline at end of file
+        )
+
+
+def fuse_bn(kernel: Tensor, bn: nn.BatchNorm2d):
+    """
+    把 eval 模式下的 BatchNorm 折叠进它前面不带 bias 的卷积, 返回 (kernel, bias):
+    bn(conv(x)) == conv(x; kernel) + bias
+    """
+    std = torch.sqrt(bn.running_var + bn.eps)
+    t = (bn.weight / std).reshape(-1, 1, 1, 1)
+    return kernel * t, bn.bias - bn.running_mean * bn.weight / std
+
+
+@torch.no_grad()
+def reparameterize(model: nn.Module):
+    """推理前调用: 模型中所有实现了 deploy() 的模块 (如 MEPCover) 替换成等价的推理结构, 之后不能再训练"""
+    model.eval()
+    for m in list(model.modules()):
+        if hasattr(m, "deploy"):
+            m.deploy()
+    return model
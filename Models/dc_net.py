@@ -5,6 +5,7 @@ from typing import Dict
 import torch
 from torch import nn, Tensor
 from torch.nn import functional as F
+from .memory_bank import build_memory_bank, use_memory_bank
 from .resnet_backbone import resnet50, resnet101
 
 
@@ -88,8 +89,7 @@ class FCN(nn.Module):
         self.aux_classifier = aux_classifier
 
         # self.m = 0.999
-        self.r = args.memory_size
-        num_classes = 1
+        self.r = use_memory_bank(args)
         dim = args.project_dim
 
         if self.contrast != -1:
@@ -97,29 +97,17 @@ class FCN(nn.Module):
                 self.ProjectorHead_3d = ProjectorHead["3d"]
                 self.ProjectorHead_3u = ProjectorHead["3u"]
                 if self.r:
-                    self.register_buffer("encode3_queue", nn.functional.normalize(torch.randn(num_classes, self.r, dim), p=2, dim=2))
-                    self.register_buffer("encode3_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                    # self.register_buffer("decode3_queue", nn.functional.normalize(torch.randn(num_classes, self.r, dim), p=2, dim=2))
-                    # self.register_buffer("decode3_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                    self.register_buffer("code3_queue_label", torch.randn(num_classes, self.r))
+                    self.bank3 = build_memory_bank(args, dim)
             if self.L2_loss != 0:
                 self.ProjectorHead_2d = ProjectorHead["2d"]
                 self.ProjectorHead_2u = ProjectorHead["2u"]
                 if self.r:             
-                    self.register_buffer("encode2_queue", nn.functional.normalize(torch.randn(num_classes, self.r, dim), p=2, dim=2))
-                    self.register_buffer("encode2_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                    # self.register_buffer("decode2_queue", nn.functional.normalize(torch.randn(num_classes, self.r, dim), p=2, dim=2))
-                    # self.register_buffer("decode2_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                    self.register_buffer("code2_queue_label", torch.randn(num_classes, self.r))
+                    self.bank2 = build_memory_bank(args, dim)
             if self.L1_loss != 0:
                 self.ProjectorHead_1d = ProjectorHead["1d"]
                 self.ProjectorHead_1u = ProjectorHead["1u"]
                 if self.r:                  
-                    self.register_buffer("encode1_queue", nn.functional.normalize(torch.randn(num_classes, self.r, dim), p=2, dim=2))
-                    self.register_buffer("encode1_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                    # self.register_buffer("decode1_queue", nn.functional.normalize(torch.randn(num_classes, self.r, dim), p=2, dim=2))
-                    # self.register_buffer("decode1_queue_ptr", torch.zeros(num_classes, dtype=torch.long)) 
-                    self.register_buffer("code1_queue_label", torch.randn(num_classes, self.r))           
+                    self.bank1 = build_memory_bank(args, dim)
 
     def forward(self, x: Tensor, target=None, is_eval=False) -> Dict[str, Tensor]:
         input_shape = x.shape[-2:]
@@ -143,6 +131,8 @@ class FCN(nn.Module):
 
         # if self.ProjectorHead is not None:
         if self.contrast != -1 and is_eval == False:
+            # 上采样到原图之前的 logits, 对比损失的预测直接由它得到 (loss_manage.pyramid.LabelPyramid)
+            result["logits"] = classifer["cls"]
             if self.L3_loss != 0:
                 L3d = features["L3d"]
                 L3d = self.ProjectorHead_3d(L3d)
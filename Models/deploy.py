@@ -0,0 +1,129 @@
+import json
+import struct
+from argparse import Namespace
+
+import numpy as np
+import torch
+
+from .inference_model import prepare_inference, freeze
+from .model_build import create_model
+
+MAGIC = b"SEGDEPLY"
+ALIGN = 64
+# torch.from_numpy 不支持 bfloat16, bf16 按 int16 映射后再 view 回来
+DTYPES = {
+    "float32": (torch.float32, np.float32),
+    "float16": (torch.float16, np.float16),
+    "bfloat16": (torch.bfloat16, np.int16),
+    "int64": (torch.int64, np.int64),
+    "int32": (torch.int32, np.int32),
+    "uint8": (torch.uint8, np.uint8),
+    "bool": (torch.bool, np.bool_),
+}
+TORCH_NAMES = {v[0]: k for k, v in DTYPES.items()}
+
+
+def json_args(args):
+    # checkpoint 中的 args 只保留能写进 json 的部分 (create_model 需要的都是 str / int / float / bool)
+    def ok(v):
+        if isinstance(v, (list, tuple)):
+            return all(ok(i) for i in v)
+        return v is None or isinstance(v, (str, int, float, bool))
+    return {k: v for k, v in vars(args).items() if ok(v)}
+
+
+def save_deploy(model, args, path, dtype=torch.float16, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+    """
+    推理用权重文件, 结构:
+
+        8 字节   MAGIC
+        8 字节   json header 长度 (little endian uint64)
+        header   model_name / num_classes / normalization / dtype / 构建模型用的 args,
+                 以及每个 tensor 的 dtype / shape / 偏移
+        data     所有 tensor 依次排列, 每个按 ALIGN 字节对齐
+
+    保存的是 prepare_inference 之后 (Conv-BN 折叠、去掉投影头 / 对比头 / 辅助分类头 / MemoryBank) 的权重,
+    浮点 tensor 转成 dtype (先在 fp32 下折叠, 再转换). model 会被原地修改.
+    """
+    model = prepare_inference(model)
+    tensors, offset = {}, 0
+    state = model.state_dict()
+    for name, t in state.items():
+        t = t.detach().cpu()
+        if t.is_floating_point():
+            t = t.to(dtype)
+        state[name] = t.contiguous()
+        nbytes = t.numel() * t.element_size()
+        tensors[name] = {"dtype": TORCH_NAMES[t.dtype], "shape": list(t.shape), "offset": offset, "nbytes": nbytes}
+        offset += (nbytes + ALIGN - 1) // ALIGN * ALIGN
+
+    header = {
+        "model_name": args.model_name,
+        "num_classes": args.num_classes,
+        "normalization": {"mean": list(mean), "std": list(std)},
+        "dtype": TORCH_NAMES[dtype],
+        "args": json_args(args),
+        "tensors": tensors,
+    }
+    header = json.dumps(header).encode("utf-8")
+    # data 起始位置也按 ALIGN 对齐
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+    data_start = len(MAGIC) + 8 + len(header)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, t in state.items():
+            info = tensors[name]
+            f.seek(data_start + info["offset"])
+            if info["dtype"] == "bfloat16":
+                t = t.view(torch.int16)
+            f.write(t.numpy().tobytes())
+        # 最后一个 tensor 的对齐补齐
+        f.truncate(data_start + offset)
+    return data_start + offset
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'{}' is not a deploy file, convert the checkpoint with convert_checkpoint.py".format(path))
+        length, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length).decode("utf-8"))
+    header["data_start"] = len(MAGIC) + 8 + length
+    return header
+
+
+def load_state(path, header=None):
+    """np.memmap 映射文件, 返回的 tensor 直接指向映射区域 (copy-on-write), 读取时才从磁盘载入"""
+    header = header or read_header(path)
+    data = np.memmap(path, dtype=np.uint8, mode="c")
+    state = {}
+    for name, info in header["tensors"].items():
+        torch_dtype, np_dtype = DTYPES[info["dtype"]]
+        start = header["data_start"] + info["offset"]
+        array = data[start:start + info["nbytes"]].view(np_dtype).reshape(info["shape"])
+        t = torch.from_numpy(array)
+        state[name] = t.view(torch_dtype) if info["dtype"] == "bfloat16" else t
+    return state
+
+
+def load_deploy(path, device="cpu", example=None):
+    """
+    读取 save_deploy 保存的文件, 返回 (推理模型, header). 模型按 header 中的 args 构建 (不加载预训练权重)
+    并经过 prepare_inference, 参数为 fp32 (从 fp16 / bf16 转换); forward(x) 只返回 out.
+    给出 example 时再用 torch.jit.freeze 固化.
+    """
+    header = read_header(path)
+    args = Namespace(**header["args"])
+    args.pre_trained = ""
+    # 推理模型不需要 MemoryBank / PrototypeBank, 不分配缓冲区 (prepare_inference 也会把它们删掉)
+    args.memory_size = 0
+    args.memory_type = "queue"
+    model = prepare_inference(create_model(args))
+    model.load_state_dict(load_state(path, header))
+    model.to(device)
+    if example is not None:
+        model = freeze(model, example)
+    return model, header
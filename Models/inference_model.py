@@ -0,0 +1,106 @@
+import inspect
+
+import torch
+from torch import nn, Tensor
+
+from .base import IntermediateLayerGetter, fuse_bn, reparameterize
+
+
+def fuse_conv(conv: nn.Conv2d, bn: nn.BatchNorm2d) -> nn.Conv2d:
+    # bn(conv(x)) -> 一个带 bias 的卷积
+    kernel, bias = fuse_bn(conv.weight, bn)
+    if conv.bias is not None:
+        bias = bias + conv.bias * bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    fused = nn.Conv2d(conv.in_channels, conv.out_channels, conv.kernel_size, stride=conv.stride,
+                      padding=conv.padding, dilation=conv.dilation, groups=conv.groups, bias=True,
+                      padding_mode=conv.padding_mode).to(device=kernel.device, dtype=kernel.dtype)
+    fused.weight.copy_(kernel)
+    fused.bias.copy_(bias)
+    return fused
+
+
+@torch.no_grad()
+def fuse_conv_bn(model: nn.Module):
+    """
+    eval 模式下把 BatchNorm2d 折叠进它前面的 Conv2d, bn 换成 nn.Identity (保留位置, DeepLabHead 等按下标取中间输出).
+    两种写法:
+        Sequential / IntermediateLayerGetter 中相邻的 Conv2d, BatchNorm2d (FCNHead, ASPPConv, ASPPPooling,
+        DoubleConv, ProjectorHead, ASPPDown / ASPPUp, ConvBNActivation, backbone 的 conv1 / bn1 ...);
+        同一模块中的 convN / bnN, 即 forward 中 bnN(convN(x)) (resnet Bottleneck).
+    ReLU 保持不变.
+    返回折叠的个数.
+    """
+    count = 0
+    for m in list(model.modules()):
+        if isinstance(m, (nn.Sequential, IntermediateLayerGetter)):
+            names = list(m._modules)
+            for a, b in zip(names, names[1:]):
+                if isinstance(m._modules[a], nn.Conv2d) and isinstance(m._modules[b], nn.BatchNorm2d):
+                    m._modules[a] = fuse_conv(m._modules[a], m._modules[b])
+                    m._modules[b] = nn.Identity()
+                    count += 1
+        else:
+            for name, conv in list(m.named_children()):
+                bn = getattr(m, "bn" + name[len("conv"):], None) if name.startswith("conv") else None
+                if isinstance(conv, nn.Conv2d) and isinstance(bn, nn.BatchNorm2d):
+                    setattr(m, name, fuse_conv(conv, bn))
+                    setattr(m, "bn" + name[len("conv"):], nn.Identity())
+                    count += 1
+    return count
+
+
+def strip_training_modules(model: nn.Module):
+    """
+    删除 is_eval=True 前向用不到的模块: 辅助分类头、投影头 (dc_net ProjectorHead_*)、
+    对比头 (deeplabv3 / aspp_contrast 的 contrast) 以及 MemoryBank 队列. 之后只能 model(x, is_eval=True).
+    """
+    if getattr(model, "aux_classifier", None) is not None:
+        model.aux_classifier = None
+    if isinstance(getattr(model, "contrast", None), nn.Module):
+        model.contrast = None
+    for name, _ in list(model.named_children()):
+        if name.startswith("ProjectorHead_") or name in ["bank1", "bank2", "bank3"]:
+            delattr(model, name)
+    return model
+
+
+class InferenceModel(nn.Module):
+    """只返回 out (Tensor[B, num_classes, H, W]) 的推理模型"""
+    def __init__(self, model: nn.Module):
+        super(InferenceModel, self).__init__()
+        self.model = model
+        # fcn 等模型的 forward 没有 is_eval 参数
+        self.is_eval = "is_eval" in inspect.signature(model.forward).parameters
+
+    def forward(self, x: Tensor) -> Tensor:
+        if self.is_eval:
+            return self.model(x, is_eval=True)["out"]
+        return self.model(x)["out"]
+
+
+def prepare_inference(model: nn.Module, example: Tensor = None):
+    """
+    训练好的模型 -> 推理模型: eval、MEPCover 重参数化、Conv-BN 折叠、删除训练专用模块, 返回只输出 out 的模块,
+    参数不再需要梯度. 给出 example 输入时再用 torch.jit.trace + torch.jit.freeze 固化计算图
+    (常量折叠, cuda 上 cudnn 可进一步融合 conv + relu); 固化失败时返回未固化的模块.
+    """
+    model = model.module if hasattr(model, "module") else model
+    reparameterize(model)
+    fuse_conv_bn(model)
+    strip_training_modules(model)
+    for p in model.parameters():
+        p.requires_grad_(False)
+    model = InferenceModel(model).eval()
+    if example is None:
+        return model
+    return freeze(model, example)
+
+
+def freeze(model: nn.Module, example: Tensor):
+    """torch.jit.trace + torch.jit.freeze 固化推理模型; 固化失败时返回原模块"""
+    try:
+        with torch.no_grad():
+            return torch.jit.freeze(torch.jit.trace(model, example))
+    except Exception as e:
+        print("torch.jit.freeze failed, using the eager model: {!r}".format(e))
+        return model
@@ -0,0 +1,337 @@
+import re
+
+import torch
+from torch import nn
+
+POLICIES = ["fifo", "reservoir", "hardness"]
+
+
+class MemoryBank(nn.Module):
+    """
+    对比学习的特征队列 (环形缓冲区).
+
+    feature: [num_classes, size, dim] 归一化后的特征
+    label:   [num_classes, size]      每个位置对应的类别
+    valid:   [num_classes, size]      该位置是否已经写入过特征, 未写入的位置不参与对比
+    ptr:     [num_classes]            fifo 下一个写入位置
+    seen:    [num_classes]            reservoir 每个类别累计见过的特征个数
+    score:   [num_classes, size]      hardness 每个位置的难度分数
+
+    num_classes == 1 时所有类别共用一个队列; num_classes > 1 时按类别分区, 每个类别独占 size 个位置.
+    每个 step 采样得到的所有特征一次写入, 指针等状态一直留在 device 上, 入队时不需要 .item() 同步.
+
+    淘汰策略 (policy):
+        fifo:      写满后覆盖最早写入的特征
+        reservoir: 蓄水池采样, 队列中每个见过的特征被保留的概率相同
+        hardness:  与类别原型 (队列中同类特征的均值) 越不相似越难, 优先保留难特征, 已有分数每步乘以 decay 衰减
+    """
+    def __init__(self, size, dim, num_classes: int = 1, policy: str = "fifo", decay: float = 0.99):
+        super(MemoryBank, self).__init__()
+        if policy not in POLICIES:
+            raise ValueError("unknown memory policy: {}, expected one of {}".format(policy, POLICIES))
+        self.size = size
+        self.dim = dim
+        self.num_classes = num_classes
+        self.policy = policy
+        self.decay = decay
+
+        self.register_buffer("feature", nn.functional.normalize(torch.randn(num_classes, size, dim), p=2, dim=2))
+        self.register_buffer("label", torch.arange(num_classes, dtype=torch.float).view(-1, 1).repeat(1, size))
+        self.register_buffer("valid", torch.zeros(num_classes, size, dtype=torch.bool))
+        self.register_buffer("ptr", torch.zeros(num_classes, dtype=torch.long))
+        self.register_buffer("seen", torch.zeros(num_classes, dtype=torch.long))
+        self.register_buffer("score", torch.zeros(num_classes, size))
+
+    def _partition(self, labels):
+        # 每个特征写入的队列编号, 以及它在本 step 同一队列中的先后次序 (rank)
+        # label 为负 (如多卡 all_gather 时补齐的行) 的特征不入队
+        if self.num_classes == 1:
+            queue_id = torch.zeros_like(labels, dtype=torch.long)
+            in_range = labels >= 0
+        else:
+            queue_id = labels.long()
+            in_range = (queue_id >= 0) & (queue_id < self.num_classes)
+        # 排序时不入队的特征排在所有队列之后, 不占用任何队列的 rank; queue_id 截断到合法范围只用于索引
+        key = torch.where(in_range, queue_id, torch.full_like(queue_id, self.num_classes))
+        queue_id = queue_id.clamp(0, self.num_classes - 1)
+
+        count = torch.zeros(self.num_classes, dtype=torch.long, device=labels.device)
+        count.scatter_add_(0, queue_id, in_range.long())
+        order = torch.sort(key, stable=True)[1]
+        start = count.cumsum(0) - count
+        rank = torch.empty_like(queue_id)
+        rank[order] = torch.arange(queue_id.shape[0], device=labels.device) - start[queue_id[order]]
+        # 不入队的特征 rank 记为 0 (之后都会被 in_range mask 掉)
+        rank = torch.where(in_range, rank, torch.zeros_like(rank))
+        return queue_id, rank, count, in_range
+
+    def _winner(self, slot, keep):
+        """
+        每个特征实际写入的位置 target 与写入的内容 src (特征编号, -1 表示保持该位置原来的内容).
+        同一位置被写多次时和逐个写入一样保留最后一个: 同一位置的所有特征都写入最后一个特征, 写入的值相同;
+        丢弃的特征 (keep 为 False) 也改写到本 step 某个被写入的位置并写入同样的值 (都没有写入时写回位置 0 原来的内容).
+        这样之后只需要对 n 行做 index_copy_, 不需要额外的垃圾位置, 也不需要布尔索引.
+        slot / keep 可以带前导维度 (多个队列一次计算), 返回形状与 slot 相同.
+        """
+        num_slots = self.num_classes * self.size
+        n = slot.shape[-1]
+        item = torch.arange(n, device=slot.device)
+        slot = torch.where(keep, slot, torch.full_like(slot, num_slots))
+
+        # 按 (位置, 编号) 排序, 每段相同位置中最后一个特征即最终写入的特征; 丢弃的特征排在最后
+        key, perm = torch.sort(slot * n + item, dim=-1)
+        sorted_slot = key // n
+        last = torch.ones_like(keep)
+        last[..., :-1] = sorted_slot[..., 1:] != sorted_slot[..., :-1]
+        # 每个排序位置所在段的最后一个排序位置 (后缀最小值)
+        end = torch.where(last, item.expand_as(sorted_slot), torch.full_like(sorted_slot, n))
+        end = torch.cummin(end.flip(-1), dim=-1)[0].flip(-1)
+        src = perm.gather(-1, end)
+
+        # 丢弃的特征改写到排在最前面的位置 (有写入时它是一个被写入的位置)
+        dropped = sorted_slot == num_slots
+        target = torch.where(dropped, sorted_slot[..., :1].expand_as(sorted_slot), sorted_slot)
+        src = torch.where(dropped, src[..., :1].expand_as(src), src)
+        hit = target < num_slots
+        target = torch.where(hit, target, torch.zeros_like(target))
+        src = torch.where(hit, src, torch.full_like(src, -1))
+        return target, src
+
+    def _write(self, target, src, feats, labels, score=None):
+        """
+        按 _winner 的结果写入: 位置 target[i] 写入第 src[i] 个特征 (src 为 -1 时写回原来的内容).
+        只读写被写到的 n 行, 同一位置重复出现时写入的值相同.
+        """
+        num_slots = self.num_classes * self.size
+        hit = src >= 0
+        src = src.clamp(min=0)
+
+        feature = self.feature.view(num_slots, self.dim)
+        feature.index_copy_(0, target, torch.where(hit.unsqueeze(1), feats[src].to(feature.dtype), feature[target]))
+        label = self.label.view(num_slots)
+        label.index_copy_(0, target, torch.where(hit, labels[src].to(label.dtype), label[target]))
+        valid = self.valid.view(num_slots)
+        valid.index_copy_(0, target, hit | valid[target])
+        if score is not None:
+            flat_score = self.score.view(num_slots)
+            flat_score.index_copy_(0, target, torch.where(hit, score[src].to(flat_score.dtype), flat_score[target]))
+
+    def _hardness(self, feats, queue_id):
+        # 难度 = 1 - 与类别原型的余弦相似度, 队列中还没有该类别时记为 1
+        weight = self.valid.to(self.feature.dtype).unsqueeze(-1)
+        proto = (self.feature * weight).sum(1)
+        has_proto = self.valid.any(1)
+        proto = nn.functional.normalize(proto, p=2, dim=1)
+        sim = (feats * proto[queue_id]).sum(1)
+        return torch.where(has_proto[queue_id], 1 - sim, torch.ones_like(sim))
+
+    def _enqueue_hardness(self, feats, labels, queue_id, rank, in_range):
+        # 每个类别在 (已有 size 个 + 本 step 新来的) 特征中保留分数最高的 size 个
+        n = feats.shape[0]
+        score = self._hardness(feats, queue_id)
+        old_score = torch.where(self.valid, self.score * self.decay, torch.full_like(self.score, -float("inf")))
+
+        new_score = torch.full((self.num_classes * n + 1,), -float("inf"), dtype=old_score.dtype, device=feats.device)
+        pos = torch.where(in_range, queue_id * n + rank, torch.full_like(rank, self.num_classes * n))
+        new_score.scatter_(0, pos, score.to(old_score.dtype))
+        new_score = new_score[:-1].view(self.num_classes, n)
+        new_index = torch.full((self.num_classes * n + 1,), 0, dtype=torch.long, device=feats.device)
+        new_index.scatter_(0, pos, torch.arange(n, device=feats.device))
+        new_index = new_index[:-1].view(self.num_classes, n)
+
+        top_score, top = torch.cat([old_score, new_score], dim=1).topk(self.size, dim=1)
+        from_new = top >= self.size
+        src_new = new_index.gather(1, (top - self.size).clamp(min=0))
+        src_old = top.clamp(max=self.size - 1)
+
+        feature = torch.where(from_new.unsqueeze(-1), feats[src_new].to(self.feature.dtype),
+                              self.feature.gather(1, src_old.unsqueeze(-1).expand(-1, -1, self.dim)))
+        label = torch.where(from_new, labels[src_new].to(self.label.dtype), self.label.gather(1, src_old))
+        self.feature.copy_(feature)
+        self.label.copy_(label)
+        self.valid.copy_(top_score > -float("inf"))
+        self.score.copy_(torch.where(self.valid, top_score, torch.zeros_like(top_score)))
+
+    @torch.no_grad()
+    def enqueue(self, feats, labels):
+        """
+        Args:
+            feats (Tensor[N, V, dim] or Tensor[N, dim]): 采样得到的特征, 每行 V 个视角共用一个类别
+            labels (Tensor[N]): 每行特征的类别
+        """
+        if feats is None or feats.shape[0] == 0:
+            return
+        n_view = feats.shape[1] if feats.dim() == 3 else 1
+        feats = nn.functional.normalize(feats.reshape(-1, self.dim), p=2, dim=1)
+        labels = labels.reshape(-1, 1).expand(-1, n_view).reshape(-1)
+        queue_id, rank, count, in_range = self._partition(labels)
+
+        if self.policy == "fifo":
+            # 一次写入超过队列长度时, 只有最后 size 个会保留下来 (由 _write 中的去重保证)
+            slot = queue_id * self.size + (self.ptr[queue_id] + rank) % self.size
+            self._write(*self._winner(slot, in_range), feats, labels)
+            self.ptr.copy_((self.ptr + count) % self.size)
+        elif self.policy == "reservoir":
+            t = self.seen[queue_id] + rank
+            j = (torch.rand(t.shape, device=t.device) * (t + 1).to(torch.float)).long()
+            j = torch.where(t < self.size, t, j)
+            keep = in_range & (j < self.size)
+            self._write(*self._winner(queue_id * self.size + j.clamp(max=self.size - 1), keep), feats, labels)
+            self.seen.add_(count)
+        else:
+            self._enqueue_hardness(feats, labels, queue_id, rank, in_range)
+
+    def snapshot(self):
+        """
+        返回当前队列 (feature, label, valid), feature / label 形状与原 encode_queue / code_queue_label 相同.
+        valid 总是返回 (不在 host 上判断是否写满), 对比损失中用它 mask 掉未写入的位置, 不做布尔索引, 没有同步.
+        返回的是缓冲区本身, 之后的 enqueue 会原地修改它们; 对比损失里会 cat 出一份拷贝再参与计算.
+        """
+        return self.feature.detach(), self.label.detach(), self.valid
+
+    def _load_from_state_dict(self, state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+        # 旧权重没有 valid / seen / score: 认为队列已经写满
+        if prefix + "feature" in state_dict:
+            feature = state_dict[prefix + "feature"]
+            state_dict.setdefault(prefix + "valid", torch.ones(feature.shape[:2], dtype=torch.bool))
+            state_dict.setdefault(prefix + "seen", torch.full(feature.shape[:1], feature.shape[1], dtype=torch.long))
+            state_dict.setdefault(prefix + "score", torch.zeros(feature.shape[:2]))
+        super(MemoryBank, self)._load_from_state_dict(state_dict, prefix, local_metadata, strict,
+                                                      missing_keys, unexpected_keys, error_msgs)
+
+    def extra_repr(self):
+        return "num_classes={}, size={}, dim={}, policy={}".format(self.num_classes, self.size, self.dim, self.policy)
+
+
+class PrototypeBank(MemoryBank):
+    """
+    按类别的原型 (类中心) 库, 作为特征队列的替代: 每个类别 num_prototypes 个原型, 用动量 (EMA) 更新.
+    对比集合只有 num_classes * num_prototypes 个原型, 与 memory_size 无关.
+
+    feature / label / valid 与 MemoryBank 相同 ([num_classes, num_prototypes, dim] 等), snapshot 与 enqueue 的接口不变,
+    对比损失中可以直接替换 MemoryBank. 入队时:
+        每个特征分配给同类别中最相似的原型 (该类别的原型还没有全部初始化时按 rank 轮流分配);
+        分配到同一原型的特征取均值 m, 原型更新为 normalize(momentum * p + (1 - momentum) * m), 未初始化的原型直接取 m.
+    """
+    def __init__(self, num_classes, dim, num_prototypes: int = 1, momentum: float = 0.99):
+        super(PrototypeBank, self).__init__(num_prototypes, dim, num_classes)
+        self.policy = "prototype"
+        self.momentum = momentum
+
+    @torch.no_grad()
+    def enqueue(self, feats, labels):
+        if feats is None or feats.shape[0] == 0:
+            return
+        n_view = feats.shape[1] if feats.dim() == 3 else 1
+        feats = nn.functional.normalize(feats.reshape(-1, self.dim), p=2, dim=1)
+        labels = labels.reshape(-1, 1).expand(-1, n_view).reshape(-1)
+        queue_id, rank, _, in_range = self._partition(labels)
+
+        sim = torch.einsum("nkd,nd->nk", self.feature[queue_id], feats.to(self.feature.dtype))
+        sim = torch.where(self.valid[queue_id], sim, torch.full_like(sim, -float("inf")))
+        k = torch.where(self.valid.all(1)[queue_id], sim.argmax(1), rank % self.size)
+        slot = queue_id * self.size + k
+
+        num_slots = self.num_classes * self.size
+        weight = in_range.to(self.feature.dtype)
+        total = torch.zeros(num_slots, self.dim, dtype=self.feature.dtype, device=feats.device)
+        total.index_add_(0, slot, feats.to(self.feature.dtype) * weight.unsqueeze(1))
+        count = torch.zeros(num_slots, dtype=self.feature.dtype, device=feats.device).index_add_(0, slot, weight)
+        mean = total / count.clamp(min=1).unsqueeze(1)
+
+        feature = self.feature.view(num_slots, self.dim)
+        valid = self.valid.view(num_slots)
+        ema = torch.where(valid.unsqueeze(1), self.momentum * feature + (1 - self.momentum) * mean, mean)
+        hit = count > 0
+        feature.copy_(torch.where(hit.unsqueeze(1), nn.functional.normalize(ema, p=2, dim=1), feature))
+        valid.logical_or_(hit)
+
+    def extra_repr(self):
+        return "num_classes={}, num_prototypes={}, dim={}, momentum={}".format(self.num_classes, self.size, self.dim,
+                                                                               self.momentum)
+
+
+@torch.no_grad()
+def enqueue_levels(banks, feats, labels):
+    """
+    多层特征共用一次采样时, 一次更新多个 MemoryBank.
+
+    Args:
+        banks (list[MemoryBank]): 每层的队列, num_classes / size / dim 相同
+        feats (Tensor[L, N, V, dim] or Tensor[L, N, dim]): 每层采样得到的特征
+        labels (Tensor[N]): 各层共用的类别
+    归一化、分区 (按类别排序求 rank) 与同一位置的去重只做一次 (按层批量), 最后每层各写一次自己的缓冲区.
+    hardness 策略 / PrototypeBank 依赖各层自己的类别原型, 与配置不同的队列一样逐层入队.
+    """
+    if feats is None or feats.shape[1] == 0:
+        return
+    first = banks[0]
+    if first.policy not in ["fifo", "reservoir"] or any((b.policy, b.num_classes, b.size, b.dim) !=
+                                         (first.policy, first.num_classes, first.size, first.dim) for b in banks):
+        for bank, f in zip(banks, feats):
+            bank.enqueue(f, labels)
+        return
+
+    num_levels = len(banks)
+    n_view = feats.shape[2] if feats.dim() == 4 else 1
+    feats = nn.functional.normalize(feats.reshape(num_levels, -1, first.dim), p=2, dim=2)
+    labels = labels.reshape(-1, 1).expand(-1, n_view).reshape(-1)
+    queue_id, rank, count, in_range = first._partition(labels)
+
+    if first.policy == "fifo":
+        ptr = torch.stack([b.ptr for b in banks])
+        slot = queue_id * first.size + (ptr[:, queue_id] + rank) % first.size
+        keep = in_range.expand_as(slot)
+    else:
+        seen = torch.stack([b.seen for b in banks])
+        t = seen[:, queue_id] + rank
+        j = (torch.rand(t.shape, device=t.device) * (t + 1).to(torch.float)).long()
+        j = torch.where(t < first.size, t, j)
+        keep = in_range & (j < first.size)
+        slot = queue_id * first.size + j.clamp(max=first.size - 1)
+    target, src = first._winner(slot, keep)
+
+    for level, bank in enumerate(banks):
+        bank._write(target[level], src[level], feats[level], labels)
+        if bank.policy == "fifo":
+            bank.ptr.copy_((bank.ptr + count) % bank.size)
+        else:
+            bank.seen.add_(count)
+
+
+def use_memory_bank(args):
+    """是否使用负样本库: --memory_size > 0 (特征队列) 或 --memory_type prototype (原型库, 不需要 memory_size)"""
+    return args.memory_size > 0 or getattr(args, "memory_type", "queue") == "prototype"
+
+
+def build_memory_bank(args, dim):
+    """
+    按照 args 创建 MemoryBank: --memory_per_class 时每个类别独占 memory_size 个位置;
+    --memory_type prototype 时创建 PrototypeBank (每个类别 --prototypes 个原型, 不使用 memory_size).
+    """
+    if getattr(args, "memory_type", "queue") == "prototype":
+        return PrototypeBank(args.num_classes, dim, getattr(args, "prototypes", 1),
+                             momentum=getattr(args, "prototype_momentum", 0.99))
+    num_classes = args.num_classes if getattr(args, "memory_per_class", False) else 1
+    return MemoryBank(args.memory_size, dim, num_classes, policy=getattr(args, "memory_policy", "fifo"))
+
+
+# 旧版模型直接注册的队列缓冲区: encode{N}_queue / encode{N}_queue_ptr / code{N}_queue_label
+_LEGACY_QUEUE_KEYS = [
+    (re.compile(r"^(.*)encode(\d)_queue$"), "feature"),
+    (re.compile(r"^(.*)encode(\d)_queue_ptr$"), "ptr"),
+    (re.compile(r"^(.*)code(\d)_queue_label$"), "label"),
+]
+
+
+def upgrade_queue_state_dict(state_dict):
+    """把旧权重中的队列缓冲区改名为 bank{N}.feature / bank{N}.ptr / bank{N}.label, 其余键保持不变"""
+    new_state_dict = type(state_dict)()
+    for k, v in state_dict.items():
+        for pattern, name in _LEGACY_QUEUE_KEYS:
+            m = pattern.match(k)
+            if m is not None:
+                k = "{}bank{}.{}".format(m.group(1), m.group(2), name)
+                break
+        new_state_dict[k] = v
+    return new_state_dict
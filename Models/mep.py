@@ -5,6 +5,7 @@ from typing import Dict, List
 import torch
 from torch import nn, Tensor
 from torch.nn import functional as F
+from .memory_bank import build_memory_bank, use_memory_bank
 from .resnet_backbone import resnet50, resnet101
 from .mobilenet_backbone import mobilenet_v3_large
 
@@ -91,24 +92,17 @@ class DeepLabV3(nn.Module):
 
         self.attention_name = args.attention
         
-        num_classes = 1
         self.contrast = True if args.contrast != -1 else False
 
-        if args.contrast != -1 and args.memory_size > 0:
+        if args.contrast != -1 and use_memory_bank(args):
             if args.L3_loss != 0:
-                self.register_buffer("encode3_queue", nn.functional.normalize(torch.randn(num_classes, args.memory_size, args.project_dim), p=2, dim=2))
-                self.register_buffer("encode3_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                self.register_buffer("code3_queue_label", torch.randn(num_classes, args.memory_size))
+                self.bank3 = build_memory_bank(args, args.project_dim)
             
             if args.L2_loss != 0:
-                self.register_buffer("encode2_queue", nn.functional.normalize(torch.randn(num_classes, args.memory_size, args.project_dim), p=2, dim=2))
-                self.register_buffer("encode2_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                self.register_buffer("code2_queue_label", torch.randn(num_classes, args.memory_size))
+                self.bank2 = build_memory_bank(args, args.project_dim)
             
             if args.L1_loss != 0:
-                self.register_buffer("encode1_queue", nn.functional.normalize(torch.randn(num_classes, args.memory_size, args.project_dim), p=2, dim=2))
-                self.register_buffer("encode1_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                self.register_buffer("code1_queue_label", torch.randn(num_classes, args.memory_size)) 
+                self.bank1 = build_memory_bank(args, args.project_dim)
 
     def forward(self, x: Tensor, target=None, is_eval = False) -> Dict[str, Tensor]:
         input_shape = x.shape[-2:]
@@ -125,6 +119,8 @@ class DeepLabV3(nn.Module):
 
         # 对比simsiam模块
         if  (self.contrast ) and (is_eval == False):
+            # output stride 8 上的 logits, 对比损失的预测直接由它得到 (loss_manage.pyramid.LabelPyramid)
+            result["logits"] = x["out"]
             temp = x["aspp"]
 
             aspp_one = F.normalize(temp[0], dim=1)
@@ -5,6 +5,7 @@ from typing import Dict, List
 import torch
 from torch import nn, Tensor
 from torch.nn import functional as F
+from .memory_bank import build_memory_bank, use_memory_bank
 from .resnet_backbone import resnet50, resnet101
 from .mobilenet_backbone import mobilenet_v3_large
 
@@ -12,7 +13,7 @@ from  Models.Attention.CBAM import CBAMBlock
 from  Models.Attention.PSA import PSA
 from  Models.Attention.SelfAttention import ScaledDotProductAttention
 
-from .base import IntermediateLayerGetter, FCNHead
+from .base import IntermediateLayerGetter, FCNHead, fuse_bn
 
 
 class DeepLabV3(nn.Module):
@@ -26,24 +27,17 @@ class DeepLabV3(nn.Module):
 
         self.attention_name = args.attention
         
-        num_classes = 1
         self.contrast = True if args.contrast != -1 else False
 
-        if args.contrast != -1 and args.memory_size > 0:
+        if args.contrast != -1 and use_memory_bank(args):
             if args.L3_loss != 0:
-                self.register_buffer("encode3_queue", nn.functional.normalize(torch.randn(num_classes, args.memory_size, args.project_dim), p=2, dim=2))
-                self.register_buffer("encode3_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                self.register_buffer("code3_queue_label", torch.randn(num_classes, args.memory_size))
+                self.bank3 = build_memory_bank(args, args.project_dim)
             
             if args.L2_loss != 0:
-                self.register_buffer("encode2_queue", nn.functional.normalize(torch.randn(num_classes, args.memory_size, args.project_dim), p=2, dim=2))
-                self.register_buffer("encode2_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                self.register_buffer("code2_queue_label", torch.randn(num_classes, args.memory_size))
+                self.bank2 = build_memory_bank(args, args.project_dim)
             
             if args.L1_loss != 0:
-                self.register_buffer("encode1_queue", nn.functional.normalize(torch.randn(num_classes, args.memory_size, args.project_dim), p=2, dim=2))
-                self.register_buffer("encode1_queue_ptr", torch.zeros(num_classes, dtype=torch.long))
-                self.register_buffer("code1_queue_label", torch.randn(num_classes, args.memory_size)) 
+                self.bank1 = build_memory_bank(args, args.project_dim)
 
     def forward(self, x: Tensor, target=None, is_eval = False) -> Dict[str, Tensor]:
         input_shape = x.shape[-2:]
@@ -60,6 +54,8 @@ class DeepLabV3(nn.Module):
 
         # 对比simsiam模块
         if  (self.contrast ) and (is_eval == False):
+            # output stride 8 上的 logits, 对比损失的预测直接由它得到 (loss_manage.pyramid.LabelPyramid)
+            result["logits"] = x["out"]
             temp = x["aspp"]
 
             aspp_one = F.normalize(temp[0], dim=1)
@@ -91,7 +87,28 @@ class MEPCover(nn.Module):
         self.conv1 = nn.Conv2d(in_channels, out_channels, 1, bias=False)
         self.bn1 = nn.BatchNorm2d(out_channels)
 
+        # deploy() 之后的单个 3x3 空洞卷积
+        self.reparam = None
+
+    @torch.no_grad()
+    def deploy(self):
+        # 两路 conv + bn 折叠成一个带 bias 的 3x3 空洞卷积: 1x1 分支加到 3x3 卷积核的中心
+        if self.reparam is not None:
+            return
+        kernel, bias = fuse_bn(self.conv3.weight, self.bn3)
+        kernel1, bias1 = fuse_bn(self.conv1.weight, self.bn1)
+        kernel[:, :, 1, 1] += kernel1[:, :, 0, 0]
+        conv = self.conv3
+        self.reparam = nn.Conv2d(conv.in_channels, conv.out_channels, 3, padding=conv.padding,
+                                 dilation=conv.dilation, bias=True).to(device=kernel.device, dtype=kernel.dtype)
+        self.reparam.weight.copy_(kernel)
+        self.reparam.bias.copy_(bias + bias1)
+        del self.conv3, self.bn3, self.conv1, self.bn1
+
     def forward(self, x):
+        if self.reparam is not None:
+            return self.relu(self.reparam(x))
+
         identity = x
 
         out = self.conv3(x)
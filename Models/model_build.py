@@ -1,5 +1,6 @@
 import torch
 import Models
+from Models.memory_bank import upgrade_queue_state_dict
 
 def create_model(args):
     num_classes = args.num_classes
@@ -8,13 +9,18 @@ def create_model(args):
     pre_trained = args.pre_trained
     
 
+    # mep_res_50 / mep_sk_101 等: 构建函数为 mep_res / mep_sk, backbone 深度由 model_name 的后缀决定
+    builder = model_name
+    if model_name.startswith(("mep_res_", "mep_sk_")):
+        builder = model_name.rsplit("_",1)[0]
+
     if  pre_trained in ["resnet50-imagenet.pth", "resnet101-imagenet.pth"]:
-        if  ("mep_res" in model_name) or ("mep_sk" in model_name):
-            model = eval("Models."+model_name.rsplit("_",1)[0])(args, aux=aux, num_classes=num_classes, pretrain_backbone=True)
-        else:
-            model = eval("Models."+model_name)(args, aux=aux, num_classes=num_classes, pretrain_backbone=True)
+        model = eval("Models."+builder)(args, aux=aux, num_classes=num_classes, pretrain_backbone=True)
+    elif not pre_trained:
+        # 不加载任何预训练权重 (冒烟训练 / 基准测试)
+        model = eval("Models."+builder)(args, aux=aux, num_classes=num_classes, pretrain_backbone=False)
     else:
-        model = eval("Models."+model_name)(args, aux=aux, num_classes=num_classes, pretrain_backbone=False)
+        model = eval("Models."+builder)(args, aux=aux, num_classes=num_classes, pretrain_backbone=False)
 
         weights_dict = torch.load(f"../../input/pre-trained/{pre_trained}", map_location='cpu')
             
@@ -32,7 +38,7 @@ def create_model(args):
                 if "classifier" in k:
                     del weights_dict[k]
 
-        missing_keys, unexpected_keys = model.load_state_dict(weights_dict, strict=False)
+        missing_keys, unexpected_keys = model.load_state_dict(upgrade_queue_state_dict(weights_dict), strict=False)
         if len(missing_keys) != 0 or len(unexpected_keys) != 0:
             print("missing_keys: ", missing_keys)
             print("unexpected_keys: ", unexpected_keys)
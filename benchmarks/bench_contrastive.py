@@ -0,0 +1,90 @@
+"""
+contrastive_loss (按需生成 bool mask, 可分块) 与原稠密 mask 写法的一致性校验、耗时和显存对比.
+
+    python -m benchmarks.bench_contrastive --device cuda --num_anchor 2048 --queue 10000
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from train_utils.loss_manage.contrastive import contrastive_loss
+from benchmarks.common import timeit, peak_memory
+
+
+def contrastive_dense(anchor_feature, contrast_feature, labels_, queue_feature, queue_label,
+                      temperature=0.1, base_temperature=0.07):
+    # 原 aspp_loss.Contrastive (type="intra") 的写法: repeat 出稠密 float mask, 逐行检查正样本个数
+    labels_ = labels_.contiguous().view(-1, 1)
+    anchor_num = anchor_feature.shape[0]
+    contrast_feature = torch.cat([contrast_feature, queue_feature], dim=0)
+    mask = torch.eq(labels_, torch.transpose(torch.cat([labels_, queue_label.view(-1, 1)], dim=0), 0, 1)).float()
+
+    logits = torch.div(torch.matmul(anchor_feature, torch.transpose(contrast_feature, 0, 1)), temperature)
+    logits_mask = torch.ones_like(mask).scatter_(1, torch.arange(anchor_num, device=mask.device).view(-1, 1), 0)
+    ops_mask = mask * logits_mask
+    neg_mask = 1 - mask
+
+    exp_logits = torch.exp(logits)
+    neg_logits = (exp_logits * neg_mask).sum(1, keepdim=True)
+    log_prob = logits - torch.log(exp_logits + neg_logits)
+
+    ops_mask_num = ops_mask.sum(1)
+    for i in range(len(ops_mask_num)):
+        if ops_mask_num[i] == 0:
+            ops_mask_num[i] = 1
+    mean_log_prob_pos = (ops_mask * log_prob).sum(1) / ops_mask_num
+
+    loss = - (temperature / base_temperature) * mean_log_prob_pos
+    return loss.mean()
+
+
+def make_inputs(args, device):
+    anchor = F.normalize(torch.randn(args.num_anchor, args.project_dim, device=device), dim=1).requires_grad_()
+    labels = torch.randint(0, args.num_classes, (args.num_anchor,), device=device).float()
+    queue = F.normalize(torch.randn(args.queue, args.project_dim, device=device), dim=1)
+    queue_label = torch.randint(0, args.num_classes, (args.queue,), device=device).float()
+    return anchor, labels, queue, queue_label
+
+
+def run(fn, anchor):
+    anchor.grad = None
+    loss = fn()
+    loss.backward()
+    return loss.detach(), anchor.grad.clone()
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+    anchor, labels, queue, queue_label = make_inputs(args, device)
+
+    variants = [("dense", lambda: contrastive_dense(anchor, anchor, labels, queue, queue_label))]
+    for chunk in [0] + args.chunks:
+        variants.append(("engine chunk={}".format(chunk),
+                         lambda chunk=chunk: contrastive_loss(anchor, anchor, labels, labels, queue, queue_label,
+                                                              chunk_size=chunk)))
+
+    ref_loss, ref_grad = run(variants[0][1], anchor)
+    print("device: {}  anchors: {}  queue: {}  dim: {}".format(device, args.num_anchor, args.queue, args.project_dim))
+    print("{:<20}{:>8}{:>12}{:>12}".format("variant", "equal", "fwd+bwd(ms)", "peak(MB)"))
+    for name, fn in variants:
+        loss, grad = run(fn, anchor)
+        same = torch.allclose(loss, ref_loss, atol=1e-5) and torch.allclose(grad, ref_grad, atol=1e-6)
+        t = timeit(lambda: run(fn, anchor), device, args.repeat)
+        mem = peak_memory(lambda: run(fn, anchor), device)
+        print("{:<20}{:>8}{:>12.2f}{:>12}".format(name, str(same), t, "-" if mem is None else "{:.1f}".format(mem)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--num_anchor", default=2048, type=int)
+    parser.add_argument("--queue", default=10000, type=int)
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--chunks", default=[256, 1024], type=int, nargs="+")
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
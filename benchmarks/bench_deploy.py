@@ -0,0 +1,64 @@
+"""
+Models.prepare_inference (MEPCover 重参数化 + Conv-BN 折叠 + 删除训练专用模块, 可选 torch.jit.freeze)
+与原模型 eval 前向的一致性校验、参数量与耗时对比.
+
+    python -m benchmarks.bench_deploy --device cuda --models mep_res_50 dcnet_resnet50 --size 513 513 --jit
+"""
+import argparse
+import copy
+import inspect
+
+import torch
+
+from Models import prepare_inference
+from Models.model_build import create_model
+from benchmarks.bench_models import MODELS
+from benchmarks.bench_reparam import randomize_bn
+from benchmarks.common import timeit, model_args
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    height, width = args.size
+    print("device: {}  input: {}x{}  jit: {}".format(device, height, width, args.jit))
+    print("{:<28}{:>12}{:>8}{:>12}{:>12}{:>14}{:>14}{:>10}".format(
+        "model", "max rel err", "argmax", "params(M)", "deploy(M)", "original(ms)", "deploy(ms)", "speedup"))
+    for name in args.models:
+        torch.manual_seed(args.seed)
+        config = dict(project_dim=128)
+        config.update(MODELS[name])
+        margs = model_args(model_name=name, num_classes=args.num_classes, contrast=0, L3_loss=0.1, L2_loss=0.1,
+                           L1_loss=0.1, memory_size=args.memory_size, **config)
+        model = randomize_bn(create_model(margs)).to(device).eval()
+        forward_kwargs = {"is_eval": True} if "is_eval" in inspect.signature(model.forward).parameters else {}
+        image = torch.randn(args.batch_size, 3, height, width, device=device)
+        deployed = prepare_inference(copy.deepcopy(model))
+        # 固化后参数变成常量, 参数量在固化前统计
+        params = sum(p.numel() for p in model.parameters()) / 1e6
+        deploy_params = sum(p.numel() for p in deployed.parameters()) / 1e6
+        with torch.no_grad():
+            if args.jit:
+                deployed = torch.jit.freeze(torch.jit.trace(deployed, image))
+            ref = model(image, **forward_kwargs)["out"]
+            out = deployed(image)
+            t_ref = timeit(lambda: model(image, **forward_kwargs), device, args.repeat)
+            t_dep = timeit(lambda: deployed(image), device, args.repeat)
+        err = ((ref - out).abs().max() / ref.abs().max()).item()
+        same = torch.equal(ref.argmax(1), out.argmax(1))
+        print("{:<28}{:>12.2e}{:>8}{:>12.2f}{:>12.2f}{:>14.2f}{:>14.2f}{:>9.2f}x".format(
+            name, err, str(same), params, deploy_params, t_ref, t_dep, t_ref / t_dep))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--models", default=list(MODELS), nargs="+", choices=list(MODELS))
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--size", default=[513, 513], type=int, nargs=2)
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--memory_size", default=1000, type=int)
+    parser.add_argument("--jit", action="store_true", help="torch.jit.trace + torch.jit.freeze")
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+"""
+VOC 验证集 (短边缩放到 513) 普通 BatchSampler 与 GroupedBatchSampler 的补齐面积,
+以及 cat_list 补齐到 batch 的耗时 (原来 new().fill_() + copy_ 的写法与现在只填补齐部分的写法).
+
+    python -m benchmarks.bench_grouped_batch --batch_size 8
+"""
+import argparse
+
+import numpy as np
+import torch
+
+from Datasets.pascal_voc import cat_list
+from Datasets.group_by_aspect_ratio import GroupedBatchSampler, _quantize
+from benchmarks.common import timeit
+
+
+def cat_list_fill(images, fill_value=0):
+    # 原 cat_list: 整个 batch 先 fill_, 再逐张 copy_
+    max_size = tuple(max(s) for s in zip(*[img.shape for img in images]))
+    batched_imgs = images[0].new(*((len(images),) + max_size)).fill_(fill_value)
+    for img, pad_img in zip(images, batched_imgs):
+        pad_img[..., :img.shape[-2], :img.shape[-1]].copy_(img)
+    return batched_imgs
+
+
+def voc_eval_shapes(num_images, rng):
+    # VOC 图像长边多为 500, 短边 ~ [200, 500], 横图居多; SegmentationPresetEval 把短边缩放到 513
+    short = rng.randint(200, 501, num_images)
+    landscape = rng.rand(num_images) < 0.75
+    h = np.where(landscape, short, 500)
+    w = np.where(landscape, 500, short)
+    scale = 513.0 / np.minimum(h, w)
+    return [(int(a * s), int(b * s)) for a, b, s in zip(h, w, scale)]
+
+
+def padding_ratio(batches, shapes):
+    real, padded = 0, 0
+    for batch in batches:
+        hs, ws = zip(*[shapes[i] for i in batch])
+        real += sum(h * w for h, w in zip(hs, ws))
+        padded += len(batch) * max(hs) * max(ws)
+    return 1 - real / padded
+
+
+def main(args):
+    rng = np.random.RandomState(args.seed)
+    shapes = voc_eval_shapes(args.num_images, rng)
+    sampler = torch.utils.data.SequentialSampler(shapes)
+
+    print("images: {}  batch_size: {}".format(args.num_images, args.batch_size))
+    print("{:<20}{:>10}{:>14}".format("sampler", "batches", "padding(%)"))
+    plain = list(torch.utils.data.BatchSampler(sampler, args.batch_size, drop_last=False))
+    print("{:<20}{:>10}{:>14.1f}".format("BatchSampler", len(plain), 100 * padding_ratio(plain, shapes)))
+    for k in args.group_factors:
+        bins = (2 ** np.linspace(-1, 1, 2 * k + 1)).tolist() if k > 0 else [1.0]
+        group_ids = _quantize([w / h for h, w in shapes], bins)
+        grouped = list(GroupedBatchSampler(sampler, group_ids, args.batch_size))
+        print("{:<20}{:>10}{:>14.1f}".format("grouped k={}".format(k), len(grouped), 100 * padding_ratio(grouped, shapes)))
+
+    images = [torch.randn(3, h, w) for h, w in shapes[:args.batch_size]]
+    targets = [torch.randint(0, 21, (h, w)) for h, w in shapes[:args.batch_size]]
+    cpu = torch.device("cpu")
+    t_fill = timeit(lambda: (cat_list_fill(images), cat_list_fill(targets, 255)), cpu, args.repeat)
+    t_new = timeit(lambda: (cat_list(images), cat_list(targets, 255)), cpu, args.repeat)
+    same = torch.equal(cat_list_fill(images), cat_list(images)) and torch.equal(cat_list_fill(targets, 255), cat_list(targets, 255))
+    print("cat_list equal: {}  fill+copy: {:.2f} ms  copy+pad: {:.2f} ms".format(same, t_fill, t_new))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num_images", default=1449, type=int, help="VOC2012 val")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--group_factors", default=[0, 3], type=int, nargs="+")
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
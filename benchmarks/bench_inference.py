@@ -0,0 +1,78 @@
+"""
+SlidingWindowInference (所有滑窗按 tile_batch 合并前向, device 上翻转) 与 BaseDataset.multi_scale_inference
+(batch 1, 逐个滑窗前向, 翻转经过 numpy) 的一致性校验与耗时对比.
+
+    python -m benchmarks.bench_inference --device cuda --model_name dcnet_resnet50 --height 1024 --width 2048 --crop 769 769
+"""
+import argparse
+import os
+from types import SimpleNamespace
+
+import torch
+
+from Datasets.cityscapes_gf import Cityscapes
+from Models.model_build import create_model
+from train_utils.inference import SlidingWindowInference
+from benchmarks.common import timeit, model_args
+
+
+class OutOnly(torch.nn.Module):
+    # 参考实现直接用 model(x) 的输出作为 logit, 输入留在 CPU
+    def __init__(self, model):
+        super(OutOnly, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x.to(next(self.model.parameters()).device), is_eval=True)["out"]
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+    model = create_model(model_args(model_name=args.model_name, num_classes=args.num_classes)).to(device).eval()
+
+    # 参考实现需要一个 BaseDataset 实例提供 crop_size / base_size / mean / std
+    list_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Datasets", "list", "val.txt")
+    dataset = Cityscapes(root="", list_path=list_path, num_classes=args.num_classes, ignore_label=255,
+                         base_size=args.base_size, crop_size=tuple(args.crop))
+    config = SimpleNamespace(MODEL=SimpleNamespace(NUM_OUTPUTS=1, ALIGN_CORNERS=False), TEST=SimpleNamespace(OUTPUT_INDEX=0))
+    ref_model = OutOnly(model)
+
+    image = torch.randn(1, 3, args.height, args.width)
+    engine = SlidingWindowInference(model, args.num_classes, crop_size=args.crop, scales=args.scales, flip=args.flip,
+                                    base_size=args.base_size, tile_batch=args.tile_batch)
+
+    with torch.no_grad():
+        ref = dataset.multi_scale_inference(config, ref_model, image, scales=args.scales, flip=args.flip)
+        out = engine(image.to(device))
+    same_pred = torch.equal(ref.argmax(1), out.argmax(1))
+    rel_err = ((ref - out).abs().max() / ref.abs().max()).item()
+
+    with torch.no_grad():
+        t_ref = timeit(lambda: dataset.multi_scale_inference(config, ref_model, image, scales=args.scales, flip=args.flip),
+                       device, args.repeat, warmup=1)
+        t_engine = timeit(lambda: engine(image.to(device)), device, args.repeat, warmup=1)
+
+    print("device: {}  model: {}  image: {}x{}  crop: {}  scales: {}  flip: {}".format(
+        device, args.model_name, args.height, args.width, args.crop, args.scales, args.flip))
+    print("argmax equal: {}  max relative error: {:.2e}".format(same_pred, rel_err))
+    print("multi_scale_inference: {:.1f} ms  engine (tile_batch={}): {:.1f} ms  speedup: {:.2f}x".format(
+        t_ref, args.tile_batch, t_engine, t_ref / t_engine))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--model_name", default="dcnet_resnet50", type=str)
+    parser.add_argument("--num_classes", default=19, type=int)
+    parser.add_argument("--height", default=1024, type=int)
+    parser.add_argument("--width", default=2048, type=int)
+    parser.add_argument("--base_size", default=2048, type=int)
+    parser.add_argument("--crop", default=[769, 769], type=int, nargs=2)
+    parser.add_argument("--scales", default=[0.75, 1.0], type=float, nargs="+")
+    parser.add_argument("--flip", action="store_true")
+    parser.add_argument("--tile_batch", default=8, type=int)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
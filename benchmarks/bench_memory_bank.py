@@ -0,0 +1,124 @@
+"""
+MemoryBank.enqueue (一次写入) 与 dequeue_and_enqueue_self_seri (逐行写入, 每行一次 int(ptr) 同步) 的一致性校验与耗时对比,
+以及按类别分区队列在不同淘汰策略下的入队耗时.
+
+    python -m benchmarks.bench_memory_bank --device cuda --memory_size 1000
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from Models.memory_bank import MemoryBank, POLICIES
+from train_utils.loss_manage.aspp_loss import dequeue_and_enqueue_self_seri
+from benchmarks.common import timeit
+
+
+def make_inputs(num_rows, n_view, dim, num_classes, device):
+    feats = torch.randn(num_rows, n_view, dim, device=device)
+    labels = torch.randint(0, num_classes, (num_rows,), device=device).float()
+    return feats, labels
+
+
+def check(args, bank, steps, device):
+    queue = bank.feature.clone()
+    queue_ptr = bank.ptr.clone()
+    queue_label = bank.label.clone()
+    for num_rows, n_view in steps:
+        feats, labels = make_inputs(num_rows, n_view, args.project_dim, args.num_classes, device)
+        dequeue_and_enqueue_self_seri(args, feats, feats, labels, queue, queue_ptr, queue_label)
+        bank.enqueue(feats, labels)
+    return (torch.allclose(queue, bank.feature, atol=1e-6) and torch.equal(queue_ptr, bank.ptr)
+            and torch.equal(queue_label, bank.label))
+
+
+def per_class_fifo_loop(feature, label, valid, ptr, feats, labels):
+    # 按类别分区 fifo 的逐个写入参考实现
+    size = feature.shape[1]
+    for i in range(feats.shape[0]):
+        c = int(labels[i])
+        if c < 0 or c >= feature.shape[0]:
+            continue
+        p = int(ptr[c])
+        feature[c, p] = F.normalize(feats[i, 0], p=2, dim=0)
+        label[c, p] = c
+        valid[c, p] = True
+        ptr[c] = (p + 1) % size
+
+
+def check_per_class(args, device):
+    size = max(args.memory_size // args.num_classes, 1)
+    bank = MemoryBank(size, args.project_dim, args.num_classes).to(device)
+    feature, label, valid, ptr = bank.feature.clone(), bank.label.clone(), bank.valid.clone(), bank.ptr.clone()
+    for num_rows in [args.num_rows, 3 * size * args.num_classes, 5]:
+        feats, labels = make_inputs(num_rows, 1, args.project_dim, args.num_classes, device)
+        # 255 (ignore) 与 -1 (多卡 all_gather 补齐的行) 不入队, -1 夹在类别 >= 1 的行之间
+        labels[0] = 255
+        labels[1::3] = -1
+        per_class_fifo_loop(feature, label, valid, ptr, feats, labels)
+        bank.enqueue(feats, labels)
+    return (torch.allclose(feature, bank.feature, atol=1e-6) and torch.equal(label, bank.label)
+            and torch.equal(valid, bank.valid) and torch.equal(ptr, bank.ptr))
+
+
+def check_reservoir_count(args, device):
+    # 按类别分区 reservoir: seen 只统计合法类别的特征, 队列写满之前依次写入前 seen 个位置
+    size = max(args.memory_size // args.num_classes, 1)
+    bank = MemoryBank(size, args.project_dim, args.num_classes, policy="reservoir").to(device)
+    seen = torch.zeros(args.num_classes, dtype=torch.long, device=device)
+    ok = True
+    for num_rows in [5, args.num_rows, 3 * size * args.num_classes]:
+        feats, labels = make_inputs(num_rows, 1, args.project_dim, args.num_classes, device)
+        labels[0] = 255
+        labels[1::3] = -1
+        keep = (labels >= 0) & (labels < args.num_classes)
+        seen += torch.bincount(labels[keep].long(), minlength=args.num_classes)
+        bank.enqueue(feats, labels)
+        filled = seen.clamp(max=size)
+        prefix = torch.arange(size, device=device).view(1, -1) < filled.view(-1, 1)
+        ok = ok and torch.equal(bank.seen, seen) and torch.equal(bank.valid, prefix)
+    return ok
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+
+    # 覆盖不回绕、回绕、单步写入超过队列长度等情况
+    steps = [(args.num_rows, 1)] * 5 + [(args.memory_size + 7, 1), (3, 4), (args.num_rows, 2)]
+    bank = MemoryBank(args.memory_size, args.project_dim).to(device)
+    same = check(args, bank, steps, device)
+
+    print("device: {}  memory_size: {}  dim: {}  equal: {}".format(device, args.memory_size, args.project_dim, same))
+    print("{:<10}{:>12}{:>12}{:>10}".format("rows", "loop(ms)", "bank(ms)", "speedup"))
+    for num_rows in args.rows:
+        feats, labels = make_inputs(num_rows, 1, args.project_dim, args.num_classes, device)
+        queue, queue_ptr, queue_label = bank.feature.clone(), bank.ptr.clone(), bank.label.clone()
+        t_loop = timeit(lambda: dequeue_and_enqueue_self_seri(args, feats, feats, labels, queue, queue_ptr, queue_label),
+                        device, args.repeat)
+        t_bank = timeit(lambda: bank.enqueue(feats, labels), device, args.repeat)
+        print("{:<10}{:>12.3f}{:>12.3f}{:>9.1f}x".format(num_rows, t_loop, t_bank, t_loop / t_bank))
+
+    # 按类别分区: 每个类别 memory_size // num_classes 个位置, 总容量与单队列相同
+    size = max(args.memory_size // args.num_classes, 1)
+    print("per-class fifo equal: {}".format(check_per_class(args, device)))
+    print("per-class reservoir count: {}".format(check_reservoir_count(args, device)))
+    print("{:<12}{:>12}".format("policy", "enqueue(ms)"))
+    feats, labels = make_inputs(args.num_rows, 1, args.project_dim, args.num_classes, device)
+    for policy in POLICIES:
+        bank = MemoryBank(size, args.project_dim, args.num_classes, policy=policy).to(device)
+        print("{:<12}{:>12.3f}".format(policy, timeit(lambda: bank.enqueue(feats, labels), device, args.repeat)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--memory_size", default=1000, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--num_rows", default=150, type=int, help="sampled class features per step")
+    parser.add_argument("--rows", default=[32, 150, 600], type=int, nargs="+")
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
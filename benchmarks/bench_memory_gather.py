@@ -0,0 +1,102 @@
+"""
+多卡队列入队: 每个 rank 只写入自己的采样特征 (per-rank) 与先 all_gather 再写入 (gather) 的耗时对比,
+并检查 gather 之后各 rank 的 MemoryBank 是否一致; --per_class 时再与逐个写入的参考实现比较
+(各 rank 补齐的 label -1 行夹在其他 rank 的类别之间, 入队时应被跳过).
+
+    torchrun --nproc_per_node 2 -m benchmarks.bench_memory_gather --batch_size 8
+"""
+import argparse
+import os
+
+import torch
+import torch.distributed as dist
+
+from Models.memory_bank import MemoryBank
+from train_utils.distributed_utils import all_gather_queue_samples, get_rank, get_world_size
+from benchmarks.common import timeit
+from benchmarks.bench_memory_bank import per_class_fifo_loop
+
+
+def make_inputs(args, device):
+    # Sampling 每张图每个出现的类别输出一行, 各 rank 行数不同
+    num_rows = torch.randint(args.batch_size, args.batch_size * args.num_classes // 2 + 1, (1,)).item()
+    feats = torch.randn(num_rows, 1, args.project_dim, device=device)
+    labels = torch.randint(0, args.num_classes, (num_rows,), device=device).float()
+    return feats, labels
+
+
+def same_across_ranks(bank):
+    state = torch.cat([bank.feature.flatten(), bank.label.flatten(), bank.valid.flatten().float()])
+    out = [torch.empty_like(state) for _ in range(get_world_size())]
+    dist.all_gather(out, state)
+    return all(torch.equal(out[0], x) for x in out[1:])
+
+
+def main(args):
+    if "RANK" not in os.environ:
+        raise RuntimeError("launch with torchrun, e.g. torchrun --nproc_per_node 2 -m benchmarks.bench_memory_gather")
+    backend = "nccl" if torch.cuda.is_available() and args.device == "cuda" else "gloo"
+    if backend == "nccl":
+        torch.cuda.set_device(int(os.environ["LOCAL_RANK"]))
+        device = torch.device("cuda")
+    else:
+        device = torch.device("cpu")
+    dist.init_process_group(backend=backend)
+    torch.manual_seed(args.seed + get_rank())
+
+    max_rows = args.batch_size * args.num_classes
+    num_classes = args.num_classes if args.per_class else 1
+    feats, labels = make_inputs(args, device)
+
+    local = MemoryBank(args.memory_size, args.project_dim, num_classes).to(device)
+    glob = MemoryBank(args.memory_size, args.project_dim, num_classes).to(device)
+    # 各 rank 初始队列相同
+    for bank in (local, glob):
+        dist.broadcast(bank.feature, 0)
+
+    def gather_enqueue():
+        glob.enqueue(*all_gather_queue_samples(feats, labels, max_rows, args.project_dim))
+
+    t_local = timeit(lambda: local.enqueue(feats, labels), device, args.repeat)
+    t_gather_only = timeit(lambda: all_gather_queue_samples(feats, labels, max_rows, args.project_dim), device, args.repeat)
+    t_gather = timeit(gather_enqueue, device, args.repeat)
+    local_same = same_across_ranks(local)
+    glob_same = same_across_ranks(glob)
+
+    loop_same = None
+    if args.per_class:
+        bank = MemoryBank(args.memory_size, args.project_dim, num_classes).to(device)
+        dist.broadcast(bank.feature, 0)
+        feature, label, valid, ptr = bank.feature.clone(), bank.label.clone(), bank.valid.clone(), bank.ptr.clone()
+        gathered_feats, gathered_labels = all_gather_queue_samples(feats, labels, max_rows, args.project_dim)
+        per_class_fifo_loop(feature, label, valid, ptr, gathered_feats, gathered_labels)
+        bank.enqueue(gathered_feats, gathered_labels)
+        loop_same = (torch.allclose(feature, bank.feature, atol=1e-6) and torch.equal(label, bank.label)
+                     and torch.equal(valid, bank.valid) and torch.equal(ptr, bank.ptr))
+
+    if get_rank() == 0:
+        payload = max_rows * (args.project_dim + 1) * 4 * get_world_size() / 2 ** 10
+        print("backend: {}  world_size: {}  max_rows/rank: {}  payload: {:.1f} KB".format(
+            backend, get_world_size(), max_rows, payload))
+        print("{:<22}{:>12}{:>16}".format("mode", "step(ms)", "banks in sync"))
+        print("{:<22}{:>12.3f}{:>16}".format("per-rank", t_local, str(local_same)))
+        print("{:<22}{:>12.3f}{:>16}".format("gather + enqueue", t_gather, str(glob_same)))
+        print("{:<22}{:>12.3f}".format("all_gather only", t_gather_only))
+        if loop_same is not None:
+            print("per-class gather + enqueue equal to loop: {}".format(loop_same))
+    dist.barrier()
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--batch_size", default=8, type=int, help="images per rank")
+    parser.add_argument("--memory_size", default=1000, type=int)
+    parser.add_argument("--per_class", action="store_true")
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,198 @@
+"""
+模型注册表中各模型的推理延迟 / 训练 step 耗时 / 显存 / 参数量 / 计算量对比表, 用于按延迟预算挑选部署模型.
+
+每个模型按 create_model 的参数构建 (不加载预训练权重), 在 VOC (513x513) 与 Cityscapes (1024x512) 训练裁剪尺寸上测:
+    eval      model.eval() 下 model(x, is_eval=True) 的前向延迟 (forward 没有 is_eval 时不传)
+    train     前向 + criterion (包括对比损失路径与 MemoryBank 入队) + backward + SGD step
+    peak      以上两项各自的显存峰值 (只在 cuda 上统计)
+    GMACs     eval 前向中 Conv2d / Linear 的乘加次数
+结果写到 {out}.csv 与 {out}.md.
+
+    python -m benchmarks.bench_models --device cuda --out model_table
+    python -m benchmarks.bench_models --device cpu --models mep_resnet50 mep_res_50 --presets voc --repeat 3
+"""
+import argparse
+import inspect
+
+import torch
+
+from Models.model_build import create_model
+from Models.memory_bank import use_memory_bank
+from train_utils.loss_manage import criterion
+from benchmarks.common import measure, model_args, peak_memory
+
+# 模型名 -> 训练时使用的 loss_name 等参数; mep_res 的对比特征为 256 维, MemoryBank 的维度要与之相同
+MODELS = {
+    "fcn_resnet50": {"loss_name": "intra"},
+    "dcnet_resnet50": {"loss_name": "double"},
+    "dcnet_resnet101": {"loss_name": "double"},
+    "deeplabv3_resnet50": {"loss_name": "intra"},
+    "deeplabv3_resnet101": {"loss_name": "intra"},
+    "deeplabv3_mobilenetv3_large": {"loss_name": "intra"},
+    "aspp_contrast_resnet50": {"loss_name": "aspp_loss"},
+    "aspp_contrast_resnet101": {"loss_name": "aspp_loss"},
+    "mep_resnet50": {"loss_name": "aspp_loss"},
+    "mep_resnet101": {"loss_name": "aspp_loss"},
+    "mep_res_50": {"loss_name": "aspp_loss", "project_dim": 256},
+    "mep_res_101": {"loss_name": "aspp_loss", "project_dim": 256},
+    "mep_sk_50": {"loss_name": "aspp_loss"},
+    "mep_sk_101": {"loss_name": "aspp_loss"},
+}
+# (height, width, num_classes), 与 dataset_build 中的训练裁剪尺寸相同
+PRESETS = {"voc": (513, 513, 21), "cityscapes": (1024, 512, 19)}
+COLUMNS = ["model", "dataset", "input", "params_M", "GMACs", "eval_ms", "eval_peak_MB", "train_ms", "train_peak_MB"]
+
+
+def count_macs(model, image, forward_kwargs):
+    # 只统计 Conv2d / Linear, 其余算子 (BN / 插值 / 激活) 的计算量可以忽略
+    macs = [0]
+
+    def conv_hook(m, x, y):
+        macs[0] += y.numel() * (m.in_channels // m.groups) * m.kernel_size[0] * m.kernel_size[1]
+
+    def linear_hook(m, x, y):
+        macs[0] += y.numel() * m.in_features
+
+    handles = []
+    for m in model.modules():
+        if isinstance(m, torch.nn.Conv2d):
+            handles.append(m.register_forward_hook(conv_hook))
+        elif isinstance(m, torch.nn.Linear):
+            handles.append(m.register_forward_hook(linear_hook))
+    with torch.no_grad():
+        model(image, **forward_kwargs)
+    for handle in handles:
+        handle.remove()
+    return macs[0]
+
+
+def train_step_fn(args, model, optimizer, image, target, amp):
+    # 与 train_one_epoch 相同: 每层的对比损失从 output 末尾取到对应的 MemoryBank
+    takes_target = "target" in inspect.signature(model.forward).parameters
+
+    def step():
+        with torch.cuda.amp.autocast(enabled=amp):
+            output = model(image, target) if takes_target else model(image)
+            if use_memory_bank(args):
+                for level in ["L3", "L2", "L1"]:
+                    bank = getattr(model, "bank" + level[1], None)
+                    if level in output and bank is not None:
+                        output[level].append(bank)
+            loss = criterion(args, output, target, args.contrast)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    return step
+
+
+def bench_model(args, name, preset, device):
+    height, width, num_classes = PRESETS[preset]
+    config = dict(project_dim=args.project_dim)
+    config.update(MODELS[name])
+    margs = model_args(model_name=name, num_classes=num_classes, contrast=0, L3_loss=0.1, L2_loss=0.1, L1_loss=0.1,
+                       memory_size=args.memory_size, epochs=30, sample="self_pace3", **config)
+    model = create_model(margs).to(device)
+    row = {"model": name, "dataset": preset, "input": "{}x{}".format(height, width),
+           "params_M": sum(p.numel() for p in model.parameters()) / 1e6}
+    amp = args.amp and device.type == "cuda"
+
+    # eval
+    model.eval()
+    forward_kwargs = {"is_eval": True} if "is_eval" in inspect.signature(model.forward).parameters else {}
+    image = torch.randn(args.batch_size, 3, height, width, device=device)
+    row["GMACs"] = count_macs(model, image, forward_kwargs) / 1e9 / args.batch_size
+
+    def forward():
+        with torch.no_grad(), torch.cuda.amp.autocast(enabled=amp):
+            model(image, **forward_kwargs)
+    row["eval_ms"] = measure(forward, device, args.repeat, args.warmup)["median_ms"]
+    row["eval_peak_MB"] = peak_memory(forward, device)
+    del image
+
+    # train
+    model.train()
+    optimizer = torch.optim.SGD([p for p in model.parameters() if p.requires_grad], lr=1e-4, momentum=0.9)
+    image = torch.randn(args.train_batch_size, 3, height, width, device=device)
+    # 块状标注, 保证对比损失的每个类别都能采到像素
+    target = torch.randint(0, num_classes, (args.train_batch_size, 1, height // 32 + 1, width // 32 + 1), device=device)
+    target = torch.nn.functional.interpolate(target.float(), size=(height, width), mode="nearest").squeeze(1).long()
+    step = train_step_fn(margs, model, optimizer, image, target, amp)
+    torch.manual_seed(args.seed)
+    row["train_ms"] = measure(step, device, args.repeat, args.warmup)["median_ms"]
+    row["train_peak_MB"] = peak_memory(step, device)
+    return row
+
+
+def fmt(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.1f}".format(value) if value >= 10 else "{:.2f}".format(value)
+    return str(value)
+
+
+def write_tables(rows, out, header):
+    with open(out + ".csv", "w") as f:
+        f.write(",".join(COLUMNS + ["error"]) + "\n")
+        for row in rows:
+            f.write(",".join([fmt(row.get(c)) for c in COLUMNS] + [row.get("error", "").replace(",", ";")]) + "\n")
+    with open(out + ".md", "w") as f:
+        f.write(header + "\n\n")
+        f.write("| " + " | ".join(COLUMNS) + " |\n")
+        f.write("|" + "---|" * len(COLUMNS) + "\n")
+        for row in rows:
+            if "error" in row:
+                f.write("| {} | {} | {} | error: {} |\n".format(row["model"], row["dataset"], row["input"], row["error"]))
+            else:
+                f.write("| " + " | ".join(fmt(row.get(c)) for c in COLUMNS) + " |\n")
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    header = "device: {}  eval batch: {}  train batch: {}  memory_size: {}  amp: {}  torch: {}".format(
+        device if device.type == "cpu" else torch.cuda.get_device_name(device), args.batch_size,
+        args.train_batch_size, args.memory_size, args.amp and device.type == "cuda", torch.__version__)
+    print(header)
+    print("{:<28}{:>12}{:>10}{:>10}{:>10}{:>12}{:>10}{:>12}".format(
+        "model", "dataset", "params(M)", "GMACs", "eval(ms)", "peak(MB)", "train(ms)", "peak(MB)"))
+
+    rows = []
+    for preset in args.presets:
+        for name in args.models:
+            torch.manual_seed(args.seed)
+            try:
+                row = bench_model(args, name, preset, device)
+            except Exception as e:
+                # 显存不足等: 记录错误, 继续测其它模型
+                row = {"model": name, "dataset": preset, "input": "{}x{}".format(*PRESETS[preset][:2]), "error": repr(e)}
+                print("{:<28}{:>12}  error: {!r}".format(name, preset, e))
+            else:
+                print("{:<28}{:>12}{:>10}{:>10}{:>10}{:>12}{:>10}{:>12}".format(
+                    name, preset, fmt(row["params_M"]), fmt(row["GMACs"]), fmt(row["eval_ms"]),
+                    fmt(row["eval_peak_MB"]), fmt(row["train_ms"]), fmt(row["train_peak_MB"])))
+            rows.append(row)
+            if device.type == "cuda":
+                torch.cuda.empty_cache()
+
+    if args.out:
+        write_tables(rows, args.out, header)
+        print("tables saved to {0}.csv / {0}.md".format(args.out))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--models", default=list(MODELS), nargs="+", choices=list(MODELS))
+    parser.add_argument("--presets", default=list(PRESETS), nargs="+", choices=list(PRESETS))
+    parser.add_argument("--batch_size", default=1, type=int, help="eval batch size")
+    parser.add_argument("--train_batch_size", default=2, type=int)
+    parser.add_argument("--memory_size", default=1000, type=int, help="queue length of the contrastive memory banks")
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--amp", action="store_true", help="autocast on cuda")
+    parser.add_argument("--out", default="model_table", help="write {out}.csv and {out}.md, empty = print only")
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--warmup", default=2, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
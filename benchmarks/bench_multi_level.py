@@ -0,0 +1,96 @@
+"""
+mep 系列模型的多层对比损失: 逐层 (每层各自采样 / 对比 / 入队) 与 --multi_level (一次采样、批量对比、一次入队) 的对比.
+两种方式从相同的 MemoryBank 状态出发连续训练若干步, 校验每步的总损失、特征梯度以及队列状态一致,
+再比较 criterion 前向 + 反向的耗时. 默认的 self_pace3 等确定性采样结果完全相同;
+随机保留像素的采样方式 (self_pace_epochs 等) 多层共用一次随机抽样, 只在分布上与逐层抽样相同.
+
+    python -m benchmarks.bench_multi_level --device cuda --batch_size 8 --size 65 --memory_size 2000
+"""
+import argparse
+import copy
+
+import torch
+import torch.nn.functional as F
+
+from Models.memory_bank import MemoryBank, use_memory_bank
+from train_utils.loss_manage.loss_build import criterion
+from benchmarks.common import timeit, synthetic_labels, synthetic_feats
+
+
+def make_args(args, multi_level):
+    return argparse.Namespace(contrast=0, loss_name="aspp_loss", epochs=30, sample=args.sample,
+                              L1_loss=0.1, L2_loss=0.1, L3_loss=0.1, memory_size=args.memory_size,
+                              num_classes=args.num_classes, memory_gather=False, contrast_chunk=args.chunk,
+                              multi_level=multi_level)
+
+
+def make_step(args, device):
+    h = w = args.size
+    labels, predict = synthetic_labels(args.batch_size, h, w, args.num_classes, device)
+    logits = F.one_hot(predict, args.num_classes).permute(0, 3, 1, 2).float()
+    feats = [synthetic_feats(args.batch_size, h, w, args.project_dim, device) for _ in range(3)]
+    return labels, logits, feats
+
+
+def run(train_args, step, banks):
+    labels, logits, feats = step
+    feats = [f.clone().requires_grad_(True) for f in feats]
+    inputs = {"out": logits, "logits": logits,
+              "L1": [feats[0], feats[1]], "L2": [feats[1], feats[2]], "L3": [feats[2], feats[0]]}
+    if use_memory_bank(train_args):
+        for name, bank in zip(["L1", "L2", "L3"], banks):
+            inputs[name].append(bank)
+    loss = criterion(train_args, inputs, labels, epoch=10)
+    loss.backward()
+    return loss.detach(), [f.grad for f in feats]
+
+
+def same_banks(a, b):
+    return all(torch.allclose(x.feature, y.feature, atol=1e-6) and torch.equal(x.label, y.label)
+               and torch.equal(x.valid, y.valid) and torch.equal(x.ptr, y.ptr) for x, y in zip(a, b))
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+
+    banks = [MemoryBank(args.memory_size, args.project_dim).to(device) for _ in range(3)]
+    ref_banks, new_banks = copy.deepcopy(banks), copy.deepcopy(banks)
+    ref_args, new_args = make_args(args, False), make_args(args, True)
+
+    # 多步训练, 覆盖队列未写满 (valid mask) 与写满之后的情况
+    loss_err, grad_err = 0.0, 0.0
+    for _ in range(args.steps):
+        step = make_step(args, device)
+        ref_loss, ref_grad = run(ref_args, step, ref_banks)
+        new_loss, new_grad = run(new_args, step, new_banks)
+        loss_err = max(loss_err, (ref_loss - new_loss).abs().item() / max(ref_loss.abs().item(), 1e-12))
+        grad_err = max(grad_err, max(((a - b).abs().max() / a.abs().max().clamp(min=1e-12)).item()
+                                     for a, b in zip(ref_grad, new_grad)))
+    print("device: {}  batch: {}  size: {}  memory_size: {}  sample: {}".format(
+        device, args.batch_size, args.size, args.memory_size, args.sample))
+    print("{} steps: max loss rel err {:.2e}  max grad rel err {:.2e}  banks equal: {}".format(
+        args.steps, loss_err, grad_err, same_banks(ref_banks, new_banks)))
+
+    step = make_step(args, device)
+    t_ref = timeit(lambda: run(ref_args, step, ref_banks), device, args.repeat)
+    t_new = timeit(lambda: run(new_args, step, new_banks), device, args.repeat)
+    print("{:<14}{:>14}{:>10}".format("per level(ms)", "multi level(ms)", "speedup"))
+    print("{:<14.2f}{:>14.2f}{:>9.2f}x".format(t_ref, t_new, t_ref / t_new))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--size", default=65, type=int, help="feature map size (stride 8)")
+    parser.add_argument("--num_classes", default=19, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--memory_size", default=2000, type=int)
+    parser.add_argument("--sample", default="self_pace3", type=str)
+    parser.add_argument("--chunk", default=0, type=int, help="contrast_chunk")
+    parser.add_argument("--steps", default=20, type=int)
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
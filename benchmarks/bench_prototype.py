@@ -0,0 +1,83 @@
+"""
+对比损失的负样本来源: 特征队列 (MemoryBank, memory_size 1k ~ 64k) 与 EMA 类别原型 (PrototypeBank, 每类 K 个原型)
+在 aspp_loss / double (EPOCHSELFPACEDoublePixelContrastLoss) 下一个 step (采样 + 对比 + 反向 + 入队) 的耗时、
+峰值显存 (仅 cuda) 以及队列/原型缓冲区本身的大小.
+
+    python -m benchmarks.bench_prototype --device cuda --batch_size 8 --size 65
+"""
+import argparse
+
+import torch
+
+from Models.memory_bank import MemoryBank, PrototypeBank
+from train_utils.loss_manage.aspp_loss import ASPP_CONTRAST_Loss
+from train_utils.loss_manage.double_contrastive_selfpace_epoch_loss import EPOCHSELFPACEDoublePixelContrastLoss
+from benchmarks.common import timeit, peak_memory, synthetic_labels, synthetic_feats
+
+
+def make_args(args):
+    return argparse.Namespace(memory_size=1, num_classes=args.num_classes, sample=args.sample,
+                              memory_gather=False, contrast_chunk=0)
+
+
+def buffer_mb(bank):
+    return sum(b.numel() * b.element_size() for b in bank.buffers()) / 2 ** 20
+
+
+def make_step(args, loss_name, bank, device):
+    h = w = args.size
+    labels, predict = synthetic_labels(args.batch_size, h, w, args.num_classes, device)
+    feats = synthetic_feats(args.batch_size, h, w, args.project_dim, device, requires_grad=True)
+    feats_y = synthetic_feats(args.batch_size, h, w, args.project_dim, device, requires_grad=True)
+    train_args = make_args(args)
+
+    def step():
+        feats.grad, feats_y.grad = None, None
+        if loss_name == "aspp_loss":
+            loss = ASPP_CONTRAST_Loss(train_args, 10, 30, [feats, feats_y, bank], labels, predict)
+        else:
+            x = [feats, feats_y, feats.detach(), feats_y.detach(), labels, bank]
+            loss = EPOCHSELFPACEDoublePixelContrastLoss(train_args, 10, 30, x, labels, predict)
+        if torch.is_tensor(loss) and loss.requires_grad:
+            loss.backward()
+    return step
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+
+    banks = [("queue {}".format(size), lambda size=size: MemoryBank(size, args.project_dim)) for size in args.queue_sizes]
+    banks += [("prototype K={}".format(k), lambda k=k: PrototypeBank(args.num_classes, args.project_dim, k))
+              for k in args.prototypes]
+
+    print("device: {}  batch: {}  size: {}  classes: {}  dim: {}".format(
+        device, args.batch_size, args.size, args.num_classes, args.project_dim))
+    print("{:<10}{:<16}{:>12}{:>12}{:>12}".format("loss", "negatives", "step(ms)", "peak(MB)", "buffer(MB)"))
+    for loss_name in args.losses:
+        for name, build in banks:
+            bank = build().to(device)
+            # 从写满的状态开始计时, 对比集合为全部 memory_size 个特征 / 全部原型
+            bank.valid.fill_(True)
+            step = make_step(args, loss_name, bank, device)
+            t = timeit(step, device, args.repeat)
+            mem = peak_memory(step, device)
+            print("{:<10}{:<16}{:>12.2f}{:>12}{:>12.2f}".format(loss_name, name, t, "-" if mem is None else "{:.1f}".format(mem),
+                                                               buffer_mb(bank)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--size", default=65, type=int, help="feature map size (stride 8)")
+    parser.add_argument("--num_classes", default=19, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--sample", default="self_pace3", type=str)
+    parser.add_argument("--losses", default=["aspp_loss", "double"], nargs="+")
+    parser.add_argument("--queue_sizes", default=[1000, 4000, 16000, 64000], type=int, nargs="+")
+    parser.add_argument("--prototypes", default=[1, 4], type=int, nargs="+")
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,74 @@
+"""
+多层对比损失的标注 / 预测准备: 原来每层各自把 out 双线性缩放到特征分辨率取 argmax、把 target 转 float 最近邻缩放,
+与 loss_manage.pyramid.LabelPyramid (每个 step 一次, 按分辨率缓存, 预测直接由 stride 8 的 logits 得到) 的对比.
+标注应完全一致; 预测由于不再经过 "上采样到原图再缩小", 个别边界像素的 argmax 可能不同, 打印一致的比例.
+
+    python -m benchmarks.bench_pyramid --device cuda --batch_size 8 --crop_size 513
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from train_utils.loss_manage.pyramid import LabelPyramid
+from benchmarks.common import timeit
+
+# 各模型 L1 / L2 / L3 特征的步长与 logits 的步长
+LEVELS = {"mep": ([8, 8, 8], 8), "dcnet": ([4, 8, 8], 4)}
+
+
+def per_level(target, out, sizes):
+    # 原来 criterion 与各个 loss 中的做法
+    result = []
+    for h, w in sizes:
+        pred = F.interpolate(input=out, size=(h, w), mode='bilinear', align_corners=False)
+        _, predict = torch.max(pred, 1)
+        labels = target.unsqueeze(1).float().clone()
+        labels = F.interpolate(labels, (h, w), mode='nearest')
+        labels = labels.squeeze(1).long()
+        result.append((labels, predict))
+    return result
+
+
+def pyramid(target, logits, sizes):
+    p = LabelPyramid(target, logits)
+    return [p(size) for size in sizes]
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+    size = args.crop_size
+    print("device: {}  batch: {}  crop: {}".format(device, args.batch_size, size))
+    print("{:<8}{:>14}{:>14}{:>10}{:>12}{:>14}".format("model", "per level(ms)", "pyramid(ms)", "speedup",
+                                                         "labels eq", "predict agree"))
+    for name, (strides, logit_stride) in LEVELS.items():
+        sizes = [((size - 1) // s + 1, (size - 1) // s + 1) for s in strides]
+        logit_size = (size - 1) // logit_stride + 1
+        # 块状 logits, 与真实分割头输出一样空间上平滑
+        logits = F.interpolate(torch.randn(args.batch_size, args.num_classes, logit_size // 4 + 1, logit_size // 4 + 1,
+                                           device=device), size=(logit_size, logit_size), mode='bilinear', align_corners=False)
+        out = F.interpolate(logits, size=(size, size), mode='bilinear', align_corners=False)
+        target = out.argmax(1)
+        target[torch.rand(target.shape, device=device) < 0.05] = 255
+
+        ref = per_level(target, out, sizes)
+        new = pyramid(target, logits, sizes)
+        labels_eq = all(torch.equal(a[0], b[0]) for a, b in zip(ref, new))
+        agree = sum((a[1] == b[1]).float().mean().item() for a, b in zip(ref, new)) / len(sizes)
+        t_ref = timeit(lambda: per_level(target, out, sizes), device, args.repeat)
+        t_new = timeit(lambda: pyramid(target, logits, sizes), device, args.repeat)
+        print("{:<8}{:>14.2f}{:>14.2f}{:>9.2f}x{:>12}{:>14.4f}".format(name, t_ref, t_new, t_ref / t_new,
+                                                                      str(labels_eq), agree))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--batch_size", default=8, type=int)
+    parser.add_argument("--crop_size", default=513, type=int)
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+MEPCover 结构重参数化 (3x3 空洞卷积 + BN 与 1x1 卷积 + BN 两路合成一个带 bias 的 3x3 空洞卷积) 的一致性校验与耗时对比:
+单个 MEPCover 以及整个模型 (mep_res_*, eval 前向).
+
+    python -m benchmarks.bench_reparam --device cuda --model_name mep_res_101 --size 513 513
+"""
+import argparse
+import copy
+
+import torch
+
+from Models import reparameterize
+from Models.mep_res import MEPCover
+from Models.model_build import create_model
+from benchmarks.common import timeit, model_args
+
+
+def randomize_bn(model):
+    # 随机初始化的 BN 统计量为 0 / 1, 折叠后看不出错误; 换成随机值
+    for m in model.modules():
+        if isinstance(m, torch.nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5, 0.5)
+            m.running_var.uniform_(0.5, 2.0)
+            m.weight.data.uniform_(0.5, 1.5)
+            m.bias.data.uniform_(-0.5, 0.5)
+    return model
+
+
+def compare(model, x, **kwargs):
+    model.eval()
+    deployed = reparameterize(copy.deepcopy(model))
+    with torch.no_grad():
+        ref = model(x, **kwargs)
+        out = deployed(x, **kwargs)
+    if isinstance(ref, dict):
+        ref, out = ref["out"], out["out"]
+    err = ((ref - out).abs().max() / ref.abs().max()).item()
+    return deployed, err
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+    height, width = args.size
+    print("device: {}  input: {}x{}".format(device, height, width))
+
+    # layer4 输出 (output stride 8) 上的单个 MEPCover
+    feat = torch.randn(args.batch_size, 2048, (height + 7) // 8, (width + 7) // 8, device=device)
+    print("{:<20}{:>12}{:>14}{:>14}{:>10}".format("module", "max rel err", "original(ms)", "deploy(ms)", "speedup"))
+    for rate in [12, 24, 36]:
+        cover = randomize_bn(MEPCover(2048, 512, rate)).to(device)
+        deployed, err = compare(cover, feat)
+        with torch.no_grad():
+            t_ref = timeit(lambda: cover(feat), device, args.repeat)
+            t_dep = timeit(lambda: deployed(feat), device, args.repeat)
+        print("{:<20}{:>12.2e}{:>14.2f}{:>14.2f}{:>9.2f}x".format("MEPCover rate={}".format(rate), err, t_ref, t_dep, t_ref / t_dep))
+
+    margs = model_args(model_name=args.model_name, num_classes=args.num_classes, loss_name="aspp_loss", contrast=0,
+                       L3_loss=0.1, L2_loss=0.1, L1_loss=0.1, project_dim=256)
+    model = randomize_bn(create_model(margs)).to(device)
+    image = torch.randn(args.batch_size, 3, height, width, device=device)
+    deployed, err = compare(model, image, is_eval=True)
+    same = torch.equal(model(image, is_eval=True)["out"].argmax(1), deployed(image, is_eval=True)["out"].argmax(1))
+    with torch.no_grad():
+        t_ref = timeit(lambda: model(image, is_eval=True), device, args.repeat)
+        t_dep = timeit(lambda: deployed(image, is_eval=True), device, args.repeat)
+    print("{:<20}{:>12.2e}{:>14.2f}{:>14.2f}{:>9.2f}x".format(args.model_name, err, t_ref, t_dep, t_ref / t_dep))
+    print("argmax equal: {}".format(same))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--model_name", default="mep_res_50", help="mep_res_50 mep_res_101")
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--size", default=[513, 513], type=int, nargs=2)
+    parser.add_argument("--batch_size", default=1, type=int)
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+"""
+SamplesModel.Sampling (向量化) 与 Sampling_loop (逐图像/逐类别循环) 的一致性校验与耗时对比.
+
+    python -m benchmarks.bench_sampling --device cuda --batch_size 16
+"""
+import argparse
+
+import torch
+
+from train_utils.loss_manage.SamplesModel import Sampling, Sampling_loop
+from benchmarks.common import timeit, synthetic_labels, synthetic_feats
+
+STRATEGIES = ["self_pace3", "self_pace_epochs", "self_pace_step", "self_pace_ploy",
+              "adapt_excite_2", "weight_ade_8", "label_ave", "only_esay", "pred_ave"]
+
+
+def make_inputs(args, device):
+    h = w = args.crop_size // args.network_stride
+    labels, predict = synthetic_labels(args.batch_size, h, w, args.num_classes, device)
+    feats = synthetic_feats(args.batch_size, h, w, args.project_dim, device)
+    feats_y = synthetic_feats(args.batch_size, h, w, args.project_dim, device)
+
+    feats = feats.permute(0, 2, 3, 1).contiguous().view(args.batch_size, -1, args.project_dim)
+    feats_y = feats_y.permute(0, 2, 3, 1).contiguous().view(args.batch_size, -1, args.project_dim)
+    return feats, feats_y, labels.view(args.batch_size, -1), predict.view(args.batch_size, -1)
+
+
+def check(type, epoch, epochs, inputs, seed):
+    torch.manual_seed(seed)
+    ref = Sampling_loop(type, epoch, epochs, *inputs)
+    ref_rng = torch.randint(0, 1 << 30, (4,))
+    torch.manual_seed(seed)
+    out = Sampling(type, epoch, epochs, *inputs)
+    out_rng = torch.randint(0, 1 << 30, (4,))
+
+    # 结果以及之后的随机数序列都应一致
+    same = torch.equal(ref_rng, out_rng)
+    for a, b in zip(ref[:3], out[:3]):
+        same = same and torch.allclose(a, b, atol=1e-5)
+    return same
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+    inputs = make_inputs(args, device)
+
+    print("device: {}  batch: {}  pixels/img: {}  dim: {}".format(device, args.batch_size, inputs[0].shape[1], args.project_dim))
+    print("{:<18}{:>8}{:>12}{:>12}{:>10}".format("type", "equal", "loop(ms)", "vec(ms)", "speedup"))
+    for type in STRATEGIES:
+        same = all(check(type, epoch, args.epochs, inputs, args.seed) for epoch in (0, args.epochs // 2, args.epochs - 1))
+        epoch = args.epochs // 2
+        t_loop = timeit(lambda: Sampling_loop(type, epoch, args.epochs, *inputs), device, args.repeat)
+        t_vec = timeit(lambda: Sampling(type, epoch, args.epochs, *inputs), device, args.repeat)
+        print("{:<18}{:>8}{:>12.2f}{:>12.2f}{:>9.1f}x".format(type, str(same), t_loop, t_vec, t_loop / t_vec))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--batch_size", default=16, type=int)
+    parser.add_argument("--crop_size", default=513, type=int)
+    parser.add_argument("--network_stride", default=8, type=int)
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--epochs", default=30, type=int)
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,134 @@
+"""
+SamplesModel.view_sampling (一次排序的固定视角采样) 与 view_sampling_loop (逐类别 nonzero + randperm) 的校验与耗时对比.
+两者的随机数不同, 逐行比较: 锚点的类别、n_view、每行选中的难/易像素个数一致, 选中的像素属于该 (图像, 类别) 且互不重复.
+另外检查退化情况 (没有锚点 / 选中像素不足 n_view) 返回固定形状的结果与 valid mask,
+以及 Self_pace3 / Self_pace2 不足 n_view 的行不再包含补 0 的特征 (对比损失与原实现不同).
+
+    python -m benchmarks.bench_view_sampling --device cuda --batch_size 16
+"""
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+from train_utils.loss_manage.SamplesModel import (view_sampling, view_sampling_loop, compact_views, balanced_keep,
+                                                  proportion_keep, self_pace3_view_keep, self_pace2_view_keep, hard_keep)
+from train_utils.loss_manage.double_contrastive_selfpace_epoch_loss import (Self_pace3_sampling, Self_pace2_sampling,
+                                                                            Contrastive)
+from benchmarks.common import timeit, synthetic_labels
+
+RULES = {"balanced": (balanced_keep, True), "proportion": (proportion_keep, True),
+         "self_pace3_easy": (self_pace3_view_keep(0, 30), True), "self_pace3_hard": (self_pace3_view_keep(29, 30), True),
+         "random": (hard_keep, False)}
+
+
+def index_feats(batch_size, num_pixel, dim, device):
+    # 第 0 维特征记录像素编号, 用于从采样结果反查像素
+    feats = torch.randn(batch_size, num_pixel, dim, device=device)
+    feats[..., 0] = torch.arange(batch_size * num_pixel, device=device, dtype=torch.float).view(batch_size, num_pixel)
+    return feats
+
+
+def summary(out, labels, predict, split):
+    X_, _, y_, valid = out
+    if valid is None:
+        valid = torch.ones(X_.shape[:2], dtype=torch.bool, device=X_.device)
+    index = X_[..., 0].long()
+    flat_labels, flat_predict = labels.view(-1), predict.view(-1)
+    ok = True
+    rows = []
+    for i in range(X_.shape[0]):
+        idx = index[i][valid[i]]
+        ok = ok and idx.unique().numel() == idx.numel() and bool((flat_labels[idx] == y_[i].long()).all())
+        easy = int((flat_predict[idx] == flat_labels[idx]).sum()) if split else 0
+        rows.append((int(y_[i]), idx.numel() - easy, easy))
+    return ok, X_.shape[1], rows
+
+
+def check(keep, split, feats, labels, predict):
+    ref = view_sampling_loop(feats, feats, labels, predict, keep, split=split)
+    out = view_sampling(feats, feats, labels, predict, keep, split=split)
+    ok_ref, n_ref, rows_ref = summary(ref, labels, predict, split)
+    ok_out, n_out, rows_out = summary(out, labels, predict, split)
+    return ok_ref and ok_out and n_ref == n_out and rows_ref == rows_out
+
+
+def check_partial_rows(feats, labels, predict, seed):
+    """
+    Self_pace3_sampling / Self_pace2_sampling 在选中像素不足 n_view 时 (只取易样本或只取难样本的阶段) 的行为:
+    原实现在这些行补 0 特征并参与对比, 现在 compact_views 去掉补的 0, 只保留选中的像素.
+    固定随机种子与 view_sampling 比较: 输出是 valid 位置展开的 [M, 1, D], 没有全 0 的特征,
+    对比损失与补 0 的 [N, n_view, D] (原实现) 的结果不同.
+    """
+    feats_y = F.normalize(feats + 0.1 * torch.randn_like(feats), p=2, dim=-1)
+    results = {}
+    for name, sampling, keep in [("self_pace3", Self_pace3_sampling, self_pace3_view_keep(0, 30)),
+                                 ("self_pace2", Self_pace2_sampling, self_pace2_view_keep(0, 30))]:
+        torch.manual_seed(seed)
+        X_, Y_, y_, valid = view_sampling(feats, feats_y, labels, predict, keep)
+        torch.manual_seed(seed)
+        out = sampling(0, 30, feats, feats_y, labels, predict)
+        X_c, Y_c, y_c = out[:3]
+        assert valid is not None and not bool(valid.all()), "no partial rows in the check input"
+
+        expected = compact_views(X_, Y_, y_, valid)
+        assert X_c.shape == (int(valid.sum()), 1, feats.shape[-1])
+        assert all(torch.equal(a, b) for a, b in zip((X_c, Y_c, y_c), expected))
+        assert bool((X_c.abs().sum(-1) > 0).all())
+
+        padded = Contrastive(X_, Y_, y_)
+        compact = Contrastive(X_c, Y_c, y_c)
+        assert not torch.allclose(padded, compact), "partial rows should no longer include the zero padding"
+        results[name] = (tuple(X_.shape), int(valid.sum()), padded.item(), compact.item())
+    return results
+
+
+def main(args):
+    device = torch.device(args.device if torch.cuda.is_available() or args.device == "cpu" else "cpu")
+    torch.manual_seed(args.seed)
+    h = w = args.crop_size // args.network_stride
+    labels, predict = synthetic_labels(args.batch_size, h, w, args.num_classes, device)
+    labels, predict = labels.view(args.batch_size, -1), predict.view(args.batch_size, -1)
+    feats = index_feats(args.batch_size, h * w, args.project_dim, device)
+
+    print("device: {}  batch: {}  pixels: {}  classes: {}".format(device, args.batch_size, h * w, args.num_classes))
+    print("{:<18}{:>8}{:>12}{:>12}{:>10}".format("rule", "equal", "loop(ms)", "batched(ms)", "speedup"))
+    for name, (keep, split) in RULES.items():
+        same = check(keep, split, feats, labels, predict)
+        t_loop = timeit(lambda: view_sampling_loop(feats, feats, labels, predict, keep, split=split), device, args.repeat)
+        t_new = timeit(lambda: view_sampling(feats, feats, labels, predict, keep, split=split), device, args.repeat)
+        print("{:<18}{:>8}{:>12.2f}{:>12.2f}{:>9.1f}x".format(name, str(same), t_loop, t_new, t_loop / t_new))
+
+    # 退化情况: 全部 ignore (原实现返回个数不对的 None); 选中像素不足 n_view (前 1/3 epoch 只取易样本, 易样本只有 5 个)
+    ignored = torch.full_like(labels, 255)
+    out = view_sampling(feats, feats, ignored, predict)
+    print("all ignored: {} anchors".format(out[0].shape[0]))
+    few_labels = torch.zeros_like(labels[:1])
+    few_labels[:, :60] = 1
+    few_predict = few_labels.clone()
+    few_predict[:, 5:60] = 0
+    keep = self_pace3_view_keep(0, 30)
+    out = view_sampling(feats[:1], feats[:1], few_labels, few_predict, keep)
+    print("few easy pixels: X_ {}  valid views {}  equal: {}".format(
+        tuple(out[0].shape), int(out[3].sum()), check(keep, True, feats[:1], few_labels, few_predict)))
+
+    # Self_pace3 / Self_pace2 的不足 n_view 的行: 不再包含补 0 的特征, 损失与原实现 (补 0) 不同
+    unit_feats = F.normalize(torch.randn_like(feats[:1]), p=2, dim=-1)
+    for name, (shape, views, padded, compact) in check_partial_rows(unit_feats, few_labels, few_predict,
+                                                                    args.seed).items():
+        print("{} partial rows: padded X_ {} -> {} valid views  loss padded {:.6f} -> compact {:.6f}".format(
+            name, shape, views, padded, compact))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--device", default="cuda", help="device")
+    parser.add_argument("--batch_size", default=16, type=int)
+    parser.add_argument("--crop_size", default=513, type=int)
+    parser.add_argument("--network_stride", default=8, type=int)
+    parser.add_argument("--num_classes", default=19, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--repeat", default=10, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
@@ -0,0 +1,78 @@
+import time
+
+import torch
+import torch.nn.functional as F
+
+
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def timeit(fn, device, repeat=20, warmup=3):
+    """返回 fn() 每次调用的平均耗时 (ms)"""
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    synchronize(device)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def measure(fn, device, repeat=20, warmup=3):
+    """每次调用后同步, 返回 {mean_ms, median_ms, min_ms, repeat}"""
+    for _ in range(warmup):
+        fn()
+    synchronize(device)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {"mean_ms": sum(times) / repeat, "median_ms": times[repeat // 2], "min_ms": times[0], "repeat": repeat}
+
+
+def peak_memory(fn, device):
+    """fn() 一次调用的峰值显存 (MB), 非 cuda 设备返回 None"""
+    if torch.device(device).type != "cuda":
+        return None
+    synchronize(device)
+    torch.cuda.reset_peak_memory_stats(device)
+    fn()
+    synchronize(device)
+    return torch.cuda.max_memory_allocated(device) / 2 ** 20
+
+
+def synthetic_labels(batch_size, h, w, num_classes, device, block=8, ignore_ratio=0.05, error_ratio=0.2, ignore_label=255):
+    """
+    生成块状分布的标注和带噪声的预测, 模拟 stride 8 特征图上的 target / predict.
+    """
+    coarse = torch.randint(0, num_classes, (batch_size, 1, max(h // block, 1), max(w // block, 1)), device=device)
+    labels = F.interpolate(coarse.float(), size=(h, w), mode='nearest').long().squeeze(1)
+    labels[torch.rand(labels.shape, device=device) < ignore_ratio] = ignore_label
+
+    predict = labels.clone()
+    noise = torch.rand(labels.shape, device=device) < error_ratio
+    predict[noise] = torch.randint(0, num_classes, labels.shape, device=device)[noise]
+    predict[predict == ignore_label] = 0
+    return labels, predict
+
+
+def synthetic_feats(batch_size, h, w, dim, device, requires_grad=False):
+    feats = F.normalize(torch.randn(batch_size, dim, h, w, device=device), p=2, dim=1)
+    return feats.requires_grad_(requires_grad)
+
+
+def model_args(**kwargs):
+    """create_model 需要的参数 (与 train_multi_GPU.py 的默认值相同, 不加载预训练权重)"""
+    import argparse
+    args = argparse.Namespace(model_name="dcnet_resnet50", num_classes=19, aux=False, pre_trained="",
+                              weight_only_backbone=False, project_dim=128, loss_name="intra", contrast=10,
+                              L3_loss=0, L2_loss=0, L1_loss=0, memory_size=0, attention="")
+    for k, v in kwargs.items():
+        setattr(args, k, v)
+    return args
@@ -0,0 +1,273 @@
+"""
+离线微基准: 在合成数据 (训练时的真实形状) 上分别计时训练中的热点组件, 在 CPU 和当前 cuda 设备上各跑一遍,
+结果连同环境信息 (git 提交、torch / cuda 版本、设备型号等) 写成 JSON, 便于不同提交之间对比.
+
+    python -m benchmarks.run --out bench.json
+    python -m benchmarks.run --devices cpu --groups sampling contrastive --repeat 5
+
+组件:
+    sampling      SamplesModel.Sampling 的每种策略
+    hard_anchor   intra / inter / double / selfpace 损失中的 Hard_anchor_sampling
+    contrastive   各 Contrastive 实现 (fwd + bwd), 带队列的实现分别测有 / 无队列
+    queue         dequeue_and_enqueue_self_seri 与 MemoryBank.enqueue
+    data          Cityscapes.__getitem__ (不指定 --cityscapes_root 时用合成的 2048x1024 图像), VOC SegmentationPresetTrain
+    metrics       ConfusionMatrix.update
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from Datasets.cityscapes_gf import Cityscapes
+from Datasets.pascal_voc import SegmentationPresetTrain
+from Models.memory_bank import MemoryBank
+from train_utils.distributed_utils import ConfusionMatrix
+from train_utils.loss_manage import aspp_loss, double_contrastive_selfpace_epoch_loss as epoch_loss
+from train_utils.loss_manage import intra_contrastive_loss, inter_contrastive_loss, double_contrastive_loss
+from train_utils.loss_manage import double_contrastive_selfpace_loss
+from train_utils.loss_manage.SamplesModel import Sampling
+from benchmarks.bench_sampling import STRATEGIES, make_inputs
+from benchmarks.common import measure, synthetic_labels
+
+GROUPS = ["sampling", "hard_anchor", "contrastive", "queue", "data", "metrics"]
+# 只在 CPU 上跑的组 (DataLoader worker 中执行)
+CPU_ONLY = ["data"]
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def environment():
+    env = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.version.cuda,
+        "cudnn": torch.backends.cudnn.version() if torch.cuda.is_available() else None,
+        "gpus": [torch.cuda.get_device_name(i) for i in range(torch.cuda.device_count())],
+    }
+    try:
+        env["git_commit"] = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                                    stderr=subprocess.DEVNULL).decode().strip()
+        env["git_dirty"] = bool(subprocess.check_output(["git", "status", "--porcelain", "-uno"], cwd=ROOT,
+                                                        stderr=subprocess.DEVNULL).strip())
+    except (OSError, subprocess.CalledProcessError):
+        env["git_commit"] = None
+    return env
+
+
+def sampled_features(args, device):
+    # 对比损失的输入取自 Sampling 的真实输出: [total_classes, n_view, dim]
+    torch.manual_seed(args.seed)
+    feats, feats_y, labels_, _, _, _ = Sampling("self_pace3", args.epochs // 2, args.epochs, *make_inputs(args, device))
+    return feats, feats_y, labels_
+
+
+def filled_bank(args, device):
+    bank = MemoryBank(args.memory_size, args.project_dim).to(device)
+    rows = args.memory_size // 10 + 1
+    bank.enqueue(torch.randn(rows, 10, args.project_dim, device=device),
+                 torch.randint(0, args.num_classes, (rows,), device=device).float())
+    return bank
+
+
+def sampling_cases(args, device):
+    torch.manual_seed(args.seed)
+    inputs = make_inputs(args, device)
+    params = {"batch_size": args.batch_size, "pixels": inputs[0].shape[1], "dim": args.project_dim}
+    for type in STRATEGIES:
+        yield "Sampling/" + type, params, lambda type=type: Sampling(type, args.epochs // 2, args.epochs, *inputs)
+
+
+def hard_anchor_cases(args, device):
+    torch.manual_seed(args.seed)
+    feats, feats_y, labels, predict = make_inputs(args, device)
+    params = {"batch_size": args.batch_size, "pixels": feats.shape[1], "dim": args.project_dim}
+    yield "Hard_anchor_sampling/intra", params, lambda: intra_contrastive_loss.Hard_anchor_sampling(feats, labels, predict)
+    for name, module in [("inter", inter_contrastive_loss), ("double", double_contrastive_loss),
+                         ("selfpace", double_contrastive_selfpace_loss)]:
+        yield "Hard_anchor_sampling/" + name, params, \
+            lambda module=module: module.Hard_anchor_sampling(feats, feats_y, labels, predict)
+
+
+def contrastive_cases(args, device):
+    feats, feats_y, labels_ = sampled_features(args, device)
+    feats.requires_grad_()
+    feats_y.requires_grad_()
+    queue, queue_label, queue_valid = filled_bank(args, device).snapshot()
+    params = {"anchors": feats.shape[0], "n_view": feats.shape[1], "dim": args.project_dim}
+    queue_params = dict(params, memory_size=args.memory_size)
+
+    def backward(fn):
+        def run():
+            feats.grad, feats_y.grad = None, None
+            fn().backward()
+        return run
+
+    yield "Contrastive/intra", params, backward(lambda: intra_contrastive_loss.Contrastive(feats, labels_))
+    for name, module in [("inter", inter_contrastive_loss), ("double", double_contrastive_loss),
+                         ("selfpace", double_contrastive_selfpace_loss)]:
+        yield "Contrastive/" + name, params, \
+            backward(lambda module=module: module.Contrastive(feats, feats_y, labels_))
+    for type in ["intra", "inter", "double"]:
+        yield "Contrastive/aspp_" + type, params, \
+            backward(lambda type=type: aspp_loss.Contrastive(feats, feats_y, labels_, type=type))
+        yield "Contrastive/aspp_{}+queue".format(type), queue_params, \
+            backward(lambda type=type: aspp_loss.Contrastive(feats, feats_y, labels_, queue, queue_label, queue_valid,
+                                                             type=type))
+    yield "Contrastive/epoch_selfpace", params, \
+        backward(lambda: epoch_loss.Contrastive(feats, feats_y, labels_))
+    yield "Contrastive/epoch_selfpace+queue", queue_params, \
+        backward(lambda: epoch_loss.Contrastive(feats, feats_y, labels_, queue, queue_label, queue_valid))
+
+
+def queue_cases(args, device):
+    bank = filled_bank(args, device)
+    queue, queue_ptr, queue_label = bank.feature.clone(), bank.ptr.clone(), bank.label.clone()
+    for num_rows in args.queue_rows:
+        feats = torch.randn(num_rows, 1, args.project_dim, device=device)
+        labels = torch.randint(0, args.num_classes, (num_rows,), device=device).float()
+        params = {"rows": num_rows, "memory_size": args.memory_size, "dim": args.project_dim}
+        yield "dequeue_and_enqueue_self_seri/rows={}".format(num_rows), params, \
+            lambda feats=feats, labels=labels: aspp_loss.dequeue_and_enqueue_self_seri(
+                args, feats, feats, labels, queue, queue_ptr, queue_label)
+        yield "MemoryBank.enqueue/rows={}".format(num_rows), params, \
+            lambda feats=feats, labels=labels: bank.enqueue(feats, labels)
+
+
+def synthetic_cityscapes(root, num_images, seed):
+    # 块状的图像与标注 (压缩率接近真实图像), 原始 label id 0..33
+    rng = np.random.RandomState(seed)
+    lines = []
+    for i in range(num_images):
+        image = cv2.resize(rng.randint(0, 256, (64, 128, 3), dtype=np.uint8), (2048, 1024), interpolation=cv2.INTER_LINEAR)
+        label = cv2.resize(rng.randint(0, 34, (32, 64), dtype=np.uint8), (2048, 1024), interpolation=cv2.INTER_NEAREST)
+        image_path = "leftImg8bit/train/bench/bench_{:06d}_leftImg8bit.png".format(i)
+        label_path = "gtFine/train/bench/bench_{:06d}_gtFine_labelIds.png".format(i)
+        for path, array in [(image_path, image), (label_path, label)]:
+            os.makedirs(os.path.dirname(os.path.join(root, "Cityscape", path)), exist_ok=True)
+            cv2.imwrite(os.path.join(root, "Cityscape", path), array)
+        lines.append("{} {}\n".format(image_path, label_path))
+    list_path = os.path.join(root, "train.txt")
+    with open(list_path, "w") as f:
+        f.writelines(lines)
+    return list_path
+
+
+def data_cases(args, device):
+    # 与 dataset_build.Pre_datasets 中 cityscapes 训练集的参数相同
+    if args.cityscapes_root:
+        root, list_path = args.cityscapes_root, os.path.join(ROOT, "Datasets", "list", "train.txt")
+    else:
+        root = tempfile.mkdtemp(prefix="bench_cityscapes_")
+        list_path = synthetic_cityscapes(root, args.num_images, args.seed)
+    try:
+        dataset = Cityscapes(root=root, list_path=list_path, num_samples=args.num_images, num_classes=19,
+                             multi_scale=True, flip=True, ignore_label=255, base_size=2048, crop_size=(1024, 512),
+                             downsample_rate=1)
+        counter = iter(range(1 << 30))
+        yield "Cityscapes.__getitem__", {"images": len(dataset), "crop_size": [1024, 512]}, \
+            lambda: dataset[next(counter) % len(dataset)]
+    finally:
+        if not args.cityscapes_root:
+            shutil.rmtree(root, ignore_errors=True)
+
+    # VOC 图像长边 500, 短边 ~375
+    rng = np.random.RandomState(args.seed)
+    image = Image.fromarray(cv2.resize(rng.randint(0, 256, (47, 63, 3), dtype=np.uint8), (500, 375)))
+    target = Image.fromarray(cv2.resize(rng.randint(0, 21, (47, 63), dtype=np.uint8), (500, 375),
+                                        interpolation=cv2.INTER_NEAREST), mode="L").convert("P")
+    transform = SegmentationPresetTrain(513, 513)
+    yield "SegmentationPresetTrain", {"image": [375, 500], "base_size": 513, "crop_size": 513}, \
+        lambda: transform(image, target)
+
+
+def metrics_cases(args, device):
+    # cityscapes 验证: batch 个 1024x2048 的标注 / 预测
+    target, predict = synthetic_labels(args.batch_size_val, 1024, 2048, 19, device)
+    confmat = ConfusionMatrix(19)
+    yield "ConfusionMatrix.update", {"batch_size": args.batch_size_val, "size": [1024, 2048]}, \
+        lambda: confmat.update(target.flatten(), predict.flatten())
+
+
+CASES = {"sampling": sampling_cases, "hard_anchor": hard_anchor_cases, "contrastive": contrastive_cases,
+         "queue": queue_cases, "data": data_cases, "metrics": metrics_cases}
+
+
+def main(args):
+    devices = []
+    for name in args.devices:
+        if torch.device(name).type == "cuda" and not torch.cuda.is_available():
+            print("skip {}: cuda is not available".format(name))
+            continue
+        devices.append(torch.device(name))
+
+    results = []
+    print("{:<40}{:>8}{:>12}{:>12}".format("case", "device", "mean(ms)", "median(ms)"))
+    for group in args.groups:
+        for device in devices:
+            if group in CPU_ONLY and device.type != "cpu":
+                continue
+            cases = CASES[group](args, device)
+            while True:
+                # setup 失败 (如缺少数据) 时记录错误, 继续跑其它组
+                try:
+                    name, params, fn = next(cases)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    results.append({"group": group, "name": group, "device": str(device), "error": repr(e)})
+                    print("{:<40}{:>8}  error: {!r}".format(group, str(device), e))
+                    break
+                entry = {"group": group, "name": name, "device": str(device), "params": params}
+                try:
+                    torch.manual_seed(args.seed)
+                    entry.update(measure(fn, device, args.repeat, args.warmup))
+                    print("{:<40}{:>8}{:>12.3f}{:>12.3f}".format(name, str(device), entry["mean_ms"], entry["median_ms"]))
+                except Exception as e:
+                    entry["error"] = repr(e)
+                    print("{:<40}{:>8}  error: {!r}".format(name, str(device), e))
+                results.append(entry)
+
+    report = {"env": environment(), "config": vars(args), "results": results}
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print("results saved to {}".format(args.out))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_results.json", help="JSON output, empty = print only")
+    parser.add_argument("--devices", default=["cpu", "cuda"], nargs="+", help="cuda is skipped when unavailable")
+    parser.add_argument("--groups", default=GROUPS, nargs="+", choices=GROUPS)
+    parser.add_argument("--batch_size", default=16, type=int)
+    parser.add_argument("--batch_size_val", default=4, type=int)
+    parser.add_argument("--crop_size", default=513, type=int)
+    parser.add_argument("--network_stride", default=8, type=int)
+    parser.add_argument("--num_classes", default=21, type=int)
+    parser.add_argument("--project_dim", default=128, type=int)
+    parser.add_argument("--epochs", default=30, type=int)
+    parser.add_argument("--memory_size", default=10000, type=int)
+    parser.add_argument("--queue_rows", default=[32, 150, 600], type=int, nargs="+")
+    parser.add_argument("--cityscapes_root", default="", help="real cityscapes root (Datasets/list/train.txt), empty = synthetic")
+    parser.add_argument("--num_images", default=4, type=int, help="synthetic cityscapes images")
+    parser.add_argument("--repeat", default=20, type=int)
+    parser.add_argument("--warmup", default=3, type=int)
+    parser.add_argument("--seed", default=304, type=int)
+
+    main(parser.parse_args())
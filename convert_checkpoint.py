@@ -0,0 +1,65 @@
+"""
+train_multi_GPU.py 保存的 checkpoint -> 推理用权重文件 (Models.deploy.save_deploy):
+不含 optimizer / lr_scheduler / GradScaler / MemoryBank 队列和训练专用的头, Conv-BN 已折叠, 权重为 fp16 / bf16,
+文件头是描述 model_name / num_classes / 归一化参数的 json. predict.py 以内存映射方式读取.
+
+    python convert_checkpoint.py --weights results/xxx/checkpoints/model_best.pth --out model_best.deploy --dtype fp16
+"""
+import os
+
+import torch
+
+from Models.deploy import save_deploy, load_deploy
+from Models.model_build import create_model
+from Models.memory_bank import upgrade_queue_state_dict
+
+DTYPES = {"fp16": torch.float16, "bf16": torch.bfloat16, "fp32": torch.float32}
+
+
+def main(args):
+    assert os.path.exists(args.weights), f"weights {args.weights} not found."
+    checkpoint = torch.load(args.weights, map_location='cpu')
+    train_args = checkpoint['args']
+    train_args.pre_trained = ""
+
+    model = create_model(train_args)
+    model.load_state_dict(upgrade_queue_state_dict(checkpoint['model']))
+    size = save_deploy(model, train_args, args.out, dtype=DTYPES[args.dtype], mean=args.mean, std=args.std)
+    print("{}: {:.1f} MB -> {}: {:.1f} MB".format(args.weights, os.path.getsize(args.weights) / 2 ** 20,
+                                                  args.out, size / 2 ** 20))
+
+    if args.check:
+        # 与 checkpoint 的 fp32 模型比较 (输入尺寸较小, 只用于检查转换是否正确)
+        model = create_model(train_args)
+        model.load_state_dict(upgrade_queue_state_dict(checkpoint['model']))
+        model.eval()
+        deployed, _ = load_deploy(args.out)
+        image = torch.randn(1, 3, 129, 129)
+        with torch.no_grad():
+            ref = model(image, is_eval=True)["out"] if deployed.is_eval else model(image)["out"]
+            out = deployed(image)
+        print("max rel err: {:.2e}  argmax agreement: {:.4f}".format(
+            ((ref - out).abs().max() / ref.abs().max()).item(), (ref.argmax(1) == out.argmax(1)).float().mean().item()))
+
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument("--weights", required=True, help="checkpoint saved by train_multi_GPU.py")
+    parser.add_argument("--out", default="", help="output file, default: weights with .deploy suffix")
+    parser.add_argument("--dtype", default="fp16", choices=list(DTYPES))
+    parser.add_argument("--mean", default=[0.485, 0.456, 0.406], type=float, nargs=3, help="input normalization mean")
+    parser.add_argument("--std", default=[0.229, 0.224, 0.225], type=float, nargs=3, help="input normalization std")
+    parser.add_argument("--check", action="store_true", help="compare the converted model with the checkpoint")
+
+    args = parser.parse_args()
+    if not args.out:
+        args.out = os.path.splitext(args.weights)[0] + ".deploy"
+
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
@@ -7,7 +7,7 @@ from torchvision import transforms
 import numpy as np
 from PIL import Image
 
-from Models import fcn_resnet50
+from Models.deploy import load_deploy
 
 
 def time_synchronized():
@@ -16,9 +16,8 @@ def time_synchronized():
 
 
 def main():
-    aux = False  # inference time not need aux_classifier
-    classes = 20
-    weights_path = "./save_weights/model_29.pth"
+    # convert_checkpoint.py 转换得到的推理权重
+    weights_path = "./save_weights/model_29.deploy"
     img_path = "./test.jpg"
     palette_path = "./palette.json"
     assert os.path.exists(weights_path), f"weights {weights_path} not found."
@@ -34,18 +33,9 @@ def main():
     device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
     print("using {} device.".format(device))
 
-    # create model
-    model = fcn_resnet50(aux=aux, num_classes=classes+1)
-
-    # delete weights about aux_classifier
-    weights_dict = torch.load(weights_path, map_location='cpu')['model']
-    for k in list(weights_dict.keys()):
-        if "aux" in k:
-            del weights_dict[k]
-
-    # load weights
-    model.load_state_dict(weights_dict)
-    model.to(device)
+    # create model and load weights (内存映射读取), 不含 aux_classifier / projector / memory bank, 只输出 out
+    model, header = load_deploy(weights_path, device=device)
+    print("{} ({} classes, {} weights)".format(header["model_name"], header["num_classes"], header["dtype"]))
 
     # load image
     original_img = Image.open(img_path)
@@ -53,13 +43,12 @@ def main():
     # from pil image to tensor and normalize
     data_transform = transforms.Compose([transforms.Resize(520),
                                          transforms.ToTensor(),
-                                         transforms.Normalize(mean=(0.485, 0.456, 0.406),
-                                                              std=(0.229, 0.224, 0.225))])
+                                         transforms.Normalize(mean=header["normalization"]["mean"],
+                                                              std=header["normalization"]["std"])])
     img = data_transform(original_img)
     # expand batch dimension
     img = torch.unsqueeze(img, dim=0)
 
-    model.eval()  # 进入验证模式
     with torch.no_grad():
         # init model
         img_height, img_width = img.shape[-2:]
@@ -71,7 +60,7 @@ def main():
         t_end = time_synchronized()
         print("inference time: {}".format(t_end - t_start))
 
-        prediction = output['out'].argmax(1).squeeze(0)
+        prediction = output.argmax(1).squeeze(0)
         prediction = prediction.to("cpu").numpy().astype(np.uint8)
         mask = Image.fromarray(prediction)
         mask.putpalette(pallette)
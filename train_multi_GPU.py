@@ -4,7 +4,7 @@ import datetime
 
 import torch
 
-from train_utils import train_one_epoch, evaluate, create_lr_scheduler, init_distributed_mode, save_on_master, mkdir
+from train_utils import train_one_epoch, evaluate, create_lr_scheduler, init_distributed_mode, mkdir
 from train_utils import optim_manage
 
 import numpy as np
@@ -12,6 +12,11 @@ import random
 
 from Datasets.dataset_build import Pre_datasets
 from Models.model_build import create_model
+from Models.memory_bank import upgrade_queue_state_dict
+from train_utils.inference import build_inference
+from train_utils.checkpoint import CheckpointManager
+from train_utils.profiler import build_profiler
+from train_utils.contrast_schedule import ContrastSchedule
 
 
 # 远程调试
@@ -49,11 +54,19 @@ def main(args):
         args.num_classes = 21
     num_classes = args.num_classes
 
+    # 冒烟训练: 随机数据、不加载预训练权重, 没有 GPU 时在 CPU 上跑通完整训练流程
+    if getattr(args, "smoke_steps", 0):
+        args.pre_trained = ""
+        args.wandb = ""
+
     # 分布式训练初始化
     init_distributed_mode(args)
     print(args.name_date)
     print(args)
-    device = torch.device(args.device)
+    device = torch.device(args.device if torch.cuda.is_available() else "cpu")
+    if device.type == "cpu":
+        # GradScaler / autocast 只支持 cuda
+        args.amp = False
 
     # 用来保存运行结果的文件，只在主进程上进行写操作
     results_log = args.checkpoint_dir + "/output.log"
@@ -77,10 +90,16 @@ def main(args):
         model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
 
     model_without_ddp = model
+    ddp_kwargs = None
     if args.distributed:
-        model = torch.nn.parallel.DistributedDataParallel(model, device_ids=[args.gpu], find_unused_parameters=args.ddp)
+        device_ids = [args.gpu] if device.type == "cuda" else None
+        ddp_kwargs = dict(device_ids=device_ids, find_unused_parameters=args.ddp)
+        model = torch.nn.parallel.DistributedDataParallel(model, **ddp_kwargs)
         model_without_ddp = model.module
 
+    # 验证时的滑窗 / 多尺度 / 翻转推理, 不设置时整图前向
+    inference = build_inference(args, model, num_classes)
+
     # 设置参数的学习率
     optimizer = optim_manage(args, model_without_ddp)
     
@@ -93,7 +112,8 @@ def main(args):
 
     # 如果传入resume参数，即上次训练的权重地址，则接着上次的参数训练
     if args.resume:        
-        missing_keys, unexpected_keys = model_without_ddp.load_state_dict(checkpoint['model'])
+        # 兼容旧权重中直接注册的 encodeN_queue 等队列缓冲区
+        missing_keys, unexpected_keys = model_without_ddp.load_state_dict(upgrade_queue_state_dict(checkpoint['model']))
         optimizer.load_state_dict(checkpoint['optimizer'])
         lr_scheduler.load_state_dict(checkpoint['lr_scheduler'])
         args.start_epoch = checkpoint['epoch'] + 1
@@ -108,7 +128,8 @@ def main(args):
             print("unexpected_keys: ", unexpected_keys)
 
     if args.test_only:
-        confmat = evaluate(model, val_data_loader, device=device, num_classes=num_classes)
+        confmat = evaluate(model, val_data_loader, device=device, num_classes=num_classes, epoch=0, epochs=1,
+                           inference=inference)
         val_info = str(confmat)
         print(val_info)
         return
@@ -127,15 +148,27 @@ def main(args):
 
     print(model)
     best_IOU = 0
+    # 权重在后台线程中写入, 不阻塞下一个 epoch 的训练
+    checkpoint_manager = CheckpointManager('{}/checkpoints'.format(args.checkpoint_dir),
+                                           keep_last=getattr(args, "keep_last", 0),
+                                           async_write=getattr(args, "async_checkpoint", True))
+    # --profile_steps start:end 窗口内的 torch.profiler 记录
+    profiler = build_profiler(args)
+    # args.contrast 之前关闭对比分支, 开关切换时重新创建 DDP
+    contrast_schedule = ContrastSchedule(args, model_without_ddp, device, ddp_kwargs)
     print("Start training")
     start_time = time.time()
     for epoch in range(args.start_epoch, args.epochs):
         if args.distributed:
             train_sampler.set_epoch(epoch)
+        model = contrast_schedule.set_epoch(model, epoch)
+        inference = build_inference(args, model, num_classes)
         mean_loss, lr = train_one_epoch(args, model, optimizer, train_data_loader, device, epoch, args.epochs,
-                                        lr_scheduler=lr_scheduler, print_freq=args.print_freq, scaler=scaler)
+                                        lr_scheduler=lr_scheduler, print_freq=args.print_freq, scaler=scaler,
+                                        profiler=profiler)
 
-        confmat = evaluate(model, val_data_loader, device=device, num_classes=num_classes, epoch=epoch, epochs=args.epochs)
+        confmat = evaluate(model, val_data_loader, device=device, num_classes=num_classes, epoch=epoch, epochs=args.epochs,
+                           inference=inference)
         acc_global, acc, iu = confmat.compute()
         IOU = iu.mean().item() * 100
         val_info = (
@@ -171,18 +204,20 @@ def main(args):
                          'run_id': args.run_id}
             if args.amp:
                 save_file["scaler"] = scaler.state_dict()
-            save_on_master(save_file,
-                            '{}/checkpoints/model_latest.pth'.format(args.checkpoint_dir))
-            if IOU > best_IOU:
+            is_best = IOU > best_IOU
+            if is_best:
                 best_IOU = IOU
-                save_on_master(save_file,
-                            '{}/checkpoints/model_best.pth'.format(args.checkpoint_dir))
+            # model_latest.pth, 指标变好时 model_best.pth 硬链接到同一份文件
+            checkpoint_manager.save(save_file, epoch, is_best=is_best)
 
         ##### wandb #####
         if args.wandb and (args.rank in [-1, 0]):
             wandb.log({"mean_loss": mean_loss, "mIOU": IOU, "best_IOU": best_IOU, "acc_global": acc_global, "lr": lr, "epoch": epoch})
       
 
+    if profiler is not None:
+        profiler.close()
+    checkpoint_manager.close()
     total_time = time.time() - start_time
     total_time_str = str(datetime.timedelta(seconds=int(total_time)))
     print('Training time {}'.format(total_time_str))
@@ -234,6 +269,9 @@ if __name__ == "__main__":
     # 训练文件的根目录(VOCdevkit)
     parser.add_argument('--data_path', default='pascal-voc-2012', help='dataset')
     parser.add_argument("--data_train_type", default="train.txt", type=str, help="")
+    parser.add_argument("--data_cache", default="", type=str, help="dataset cache root built by python -m Datasets.build_cache")
+    parser.add_argument("--aspect_ratio_group_factor", default=-1, type=int, help="VOC: batch images of similar aspect ratio, -1 = off")
+    parser.add_argument("--gpu_aug", default=False, type=str2bool, help="workers only decode, train augmentation runs batched on the device")
     # 训练设备类型
     parser.add_argument('--device', default='cuda', help='device')
     # 检测目标类别数(不包含背景)
@@ -306,14 +344,35 @@ if __name__ == "__main__":
     parser.add_argument("--L2_loss", default=0, type=float, help="L2 loss")
     parser.add_argument("--L1_loss", default=0, type=float, help="L1 loss")
     parser.add_argument("--GAcc", default=1, type=int, help="Gradient Accumulation")
-    parser.add_argument("--memory_size", default=0, type=int, help="")
+    parser.add_argument("--memory_size", default=0, type=int, help="queue length (per class with --memory_per_class)")
+    parser.add_argument("--memory_per_class", default=False, type=str2bool, help="one queue partition per class")
+    parser.add_argument("--memory_policy", default="fifo", type=str, help="queue eviction: fifo reservoir hardness")
+    parser.add_argument("--memory_gather", default=False, type=str2bool, help="all_gather queue features across ranks before enqueue")
+    parser.add_argument("--memory_type", default="queue", type=str, choices=["queue", "prototype"], help="queue: pixel feature queue (needs --memory_size > 0), prototype: EMA class centers (--prototypes per class)")
+    parser.add_argument("--prototypes", default=1, type=int, help="prototypes per class with --memory_type prototype")
+    parser.add_argument("--prototype_momentum", default=0.99, type=float, help="EMA momentum of the prototypes")
     parser.add_argument("--network_stride", default=8, type=int, help="")
     parser.add_argument("--pixel_update_freq", default=10, type=int, help="")
-    parser.add_argument('--ddp', default=False, type=str2bool, help='')
+    parser.add_argument("--keep_last", default=0, type=int, help="also keep model_{epoch}.pth of the last N epochs, 0 = off")
+    parser.add_argument("--async_checkpoint", default=True, type=str2bool, help="write checkpoints from a background thread")
+    parser.add_argument("--val_crop", default=None, type=int, nargs=2, help="sliding window (h w) for validation")
+    parser.add_argument("--val_scales", default=None, type=float, nargs="+", help="multi-scale validation, e.g. 0.75 1.0 1.25")
+    parser.add_argument("--val_base_size", default=0, type=int, help="long side at scale 1.0 for --val_scales, 0 = input size")
+    parser.add_argument("--val_flip", default=False, type=str2bool, help="horizontal flip at validation")
+    parser.add_argument("--val_tile_batch", default=4, type=int, help="sliding window tiles per forward")
+    parser.add_argument("--contrast_chunk", default=0, type=int, help="contrastive loss anchor chunk size, 0 = no chunk")
+    parser.add_argument("--multi_level", default=False, type=str2bool, help="aspp_loss: sample / contrast / enqueue L1 L2 L3 together (mep models)")
+    parser.add_argument("--profile_steps", default="", type=str, help="torch.profiler window start:end (global train steps), trace saved to checkpoint_dir")
+    parser.add_argument("--step_timing", default=False, type=str2bool, help="per-phase step timing, percentiles per epoch in step_timing.csv")
+    parser.add_argument('--ddp', default=False, type=str2bool, help='find_unused_parameters of DDP')
     parser.add_argument('--weight_only_backbone', default=False, type=str2bool, help='')
     parser.add_argument("--sample", default="self_pace3", type=str, help="")
     parser.add_argument('--attention', default="", type=str, help='')
 
+    # 冒烟训练 (随机数据, 可在 CPU 上运行)
+    parser.add_argument("--smoke_steps", default=0, type=int, help="train steps per epoch on synthetic data, 0 = off")
+    parser.add_argument("--smoke_size", default=128, type=int, help="synthetic image size for smoke training")
+
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,106 @@
+import glob
+import os
+import re
+import shutil
+import threading
+
+import torch
+
+from .distributed_utils import is_main_process
+
+
+def to_cpu(obj):
+    """把 state_dict (可以嵌套 dict / list / tuple) 中的 tensor 拷贝一份到 CPU, 之后训练原地更新参数不影响这份快照"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def atomic_save(obj, path):
+    # 先写临时文件并 fsync, 再 rename: 中途被杀掉也不会留下写了一半的 path
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def atomic_link(src, dst):
+    # dst 指向与 src 相同的文件内容; 文件系统不支持硬链接时退回到拷贝
+    tmp_path = dst + ".tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copyfile(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+class CheckpointManager(object):
+    """
+    每个 epoch 结束时保存 model_latest.pth, 验证指标变好时保存 model_best.pth, 只在主进程上写.
+
+    save() 只把 state 拷贝到 CPU 就返回, torch.save 在后台线程中完成, 同一时间最多一个写操作,
+    下一次 save() (或 close()) 之前会等上一次写完. 后台线程的异常在下一次 save() / close() 时抛出.
+    model_best.pth 与本 epoch 的 model_latest.pth 内容相同, 用硬链接代替再写一遍;
+    model_latest.pth 之后被 rename 覆盖时, model_best.pth 仍指向原来的文件.
+    keep_last > 0 时另外保留最近 keep_last 个 epoch 的 model_{epoch}.pth (同样是硬链接).
+    """
+    def __init__(self, checkpoint_dir, keep_last=0, async_write=True):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep_last = keep_last
+        self.async_write = async_write
+        self._thread = None
+        self._error = None
+        if is_main_process():
+            os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def _write(self, state, epoch, is_best):
+        try:
+            latest = os.path.join(self.checkpoint_dir, "model_latest.pth")
+            atomic_save(state, latest)
+            if is_best:
+                atomic_link(latest, os.path.join(self.checkpoint_dir, "model_best.pth"))
+            if self.keep_last > 0:
+                atomic_link(latest, os.path.join(self.checkpoint_dir, "model_{}.pth".format(epoch)))
+                self._prune()
+        except Exception as e:
+            self._error = e
+
+    def _prune(self):
+        epochs = []
+        for path in glob.glob(os.path.join(self.checkpoint_dir, "model_*.pth")):
+            m = re.match(r"^model_(\d+)\.pth$", os.path.basename(path))
+            if m is not None:
+                epochs.append((int(m.group(1)), path))
+        for _, path in sorted(epochs)[:-self.keep_last]:
+            os.remove(path)
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, state, epoch, is_best=False):
+        if not is_main_process():
+            return
+        self.wait()
+        state = to_cpu(state)
+        if self.async_write:
+            self._thread = threading.Thread(target=self._write, args=(state, epoch, is_best), daemon=False)
+            self._thread.start()
+        else:
+            self._write(state, epoch, is_best)
+            self.wait()
+
+    def close(self):
+        self.wait()
@@ -0,0 +1,75 @@
+import inspect
+
+import torch
+
+
+def contrast_on(args, epoch):
+    # --contrast: 从第 args.contrast 个 epoch 开始加入对比损失, -1 不使用
+    return args.contrast != -1 and epoch >= args.contrast
+
+
+@torch.no_grad()
+def used_parameters(model, device, contrast, size=65):
+    """
+    用一张小图在 eval 模式下前向一次, 返回前向中被调用过的模块的参数 (不更新 BN 统计量, 不入队).
+    contrast=False 时 is_eval=True, 各模型只计算 out / aux, 不经过投影头 / 对比头.
+    """
+    called = set()
+    handles = [m.register_forward_pre_hook(lambda m, x: called.add(m)) for m in model.modules()]
+    training = model.training
+    model.eval()
+    try:
+        image = torch.zeros(1, 3, size, size, device=device)
+        target = torch.zeros(1, size, size, dtype=torch.long, device=device)
+        if "is_eval" in inspect.signature(model.forward).parameters:
+            model(image, target, is_eval=not contrast)
+        else:
+            # fcn 等模型没有对比分支
+            model(image)
+    finally:
+        for handle in handles:
+            handle.remove()
+        model.train(training)
+    return {id(p) for m in called for p in m.parameters(recurse=False)}
+
+
+class ContrastSchedule(object):
+    """
+    按 epoch 开关对比分支. args.contrast 之前的 epoch:
+        前向 is_eval=True, 不计算投影头 / 对比头; criterion 不做采样、对比损失和 MemoryBank 入队;
+        只在对比分支中用到的参数 (dc_net 的 ProjectorHead_*, deeplabv3 / aspp_contrast 的 contrast 头,
+        SKAttention 的 mlp 等) 设为 requires_grad=False.
+    前向中从未调用过的模块 (如 dc_net 的 aux_classifier) 的参数一直冻结.
+
+    DDP 只登记创建时 requires_grad 的参数, 开关切换时用同样的参数重新创建 DDP, 每个阶段登记的参数都参与反向,
+    因此不需要 find_unused_parameters (--ddp). set_epoch 返回 (可能是新创建的) 训练用模型.
+    """
+    def __init__(self, args, model_without_ddp, device, ddp_kwargs=None):
+        self.args = args
+        self.model = model_without_ddp
+        self.ddp_kwargs = ddp_kwargs
+        self.active = None
+        self.trainable = {id(p) for p in model_without_ddp.parameters() if p.requires_grad}
+        self.used_off = used_parameters(model_without_ddp, device, contrast=False)
+        self.used_on = used_parameters(model_without_ddp, device, contrast=True) if args.contrast != -1 else self.used_off
+
+    def set_epoch(self, model, epoch):
+        active = contrast_on(self.args, epoch)
+        if active == self.active:
+            return model
+        self.active = active
+        used = self.used_on if active else self.used_off
+
+        changed = False
+        for p in self.model.parameters():
+            requires_grad = id(p) in self.trainable and id(p) in used
+            if p.requires_grad != requires_grad:
+                p.requires_grad_(requires_grad)
+                changed = True
+        num_trainable = sum(p.numel() for p in self.model.parameters() if p.requires_grad)
+        print("epoch {}: contrast branch {}, {:.2f}M trainable parameters".format(
+            epoch, "on" if active else "off", num_trainable / 1e6))
+
+        if changed and self.ddp_kwargs is not None:
+            model = torch.nn.parallel.DistributedDataParallel(self.model, **self.ddp_kwargs)
+        return model
@@ -33,7 +33,7 @@ class SmoothedValue(object):
         """
         if not is_dist_avail_and_initialized():
             return
-        t = torch.tensor([self.count, self.total], dtype=torch.float64, device='cuda')
+        t = torch.tensor([self.count, self.total], dtype=torch.float64, device='cuda' if dist.get_backend() == 'nccl' else 'cpu')
         dist.barrier()
         dist.all_reduce(t)
         t = t.tolist()
@@ -71,6 +71,83 @@ class SmoothedValue(object):
             value=self.value)
 
 
+class DeviceSmoothedValue(object):
+    """
+    与 SmoothedValue 的接口和打印格式相同, 但 update 可以直接传入 device 上的 tensor, 不需要 .item().
+    最近 window_size 个值保存在 device 上的环形缓冲区中 (写指针在 host 端, 只有训练循环一个写者, 不需要加锁),
+    累计和也留在 device 上; 只有在打印 / 读取统计量时才同步一次.
+    """
+
+    def __init__(self, window_size=20, fmt=None):
+        if fmt is None:
+            fmt = "{value:.4f} ({global_avg:.4f})"
+        self.window_size = window_size
+        self.window = None
+        self.total = None
+        self.count = 0
+        self.pos = 0
+        self.fmt = fmt
+
+    def update(self, value, n=1):
+        if isinstance(value, torch.Tensor):
+            value = value.detach()
+            device = value.device
+        else:
+            device = 'cpu' if self.window is None else self.window.device
+        if self.window is None:
+            # 与 SmoothedValue 的 median / avg 一样按 float32 统计窗口, 累计和用 float64
+            self.window = torch.zeros(self.window_size, dtype=torch.float32, device=device)
+            self.total = torch.zeros((), dtype=torch.float64, device=device)
+        self.window[self.pos % self.window_size] = value
+        self.total += value * n if isinstance(value, torch.Tensor) else float(value) * n
+        self.pos += 1
+        self.count += n
+
+    def _stats(self):
+        # 一次同步取回所有统计量
+        d = self.window[:min(self.pos, self.window_size)]
+        last = self.window[(self.pos - 1) % self.window_size]
+        stats = torch.stack([d.median(), d.mean(), d.max(), last]).double()
+        stats = torch.cat([stats, self.total.view(1)]).tolist()
+        return dict(median=stats[0], avg=stats[1], max=stats[2], value=stats[3], global_avg=stats[4] / self.count)
+
+    def synchronize_between_processes(self):
+        """
+        Warning: does not synchronize the window!
+        """
+        if not is_dist_avail_and_initialized():
+            return
+        device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+        t = torch.stack([torch.tensor(float(self.count), dtype=torch.float64, device=self.total.device), self.total]).to(device)
+        dist.barrier()
+        dist.all_reduce(t)
+        self.count = int(t[0].item())
+        self.total = t[1].to(self.window.device)
+
+    @property
+    def median(self):
+        return self._stats()["median"]
+
+    @property
+    def avg(self):
+        return self._stats()["avg"]
+
+    @property
+    def global_avg(self):
+        return self.total.item() / self.count
+
+    @property
+    def max(self):
+        return self._stats()["max"]
+
+    @property
+    def value(self):
+        return self._stats()["value"]
+
+    def __str__(self):
+        return self.fmt.format(**self._stats())
+
+
 class ConfusionMatrix(object):
     def __init__(self, num_classes):
         self.num_classes = num_classes
@@ -112,7 +189,9 @@ class ConfusionMatrix(object):
 
     def __str__(self):
         acc_global, acc, iu = self.compute()
-        wandb.log({"acc_global":acc_global, "miou":iu.mean().item() * 100})
+        # --test-only / validation.py 不初始化 wandb
+        if wandb.run is not None:
+            wandb.log({"acc_global":acc_global, "miou":iu.mean().item() * 100})
         return (
             'global correct: {:.1f}\n'
             'average row correct: {}\n'
@@ -209,6 +288,22 @@ class MetricLogger(object):
         print('{} Total time: {}'.format(header, total_time_str))
 
 
+class DeviceMetricLogger(MetricLogger):
+    """
+    MetricLogger 的 device 版本: update 直接接收 device 上的 tensor (如 loss.detach()), 默认的 meter 为
+    DeviceSmoothedValue, 只在 log_every 每 print_freq 步打印以及 epoch 结束读取 global_avg 时同步, 打印内容不变.
+    """
+    def __init__(self, delimiter="\t", window_size=20):
+        super(DeviceMetricLogger, self).__init__(delimiter)
+        self.meters = defaultdict(lambda: DeviceSmoothedValue(window_size))
+
+    def update(self, **kwargs):
+        for k, v in kwargs.items():
+            if not isinstance(v, torch.Tensor):
+                assert isinstance(v, (float, int))
+            self.meters[k].update(v)
+
+
 def mkdir(path):
     try:
         os.makedirs(path)
@@ -256,6 +351,40 @@ def is_main_process():
     return get_rank() == 0
 
 
+def all_gather_queue_samples(feats, labels, max_rows, dim):
+    """
+    把各个 rank 采样得到的队列特征 all_gather 到一起, 使每个 rank 的 MemoryBank 保持一致.
+    各 rank 的行数不同, 先补齐到 max_rows (超出的部分丢弃) 并把 label 拼在最后一列,
+    这样只需要一次 all_gather; 补齐的行 label 为 -1, 入队时会被跳过.
+
+    Args:
+        feats (Tensor[N, V, dim] or None) / labels (Tensor[N] or None): 本 rank 的采样结果, None 表示没有采样到
+        max_rows (int): 所有 rank 上相同的行数上限
+    Returns:
+        (Tensor[world_size * max_rows, V, dim], Tensor[world_size * max_rows])
+    """
+    if not is_dist_avail_and_initialized():
+        return feats, labels
+
+    device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+    if feats is None:
+        n_view, dtype = 1, torch.float
+    else:
+        n_view, dtype = (feats.shape[1] if feats.dim() == 3 else 1), feats.dtype
+
+    buf = torch.zeros(max_rows, n_view * dim + 1, dtype=dtype, device=device)
+    buf[:, -1] = -1
+    if feats is not None:
+        n = min(feats.shape[0], max_rows)
+        buf[:n, :-1] = feats[:n].reshape(n, -1)
+        buf[:n, -1] = labels[:n].to(dtype)
+
+    out = [torch.empty_like(buf) for _ in range(get_world_size())]
+    dist.all_gather(out, buf)
+    out = torch.cat(out, dim=0)
+    return out[:, :-1].reshape(-1, n_view, dim), out[:, -1]
+
+
 def save_on_master(*args, **kwargs):
     if is_main_process():
         torch.save(*args, **kwargs)
@@ -270,17 +399,21 @@ def init_distributed_mode(args):
     elif 'SLURM_PROCID' in os.environ:
         args.rank = int(os.environ['SLURM_PROCID'])
         args.gpu = args.rank % torch.cuda.device_count()
-    elif hasattr(args, "rank"):
+    elif getattr(args, "rank", -1) != -1:
         pass
     else:
         print('Not using distributed mode')
+        args.rank = -1
         args.distributed = False
         return
 
     args.distributed = True
 
-    torch.cuda.set_device(args.gpu)
-    args.dist_backend = 'nccl'
+    if torch.cuda.is_available():
+        torch.cuda.set_device(args.gpu)
+        args.dist_backend = 'nccl'
+    else:
+        args.dist_backend = 'gloo'
     print('| distributed init (rank {}): {}'.format(
         args.rank, args.dist_url), flush=True)
     torch.distributed.init_process_group(backend=args.dist_backend, init_method=args.dist_url,
@@ -0,0 +1,150 @@
+import inspect
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+class SlidingWindowInference(object):
+    """
+    滑窗 + 多尺度 (+ 水平翻转) 推理, 与 BaseDataset.multi_scale_inference 的结果一致, 但是:
+        - 输入可以是一个 batch, 所有图像、所有尺度的滑窗先收集起来, 按 tile_batch 个一组送进模型;
+        - 翻转的滑窗和原滑窗放在同一次前向里, 输出在 device 上翻转回来, 不经过 numpy / CPU;
+        - 每个尺度的预测累加到预先分配好的 logit / count 缓冲区, 全程不做 host 同步.
+
+    适用于 Models.model_build.create_model 创建的所有模型: 调用 model(x, is_eval=True)[output] (forward 没有 is_eval 时不传);
+    也可以是 Models.prepare_inference 得到的推理模型.
+
+    Args:
+        crop_size (h, w): 滑窗大小; 图像 (缩放后) 不超过滑窗时整张图补齐到滑窗大小只算一次;
+                          为 None 时不切滑窗, 每个尺度整张图前向一次
+        stride (h, w): 滑窗步长, 默认 crop_size 的 2/3
+        scales: 每个尺度把长边缩放到 base_size * scale; base_size 为 None 时按输入图像大小缩放
+        tile_batch: 每次前向的滑窗个数 (开启 flip 时实际送入 2 * tile_batch 张)
+        mean / std: 输入已经归一化, 补齐的部分用原图中 0 像素归一化后的值
+    """
+    def __init__(self, model, num_classes, crop_size, stride=None, scales=(1.0,), flip=False, base_size=None,
+                 tile_batch=4, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), output="out",
+                 align_corners=False):
+        self.model = model
+        self.num_classes = num_classes
+        self.crop_size = tuple(crop_size) if crop_size else None
+        if stride is None and self.crop_size is not None:
+            stride = (int(self.crop_size[0] * 2.0 / 3.0), int(self.crop_size[1] * 2.0 / 3.0))
+        self.stride = tuple(stride) if stride else None
+        self.scales = list(scales)
+        self.flip = flip
+        self.base_size = base_size
+        self.tile_batch = tile_batch
+        self.mean = mean
+        self.std = std
+        self.output = output
+        self.align_corners = align_corners
+        # fcn 等模型的 forward 没有 is_eval 参数; torch.jit 固化的推理模型只接受输入图像
+        forward = model.module.forward if hasattr(model, "module") else model.forward
+        self.forward_kwargs = {}
+        if not isinstance(model, torch.jit.ScriptModule) and "is_eval" in inspect.signature(forward).parameters:
+            self.forward_kwargs = {"is_eval": True}
+
+    def _scaled_size(self, height, width, scale):
+        # 与 BaseDataset.multi_scale_aug 相同: 长边缩放到 base_size * scale
+        if self.base_size is None:
+            return int(height * scale + 0.5), int(width * scale + 0.5)
+        long_size = int(self.base_size * scale + 0.5)
+        if height > width:
+            return long_size, int(width * long_size / height + 0.5)
+        return int(height * long_size / width + 0.5), long_size
+
+    def _tiles(self, height, width):
+        # 返回滑窗大小、补齐后的大小和每个滑窗的左上角
+        if self.crop_size is None:
+            return (height, width), (height, width), [(0, 0)]
+        crop_h, crop_w = self.crop_size
+        if max(height, width) <= min(self.crop_size):
+            return self.crop_size, self.crop_size, [(0, 0)]
+        pad_h, pad_w = max(height, crop_h), max(width, crop_w)
+        rows = int(math.ceil(1.0 * (pad_h - crop_h) / self.stride[0])) + 1
+        cols = int(math.ceil(1.0 * (pad_w - crop_w) / self.stride[1])) + 1
+        # 最后一行 / 列的滑窗可能越过图像, 越过的部分补齐, 预测时丢掉
+        full_h = (rows - 1) * self.stride[0] + crop_h
+        full_w = (cols - 1) * self.stride[1] + crop_w
+        corners = [(r * self.stride[0], c * self.stride[1]) for r in range(rows) for c in range(cols)]
+        return self.crop_size, (full_h, full_w), corners
+
+    def _forward(self, tiles):
+        # 原滑窗与翻转后的滑窗一起前向, 翻转的输出在 device 上翻回来取平均
+        n = tiles.shape[0]
+        if self.flip:
+            tiles = torch.cat([tiles, tiles.flip(-1)], dim=0)
+        pred = self.model(tiles, **self.forward_kwargs)
+        # Models.prepare_inference 得到的推理模型直接返回 out
+        pred = pred[self.output] if isinstance(pred, dict) else pred
+        if pred.shape[-2:] != tiles.shape[-2:]:
+            pred = F.interpolate(pred, size=tiles.shape[-2:], mode="bilinear", align_corners=self.align_corners)
+        if self.flip:
+            pred = (pred[:n] + pred[n:].flip(-1)) * 0.5
+        return pred.exp()
+
+    @torch.no_grad()
+    def __call__(self, image):
+        """
+        Args:
+            image (Tensor[B, 3, H, W]): 归一化后的图像
+        Returns:
+            Tensor[B, num_classes, H, W]: 各尺度预测 (滑窗内 exp(logit) 的平均) 之和, argmax 即为分割结果
+        """
+        batch, _, ori_height, ori_width = image.shape
+        device = image.device
+        pad_value = torch.tensor([-m / s for m, s in zip(self.mean, self.std)], dtype=image.dtype, device=device)
+
+        # 收集所有尺度的滑窗: (滑窗大小, 尺度编号, 图像编号, 左上角), 滑窗图像按需从补齐后的缩放图中切出
+        scaled, jobs = [], []
+        for i, scale in enumerate(self.scales):
+            height, width = self._scaled_size(ori_height, ori_width, scale)
+            img = image
+            if (height, width) != (ori_height, ori_width):
+                img = F.interpolate(image, size=(height, width), mode="bilinear", align_corners=self.align_corners)
+            (crop_h, crop_w), (full_h, full_w), corners = self._tiles(height, width)
+            canvas = pad_value.view(1, -1, 1, 1).repeat(batch, 1, full_h, full_w)
+            canvas[:, :, :height, :width] = img
+            preds = torch.zeros(batch, self.num_classes, full_h, full_w, device=device)
+            count = torch.zeros(1, 1, full_h, full_w, device=device)
+            scaled.append((canvas, preds, count, height, width))
+            for h0, w0 in corners:
+                count[:, :, h0:h0 + crop_h, w0:w0 + crop_w] += 1
+                for b in range(batch):
+                    jobs.append(((crop_h, crop_w), i, b, h0, w0))
+
+        # 大小相同的滑窗 (包括不同尺度的) 放进同一次前向
+        jobs.sort(key=lambda job: job[0])
+        start = 0
+        while start < len(jobs):
+            (crop_h, crop_w) = jobs[start][0]
+            end = start + 1
+            while end < len(jobs) and end - start < self.tile_batch and jobs[end][0] == (crop_h, crop_w):
+                end += 1
+            chunk = jobs[start:end]
+            tiles = torch.stack([scaled[i][0][b, :, h0:h0 + crop_h, w0:w0 + crop_w] for _, i, b, h0, w0 in chunk])
+            pred = self._forward(tiles)
+            for (_, i, b, h0, w0), p in zip(chunk, pred):
+                scaled[i][1][b, :, h0:h0 + crop_h, w0:w0 + crop_w] += p
+            start = end
+
+        final_pred = torch.zeros(batch, self.num_classes, ori_height, ori_width, device=device)
+        for canvas, preds, count, height, width in scaled:
+            preds = (preds / count)[:, :, :height, :width]
+            final_pred += F.interpolate(preds, (ori_height, ori_width), mode="bilinear",
+                                        align_corners=self.align_corners)
+        return final_pred
+
+
+def build_inference(args, model, num_classes):
+    """--val_crop / --val_scales / --val_flip 任一设置时返回 SlidingWindowInference, 否则返回 None (整图前向)"""
+    crop = getattr(args, "val_crop", None)
+    scales = getattr(args, "val_scales", None) or [1.0]
+    flip = getattr(args, "val_flip", False)
+    if not crop and scales == [1.0] and not flip:
+        return None
+    return SlidingWindowInference(model, num_classes, crop_size=crop, scales=scales, flip=flip,
+                                  base_size=getattr(args, "val_base_size", None) or None,
+                                  tile_batch=getattr(args, "val_tile_batch", 4))
@@ -1,5 +1,7 @@
-from .sample_manage import Sampling
+from .sample_manage import Sampling, Sampling_loop
 from .common_sample import only_esay, pred_ave, label_ave
 from .self_pace import self_pace3, self_pace_epochs, self_pace_step, self_pace_ploy
-from .adapt_excite import adapt_excite
-from .weight_ade import weight_ade, weight_ade_softmax
\ No newline at end of file
+from .self_pace import self_pace3_keep, self_pace_epochs_keep, self_pace_step_keep, self_pace_ploy_keep
+from .adapt_excite import adapt_excite, adapt_excite_keep
+from .weight_ade import weight_ade, weight_ade_softmax, weight_ade_weights
+from .view_sample import view_sampling, view_sampling_loop, compact_views, balanced_keep, proportion_keep, self_pace3_view_keep, self_pace2_view_keep, hard_keep
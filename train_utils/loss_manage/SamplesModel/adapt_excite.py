@@ -1,10 +1,6 @@
 import torch
 
-def adapt_excite(this_y_hat, this_y, cls_id, aex):
-    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-    num_hard = hard_indices.shape[0]
-    num_easy = easy_indices.shape[0]
+def adapt_excite_keep(num_hard, num_easy, aex):
     sum = num_hard + num_easy
 
     # >>>> 核心修改部分
@@ -19,6 +15,16 @@ def adapt_excite(this_y_hat, this_y, cls_id, aex):
     num_easy_keep = round(num_easy * easy)
     # <<<<
 
+    return num_hard_keep, num_easy_keep
+
+def adapt_excite(this_y_hat, this_y, cls_id, aex):
+    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
+    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
+    num_hard = hard_indices.shape[0]
+    num_easy = easy_indices.shape[0]
+
+    num_hard_keep, num_easy_keep = adapt_excite_keep(num_hard, num_easy, aex)
+
     perm = torch.randperm(num_hard)
     hard_indices = hard_indices[perm[:num_hard_keep]]
     perm = torch.randperm(num_easy)
@@ -2,7 +2,138 @@ import torch
 import torch.nn as nn
 from train_utils.loss_manage import SamplesModel
 
+# label 来自 uint8 标注图, 每张图最多 256 个类别槽位 (含 ignore_label)
+LABEL_BINS = 256
+
+def _segment_sum(keys, feats, weight, num_keys):
+    # 按 keys 分段求和: sum_{i: keys[i]==k} weight[i] * feats[i]
+    src = feats * weight.unsqueeze(-1)
+    return torch.zeros((num_keys, feats.shape[-1]), dtype=feats.dtype, device=feats.device).index_add(0, keys, src)
+
+def _segment_count(keys, weight, num_keys):
+    return torch.zeros(num_keys, dtype=weight.dtype, device=weight.device).scatter_add_(0, keys, weight)
+
+def _segment_mean(keys, X, Y, weight, num_keys):
+    count = _segment_count(keys, weight, num_keys)
+    mean_x = _segment_sum(keys, X, weight, num_keys) / count.clamp(min=1).unsqueeze(-1)
+    mean_y = _segment_sum(keys, Y, weight, num_keys) / count.clamp(min=1).unsqueeze(-1)
+    return mean_x, mean_y, count
+
+def _random_keep_mask(keep, present, stats, sort_key, num_pixel):
+    """
+    按照 keep(num_hard, num_easy) 给出的个数, 在每个 (图像, 类别, 难/易) 分组内随机保留像素.
+    随机数在 host 上按照原循环版本相同的顺序 (逐图像、逐类别、先难后易) 调用 torch.randperm,
+    因此固定随机种子时与逐类别循环的采样结果一致.
+    """
+    order = torch.sort(sort_key, stable=True)[1]
+
+    selected = []
+    offset = 0
+    for g in present:
+        num_hard, num_easy = stats[g]
+        num_hard_keep, num_easy_keep = keep(num_hard, num_easy)
+        perm = torch.randperm(num_hard)
+        selected.append(perm[:num_hard_keep] + offset)
+        offset += num_hard
+        perm = torch.randperm(num_easy)
+        selected.append(perm[:num_easy_keep] + offset)
+        offset += num_easy
+    selected = torch.cat(selected).to(sort_key.device, non_blocking=True)
+
+    mask = torch.zeros(num_pixel, dtype=torch.bool, device=sort_key.device)
+    mask[order[selected]] = True
+    return mask
+
 def Sampling(type, epoch, epochs, X, Y, labels, predict, ignore_label: int = 255):
+    """
+    逐 batch 向量化的类别锚点采样: 以 batch*LABEL_BINS + label 为分段键, 用一次分段求和得到
+    每张图每个类别的难/易像素均值, 代替逐图像 torch.unique、逐类别 nonzero()/randperm 的循环.
+    返回值与 Sampling_loop 相同.
+    """
+    batch_size, num_pixel, feat_dim = X.shape
+    num_keys = batch_size * LABEL_BINS
+    device = X.device
+
+    # 与循环版本一致, 在 float32 下累加
+    X = X.reshape(-1, feat_dim).float()
+    Y = Y.reshape(-1, feat_dim).float()
+    labels = labels.reshape(batch_size, -1)
+    predict = predict.reshape(batch_size, -1)
+
+    valid = labels != ignore_label
+    batch_key = torch.arange(batch_size, device=device).view(-1, 1) * LABEL_BINS
+    keys = (batch_key + labels.clamp(0, LABEL_BINS - 1)).view(-1)
+    hard = (valid & (predict != labels)).view(-1)
+    easy = (valid & (predict == labels)).view(-1)
+
+    # 每个分组的难/易像素个数, 一次同步拷贝回 host 决定输出行数
+    num_hard = _segment_count(keys, hard.to(X.dtype), num_keys)
+    num_easy = _segment_count(keys, easy.to(X.dtype), num_keys)
+    stats = torch.stack((num_hard, num_easy), dim=1).long().cpu()
+    present = ((stats[:, 0] + stats[:, 1]) > 0).nonzero().view(-1)
+
+    total_classes = present.shape[0]
+    if total_classes == 0:
+        return None, None, None, None, None, None
+
+    y_ = (present % LABEL_BINS).to(device=device, dtype=X.dtype)
+    rows = present.to(device)
+
+    if "weight_ade" in type:
+        w = int(type.split('_')[-1])
+        hard_x, hard_y, _ = _segment_mean(keys, X, Y, hard.to(X.dtype), num_keys)
+        easy_x, easy_y, _ = _segment_mean(keys, X, Y, easy.to(X.dtype), num_keys)
+        hard_weight, easy_weight = SamplesModel.weight_ade_weights(num_hard[rows], num_easy[rows], w)
+        # 不存在的难/易像素均值为 0, 等价于只保留存在的一项
+        X_ = hard_x[rows] * hard_weight.unsqueeze(-1) + easy_x[rows] * easy_weight.unsqueeze(-1)
+        Y_ = hard_y[rows] * hard_weight.unsqueeze(-1) + easy_y[rows] * easy_weight.unsqueeze(-1)
+    elif type == "pred_ave":
+        # 图像内所有预测不为 cls_id 的像素 = 整图 - 预测为 cls_id 的像素
+        pred_keys = (batch_key + predict.clamp(0, LABEL_BINS - 1)).view(-1)
+        ones = torch.ones_like(hard, dtype=X.dtype)
+        pred_count = _segment_count(pred_keys, ones, num_keys)[rows]
+        pred_x = _segment_sum(pred_keys, X, ones, num_keys)[rows]
+        pred_y = _segment_sum(pred_keys, Y, ones, num_keys)[rows]
+        image = rows // LABEL_BINS
+        count = (num_pixel - pred_count).unsqueeze(-1)
+        X_ = (X.view(batch_size, num_pixel, feat_dim).sum(1)[image] - pred_x) / count.clamp(min=1)
+        Y_ = (Y.view(batch_size, num_pixel, feat_dim).sum(1)[image] - pred_y) / count.clamp(min=1)
+        y_ = torch.where(count.view(-1) > 0, y_, torch.zeros_like(y_))
+    else:
+        if "adapt_excite" in type:
+            n = int(type.split('_')[-1])
+            keep = lambda num_hard, num_easy: SamplesModel.adapt_excite_keep(num_hard, num_easy, n)
+        elif "self_pace" in type:
+            keep_fn = eval("SamplesModel." + type + "_keep")
+            keep = lambda num_hard, num_easy: keep_fn(epoch, epochs, num_hard, num_easy)
+        elif type == "label_ave":
+            keep = None
+            weight = valid.view(-1)
+        elif type == "only_esay":
+            keep = None
+            weight = easy
+        else:
+            raise ValueError("unknown sample type: {}".format(type))
+
+        if keep is not None:
+            # 分组内排序键: 先按 (图像, 类别), 再难后易, 组内保持像素原有顺序
+            sort_key = keys * 2 + easy.long()
+            sort_key = torch.where(hard | easy, sort_key, torch.full_like(sort_key, 2 * num_keys))
+            weight = _random_keep_mask(keep, present.tolist(), stats.tolist(), sort_key, X.shape[0])
+
+        mean_x, mean_y, count = _segment_mean(keys, X, Y, weight.to(X.dtype), num_keys)
+        X_ = mean_x[rows]
+        Y_ = mean_y[rows]
+        # 没有被选中像素的类别与原循环一致: 特征与标签都保持为 0
+        y_ = torch.where(count[rows] > 0, y_, torch.zeros_like(y_))
+
+    X_ = X_.unsqueeze(1)
+    Y_ = Y_.unsqueeze(1)
+
+    return X_, Y_, y_, X_.detach(), Y_.detach(), y_.detach()
+
+def Sampling_loop(type, epoch, epochs, X, Y, labels, predict, ignore_label: int = 255):
+    # 逐图像、逐类别的参考实现, 仅用于 benchmarks 中校验 Sampling 的结果
     batch_size, feat_dim = X.shape[0], X.shape[-1]
 
     classes = []
@@ -17,10 +148,10 @@ def Sampling(type, epoch, epochs, X, Y, labels, predict, ignore_label: int = 255
     if total_classes == 0:
         return None, None, None, None, None, None
 
-    X_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.float).cuda()
-    Y_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
-    
+    X_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.float, device=X.device)
+    Y_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.float, device=X.device)
+    y_ = torch.zeros(total_classes, dtype=torch.float, device=X.device)
+
     X_ptr = 0
     for ii in range(batch_size):
         this_y_hat = labels[ii]
@@ -45,7 +176,7 @@ def Sampling(type, epoch, epochs, X, Y, labels, predict, ignore_label: int = 255
                 X_[X_ptr, 0, :] = ade_x
                 Y_[X_ptr, 0, :] = ade_y
                 y_[X_ptr] = cls_id
-            else:  
+            else:
                 if "adapt_excite" in type:
                     n = int(type.split('_')[-1])
                     indices = eval("SamplesModel." + "adapt_excite")(this_y_hat, this_y, cls_id, n)
@@ -59,6 +190,6 @@ def Sampling(type, epoch, epochs, X, Y, labels, predict, ignore_label: int = 255
                     X_[X_ptr, 0, :] = torch.mean(X[ii, indices, :].squeeze(1), dim=0)
                     Y_[X_ptr, 0, :] = torch.mean(Y[ii, indices, :].squeeze(1), dim=0)
                     y_[X_ptr] = cls_id
-                X_ptr += 1
+            X_ptr += 1
 
     return X_, Y_, y_, X_.detach(), Y_.detach(), y_.detach()
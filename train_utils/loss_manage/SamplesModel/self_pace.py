@@ -1,10 +1,6 @@
 import torch
 
-def self_pace_ploy(epoch, epochs, this_y_hat, this_y, cls_id):
-    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-    num_hard = hard_indices.shape[0]
-    num_easy = easy_indices.shape[0]
+def self_pace_ploy_keep(epoch, epochs, num_hard, num_easy):
     sum = num_hard + num_easy
 
     # >>>> 核心修改部分
@@ -19,44 +15,22 @@ def self_pace_ploy(epoch, epochs, this_y_hat, this_y, cls_id):
     num_easy_keep = round(num_easy * easy)
     # <<<<
 
-    perm = torch.randperm(num_hard)
-    hard_indices = hard_indices[perm[:num_hard_keep]]
-    perm = torch.randperm(num_easy)
-    easy_indices = easy_indices[perm[:num_easy_keep]] 
-    indices = torch.cat((hard_indices, easy_indices), dim=0)
-    
-    return indices
-
-def self_pace_step(epoch, epochs, this_y_hat, this_y, cls_id):
-    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-    num_hard = hard_indices.shape[0]
-    num_easy = easy_indices.shape[0]
+    return num_hard_keep, num_easy_keep
 
+def self_pace_step_keep(epoch, epochs, num_hard, num_easy):
     # >>>> 核心修改部分
     n = 2
     step = (epoch/epochs)
     rate_hard = step**(1/n) # y= x^0.5
     rate_easy = (step + 1)**(-n)  # y= (x+1)^-2
- 
+
     num_hard_keep = round(rate_hard * num_hard)
     num_easy_keep = round(rate_easy * num_easy)
     # <<<<
 
-    perm = torch.randperm(num_hard)
-    hard_indices = hard_indices[perm[:num_hard_keep]]
-    perm = torch.randperm(num_easy)
-    easy_indices = easy_indices[perm[:num_easy_keep]] 
-    indices = torch.cat((hard_indices, easy_indices), dim=0)
-    
-    return indices
-
-def self_pace_epochs(epoch, epochs, this_y_hat, this_y, cls_id):
-    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-    num_hard = hard_indices.shape[0]
-    num_easy = easy_indices.shape[0]
+    return num_hard_keep, num_easy_keep
 
+def self_pace_epochs_keep(epoch, epochs, num_hard, num_easy):
     # >>>> 核心修改部分
     rate_hard = (epoch/epochs)
     easy_hard = 1 - rate_hard
@@ -65,20 +39,9 @@ def self_pace_epochs(epoch, epochs, this_y_hat, this_y, cls_id):
     num_easy_keep = round(rate_easy_threshold * num_easy)
     # <<<<
 
-    perm = torch.randperm(num_hard)
-    hard_indices = hard_indices[perm[:num_hard_keep]]
-    perm = torch.randperm(num_easy)
-    easy_indices = easy_indices[perm[:num_easy_keep]] 
-    indices = torch.cat((hard_indices, easy_indices), dim=0)
-    
-    return indices
-
-def self_pace3(epoch, epochs, this_y_hat, this_y, cls_id):
-    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-    num_hard = hard_indices.shape[0]
-    num_easy = easy_indices.shape[0]
+    return num_hard_keep, num_easy_keep
 
+def self_pace3_keep(epoch, epochs, num_hard, num_easy):
     # >>>>
     archor = epochs//3
     if  archor > epoch:
@@ -92,10 +55,32 @@ def self_pace3(epoch, epochs, this_y_hat, this_y, cls_id):
         num_hard_keep = num_hard
     # <<<<
 
+    return num_hard_keep, num_easy_keep
+
+def _self_pace_select(keep, epoch, epochs, this_y_hat, this_y, cls_id):
+    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
+    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
+    num_hard = hard_indices.shape[0]
+    num_easy = easy_indices.shape[0]
+
+    num_hard_keep, num_easy_keep = keep(epoch, epochs, num_hard, num_easy)
+
     perm = torch.randperm(num_hard)
     hard_indices = hard_indices[perm[:num_hard_keep]]
     perm = torch.randperm(num_easy)
-    easy_indices = easy_indices[perm[:num_easy_keep]] 
+    easy_indices = easy_indices[perm[:num_easy_keep]]
     indices = torch.cat((hard_indices, easy_indices), dim=0)
-    
+
     return indices
+
+def self_pace_ploy(epoch, epochs, this_y_hat, this_y, cls_id):
+    return _self_pace_select(self_pace_ploy_keep, epoch, epochs, this_y_hat, this_y, cls_id)
+
+def self_pace_step(epoch, epochs, this_y_hat, this_y, cls_id):
+    return _self_pace_select(self_pace_step_keep, epoch, epochs, this_y_hat, this_y, cls_id)
+
+def self_pace_epochs(epoch, epochs, this_y_hat, this_y, cls_id):
+    return _self_pace_select(self_pace_epochs_keep, epoch, epochs, this_y_hat, this_y, cls_id)
+
+def self_pace3(epoch, epochs, this_y_hat, this_y, cls_id):
+    return _self_pace_select(self_pace3_keep, epoch, epochs, this_y_hat, this_y, cls_id)
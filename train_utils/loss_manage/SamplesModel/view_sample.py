@@ -0,0 +1,206 @@
+import torch
+
+from .sample_manage import LABEL_BINS
+
+# 随机键的位数: 排序键 = 分组编号 << RANDOM_BITS | 随机数, 一次排序即可在每个分组内随机打乱
+RANDOM_BITS = 31
+
+
+def balanced_keep(num_hard, num_easy, n_view):
+    """
+    原 Hard_anchor_sampling 的规则: 难/易各取一半, 某一种不足一半时由另一种补齐.
+    两种都不足一半时 (原实现 raise Exception) 全部保留, 不足 n_view 的位置在 valid 中标记为无效.
+    """
+    half = n_view / 2
+    both = (num_hard >= half) & (num_easy >= half)
+    num_hard_keep = torch.where(both, torch.full_like(num_hard, n_view // 2),
+                                torch.where(num_hard >= half, n_view - num_easy, num_hard))
+    num_easy_keep = torch.where(both, torch.full_like(num_easy, n_view - n_view // 2),
+                                torch.where(num_hard >= half, num_easy,
+                                            torch.where(num_easy >= half, n_view - num_hard, num_easy)))
+    return num_hard_keep, num_easy_keep
+
+
+def easy_keep(num_hard, num_easy, n_view):
+    return torch.zeros_like(num_hard), num_easy.clamp(max=n_view)
+
+
+def hard_keep(num_hard, num_easy, n_view):
+    return num_hard.clamp(max=n_view), torch.zeros_like(num_easy)
+
+
+def self_pace3_view_keep(epoch, epochs):
+    # 前 1/3 个 epoch 只取易样本, 中间 1/3 难易各半, 最后 1/3 只取难样本
+    archor = epochs // 3
+    if archor > epoch:
+        return easy_keep
+    elif 2 * archor > epoch:
+        return balanced_keep
+    return hard_keep
+
+
+def self_pace2_view_keep(epoch, epochs):
+    # 前一半 epoch 只取易样本, 之后难易各半
+    return easy_keep if epochs // 2 > epoch else balanced_keep
+
+
+def proportion_keep(num_hard, num_easy, n_view):
+    """
+    SELFPACEDoublePixelContrastLoss 的规则: 按该类别中易样本的比例决定
+    (易样本少于 1/3 只取易样本, 1/3 ~ 2/3 难易各半, 多于 2/3 只取难样本).
+    """
+    archor = (num_hard + num_easy) // 3
+    num_hard_keep, num_easy_keep = balanced_keep(num_hard, num_easy, n_view)
+    easy_only = archor > num_easy
+    hard_only = ~easy_only & (2 * archor <= num_easy)
+    num_hard_keep = torch.where(easy_only, torch.zeros_like(num_hard),
+                                torch.where(hard_only, num_hard.clamp(max=n_view), num_hard_keep))
+    num_easy_keep = torch.where(easy_only, num_easy.clamp(max=n_view),
+                                torch.where(hard_only, torch.zeros_like(num_easy), num_easy_keep))
+    return num_hard_keep, num_easy_keep
+
+
+def view_sampling(X, Y, y_hat, y, keep=balanced_keep, ignore_label: int = 255, max_views: int = 50,
+                  max_samples: int = 1024, split: bool = True):
+    """
+    固定视角数的类别锚点采样: 每张图中像素数大于 max_views 的类别作为一个锚点, 取 n_view 个像素
+    (难样本在前, 易样本在后), n_view = min(max_samples // 锚点数, max_views).
+
+    每个像素的分组为 (图像, 类别, 难/易), 给每个像素一个随机键后按 (分组, 随机键) 排一次序,
+    组内名次小于 keep 给出的保留个数的像素被选中, 代替逐类别 nonzero() + randperm 的循环.
+    只有各分组的像素个数拷贝回 host 一次 (决定输出形状).
+
+    Args:
+        X, Y (Tensor[B, P, D]): 两路特征
+        y_hat (Tensor[B, P]): 标注; y (Tensor[B, P]): 预测
+        keep: (num_hard, num_easy, n_view) -> (num_hard_keep, num_easy_keep), 输入输出为 host 上的 long tensor
+        split (bool): False 时不区分难/易, 每个类别的全部像素都作为难样本分组 (Random_sampling)
+    Returns:
+        X_, Y_ (Tensor[total_classes, n_view, D]), y_ (Tensor[total_classes]),
+        valid (Tensor[total_classes, n_view] bool or None): 选中像素不足 n_view 时才有无效位置 (特征为 0),
+            全部有效时为 None. 没有锚点时 total_classes == 0.
+    """
+    batch_size, num_pixel, feat_dim = X.shape
+    num_keys = batch_size * LABEL_BINS
+    device = X.device
+    dtype = torch.promote_types(X.dtype, torch.float)
+
+    y_hat = y_hat.reshape(batch_size, -1)
+    y = y.reshape(batch_size, -1)
+    valid_pixel = y_hat != ignore_label
+    keys = torch.arange(batch_size, device=device).view(-1, 1) * LABEL_BINS + y_hat.clamp(0, LABEL_BINS - 1)
+    easy = valid_pixel & (y == y_hat) if split else torch.zeros_like(valid_pixel)
+    # 分组编号: 2 * key 为难样本, 2 * key + 1 为易样本, ignore 的像素放到最后一个分组
+    group = torch.where(valid_pixel, keys * 2 + easy.long(), torch.full_like(keys, 2 * num_keys)).view(-1)
+
+    count = torch.bincount(group, minlength=2 * num_keys + 1)
+    stats = count[:-1].view(num_keys, 2).cpu()
+    num_hard, num_easy = stats[:, 0], stats[:, 1]
+    rows = ((num_hard + num_easy) > max_views).nonzero().view(-1)
+    total_classes = rows.shape[0]
+
+    if total_classes == 0:
+        empty = torch.zeros((0, 1, feat_dim), dtype=dtype, device=device)
+        return empty, empty.clone(), torch.zeros(0, dtype=dtype, device=device), None
+
+    n_view = min(max_samples // total_classes, max_views)
+    num_hard_keep, num_easy_keep = keep(num_hard[rows], num_easy[rows], n_view)
+    num_hard_keep = torch.min(num_hard_keep.clamp(min=0), num_hard[rows])
+    num_easy_keep = torch.min(num_easy_keep.clamp(min=0), num_easy[rows])
+    all_valid = bool(((num_hard_keep + num_easy_keep) >= n_view).all())
+
+    # 每个分组保留的个数、在输出中的行号和起始列 (难样本从第 0 列开始, 易样本接在难样本之后)
+    group_keep = torch.zeros(2 * num_keys + 1, dtype=torch.long)
+    group_keep[2 * rows] = num_hard_keep
+    group_keep[2 * rows + 1] = num_easy_keep
+    group_col = torch.zeros(2 * num_keys + 1, dtype=torch.long)
+    group_col[2 * rows + 1] = num_hard_keep
+    group_row = torch.zeros(num_keys + 1, dtype=torch.long)
+    group_row[rows] = torch.arange(total_classes)
+    group_keep = group_keep.to(device, non_blocking=True)
+    group_col = group_col.to(device, non_blocking=True)
+    group_row = group_row.to(device, non_blocking=True)
+
+    # 按 (分组, 随机键) 一次排序, 组内名次即随机排列后的位置
+    rand = torch.randint(0, 2 ** RANDOM_BITS, group.shape, device=device)
+    order = torch.sort((group << RANDOM_BITS) | rand)[1]
+    sorted_group = group[order]
+    start = count.cumsum(0) - count
+    rank = torch.arange(group.shape[0], device=device) - start[sorted_group]
+
+    # 选中的像素写到 (行, 列), 其余写到最后一个垃圾位置
+    num_slots = total_classes * n_view
+    slot = group_row[sorted_group // 2] * n_view + group_col[sorted_group] + rank
+    slot = torch.where(rank < group_keep[sorted_group], slot, torch.full_like(slot, num_slots))
+    src = torch.zeros(num_slots + 1, dtype=torch.long, device=device).scatter_(0, slot, order)[:num_slots]
+
+    X_ = X.reshape(-1, feat_dim)[src].to(dtype).view(total_classes, n_view, feat_dim)
+    Y_ = Y.reshape(-1, feat_dim)[src].to(dtype).view(total_classes, n_view, feat_dim)
+    y_ = (rows % LABEL_BINS).to(device=device, dtype=dtype)
+
+    valid = None
+    if not all_valid:
+        valid = torch.zeros(num_slots + 1, dtype=torch.bool, device=device).scatter_(0, slot, True)[:num_slots]
+        valid = valid.view(total_classes, n_view)
+        X_ = torch.where(valid.unsqueeze(-1), X_, torch.zeros_like(X_))
+        Y_ = torch.where(valid.unsqueeze(-1), Y_, torch.zeros_like(Y_))
+
+    return X_, Y_, y_, valid
+
+
+def compact_views(X_, Y_, y_, valid):
+    """
+    有无效位置时把有效的视角展开成 [M, 1, D], 每个视角单独一行并重复类别标签.
+    n_view 系列对比损失只依赖 (特征, 类别) 对的集合, 与按视角展平的结果相同; valid 为 None 时原样返回.
+    注意原 Self_pace3 / Self_pace2 采样在不足 n_view 的行补 0 特征并参与对比, 这里去掉了补的 0, 这种情况下损失与原实现不同.
+    """
+    if valid is None:
+        return X_, Y_, y_
+    y_ = y_.view(-1, 1).expand_as(valid)[valid]
+    return X_[valid].unsqueeze(1), Y_[valid].unsqueeze(1), y_
+
+
+def view_sampling_loop(X, Y, y_hat, y, keep=balanced_keep, ignore_label: int = 255, max_views: int = 50,
+                       max_samples: int = 1024, split: bool = True):
+    # 逐图像、逐类别 nonzero() + randperm 的参考实现 (原 Hard_anchor_sampling), 仅用于 benchmarks 中校验 view_sampling
+    batch_size, feat_dim = X.shape[0], X.shape[-1]
+    dtype = torch.promote_types(X.dtype, torch.float)
+
+    classes = []
+    for ii in range(batch_size):
+        this_y = y_hat[ii]
+        this_classes = [x for x in torch.unique(this_y) if x != ignore_label]
+        classes.append([x for x in this_classes if (this_y == x).nonzero().shape[0] > max_views])
+    total_classes = sum(len(c) for c in classes)
+    if total_classes == 0:
+        empty = torch.zeros((0, 1, feat_dim), dtype=dtype, device=X.device)
+        return empty, empty.clone(), torch.zeros(0, dtype=dtype, device=X.device), None
+
+    n_view = min(max_samples // total_classes, max_views)
+    X_ = torch.zeros((total_classes, n_view, feat_dim), dtype=dtype, device=X.device)
+    Y_ = torch.zeros((total_classes, n_view, feat_dim), dtype=dtype, device=X.device)
+    y_ = torch.zeros(total_classes, dtype=dtype, device=X.device)
+    valid = torch.zeros((total_classes, n_view), dtype=torch.bool, device=X.device)
+
+    X_ptr = 0
+    for ii in range(batch_size):
+        this_y_hat = y_hat[ii]
+        this_y = y[ii] if split else y_hat[ii] + 1
+        for cls_id in classes[ii]:
+            hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
+            easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
+            num_hard, num_easy = torch.tensor([hard_indices.shape[0]]), torch.tensor([easy_indices.shape[0]])
+            num_hard_keep, num_easy_keep = keep(num_hard, num_easy, n_view)
+
+            hard_indices = hard_indices[torch.randperm(int(num_hard))[:int(num_hard_keep)]]
+            easy_indices = easy_indices[torch.randperm(int(num_easy))[:int(num_easy_keep)]]
+            indices = torch.cat((hard_indices, easy_indices), dim=0)
+
+            temp = indices.shape[0]
+            X_[X_ptr, :temp, :] = X[ii, indices, :].squeeze(1)
+            Y_[X_ptr, :temp, :] = Y[ii, indices, :].squeeze(1)
+            valid[X_ptr, :temp] = True
+            y_[X_ptr] = cls_id
+            X_ptr += 1
+
+    return X_, Y_, y_, (None if bool(valid.all()) else valid)
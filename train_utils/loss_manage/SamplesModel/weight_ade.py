@@ -1,10 +1,7 @@
 import math
 
-def weight_ade(this_y_hat, this_y, cls_id, ade):
-    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-    num_hard = hard_indices.shape[0]
-    num_easy = easy_indices.shape[0]
+def weight_ade_weights(num_hard, num_easy, ade):
+    # num_hard / num_easy 可以是 int，也可以是按类别统计的 tensor
     sum = num_hard + num_easy
 
     # >>>> 核心修改部分
@@ -16,6 +13,16 @@ def weight_ade(this_y_hat, this_y, cls_id, ade):
     easy = (easy_rate + 1)**(-n)  # y= (x+1)^-8
 
     # <<<<
+
+    return hard, easy
+
+def weight_ade(this_y_hat, this_y, cls_id, ade):
+    hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
+    easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
+    num_hard = hard_indices.shape[0]
+    num_easy = easy_indices.shape[0]
+
+    hard, easy = weight_ade_weights(num_hard, num_easy, ade)
     
     return hard_indices, easy_indices, hard, easy
 
@@ -41,4 +48,4 @@ def weight_ade_softmax(this_y_hat, this_y, cls_id, ade):
 
     # <<<<
     
-    return hard_indices, easy_indices, hard, easy
\ No newline at end of file
+    return hard_indices, easy_indices, hard, easy
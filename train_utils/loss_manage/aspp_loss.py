@@ -1,23 +1,23 @@
 import torch
 import torch.nn as nn
+from Models.memory_bank import use_memory_bank
+from train_utils.distributed_utils import all_gather_queue_samples
+from train_utils.step_timer import region
 from .SamplesModel import Sampling
+from .contrastive import contrastive_loss
+from .pyramid import downsample_labels
 
-def sample_negative(Q, Q_label):
+def sample_negative(Q, Q_label, Q_valid=None):
+    # 并行队列 [class_num, cache_size, feat_size] 展平成串行, 每个位置对应自己的 label
+    # 还没有写入过的位置不在这里去掉 (布尔索引需要同步), 返回展平的 valid 交给 contrastive_loss mask
     class_num, cache_size, feat_size = Q.shape
 
-    X_ = torch.zeros((class_num * cache_size, feat_size)).float().cuda()
-    y_ = torch.zeros((class_num * cache_size, 1)).float().cuda()
-    sample_ptr = 0
-    for ii in range(class_num):
-        # if ii == 0: continue
-        this_q = Q[ii, :cache_size, :]
-        # this_q_label = Q_label[ii, :cache_size]
+    X_ = Q.reshape(class_num * cache_size, feat_size)
+    y_ = Q_label.reshape(class_num * cache_size, 1)
+    if Q_valid is not None:
+        Q_valid = Q_valid.reshape(-1)
 
-        X_[sample_ptr:sample_ptr + cache_size, :] = this_q
-        y_[sample_ptr:sample_ptr + cache_size, :] = torch.transpose(Q_label, 0, 1)
-        sample_ptr += cache_size
-
-    return X_, y_
+    return X_, y_, Q_valid
 
 def dequeue_and_enqueue(args, keys, key_y, labels,
                         encode_queue, encode_queue_ptr,
@@ -147,8 +147,8 @@ def dequeue_and_enqueue_self_seri(args, keys, key_y, labels,
 
             code_queue_label[lb, ptr:ptr + K] = lbe
 
-def Contrastive(feats_x, feats_y, labels_, queue=None, queue_label=None, type: str = 'intra', temperature: float = 0.1, base_temperature: float = 0.07):
-    anchor_num, n_view = feats_x.shape[0], feats_x.shape[1]
+def Contrastive(feats_x, feats_y, labels_, queue=None, queue_label=None, queue_valid=None, type: str = 'intra', temperature: float = 0.1, base_temperature: float = 0.07, chunk_size: int = 0):
+    n_view = feats_x.shape[1]
 
     feature_x = torch.cat(torch.unbind(feats_x, dim=1), dim=0)
     feature_y = torch.cat(torch.unbind(feats_y, dim=1), dim=0)
@@ -169,97 +169,36 @@ def Contrastive(feats_x, feats_y, labels_, queue=None, queue_label=None, type: s
         contrast_feature= feature_x
         anchor_count = n_view
         contrast_count = n_view
-         
-    # 基础mask
-    labels_ = labels_.contiguous().view(-1, 1)
-    labels_T = labels_
-    mask = torch.eq(labels_, torch.transpose(labels_T, 0, 1)).float().cuda()
-    mask = mask.repeat(anchor_count, contrast_count)
-    
-    if queue is not None:
-        queue_feature, queue_label = sample_negative(queue, queue_label) # 并行队列变形成串行
-
-        # 增加queue特征
-        contrast_feature = torch.cat([contrast_feature, queue_feature], dim=0)
-
-        # 增加queue mask
-        queue_label = queue_label.contiguous().view(-1, 1)
-        mask_queue = torch.eq(labels_, torch.transpose(queue_label, 0, 1)).float().cuda()
-        mask_queue = mask_queue.repeat(anchor_count, 1)
-        # 更新mask
-        mask = torch.cat([mask, mask_queue], dim=1)
-
-
-    # 计算对比logits
-    anchor_dot_contrast = torch.div(torch.matmul(anchor_feature, torch.transpose(contrast_feature, 0, 1)), temperature)
-    logits_max, _ = torch.max(anchor_dot_contrast, dim=1, keepdim=True)
-    logits = anchor_dot_contrast - logits_max.detach()
-    logits = anchor_dot_contrast
-
-    # mask对角线logits(自身对比部分)
-    logits_mask = torch.ones_like(mask).scatter_(1,
-                                                torch.arange(anchor_num * anchor_count).view(-1, 1).cuda(),
-                                                0)
-    # 正样本mask
-    ops_mask = mask * logits_mask
-    if type == "inter":
-        ops_mask = mask
-    # 负样本mask
-    neg_mask = 1 - mask
 
-    # 负样本对比总和
-    exp_logits = torch.exp(logits)
-    neg_logits = exp_logits * neg_mask
-    neg_logits = neg_logits.sum(1, keepdim=True)
+    labels_ = labels_.contiguous().view(-1)
 
-    # 防止出现都正样本个数为0的情况
-    ops_mask_num = ops_mask.sum(1)
-    for i in range(len(ops_mask_num)):
-        if ops_mask_num[i] == 0:
-            ops_mask_num[i] = 1 
-
-    # 计算对比损失
-    log_prob = logits - torch.log(exp_logits + neg_logits)
-    mean_log_prob_pos = (ops_mask * log_prob).sum(1) / ops_mask_num
-    loss = - (temperature / base_temperature) * mean_log_prob_pos
-    loss = loss.mean()
+    queue_feature = None
+    if queue is not None:
+        queue_feature, queue_label, queue_valid = sample_negative(queue, queue_label, queue_valid) # 并行队列变形成串行
 
-    return loss
+    # inter 的正样本包含同一像素的另一视角, 不去掉对角线
+    return contrastive_loss(anchor_feature, contrast_feature,
+                            labels_.repeat(anchor_count), labels_.repeat(contrast_count),
+                            queue_feature, queue_label,
+                            exclude_self=(type != "inter"), subtract_max=False,
+                            temperature=temperature, base_temperature=base_temperature, chunk_size=chunk_size,
+                            queue_valid=queue_valid)
 
 
 def ASPP_CONTRAST_Loss(args, epoch, epochs, x, labels=None, predict=None):
     feats = x[0]
     feats_y = x[1]
 
-    labels = labels.unsqueeze(1).float().clone()
-    labels = torch.nn.functional.interpolate(labels,
-                                                (feats.shape[2], feats.shape[3]), mode='nearest')
-    labels = labels.squeeze(1).long()
+    labels = downsample_labels(labels, feats.shape[2:])
     assert labels.shape[-1] == feats.shape[-1], '{} {}'.format(labels.shape, feats.shape)
 
     queue=None
     queue_label=None
-    if args.memory_size:
-        queue_origin = x[2]
-        # queue = queue_origin
-
-        if "encode_queue" in queue_origin:
-            encode_queue = queue_origin['encode_queue']
-            encode_queue_label = queue_origin['code_queue_label']
-        else:
-            encode_queue = None
-
-        # if "decode_queue" in queue:
-        #     decode_queue = queue['decode_queue']
-        #     decode_queue_label = queue['code_queue_label']
-        # else:
-        #     decode_queue = None
-
-        # if encode_queue is not None and decode_queue is not None:
-        #     queue = torch.cat((encode_queue, decode_queue), dim=1)
-        #     queue_label = torch.cat((encode_queue_label, decode_queue_label), dim=1)
-        queue = encode_queue
-        queue_label = encode_queue_label
+    queue_valid=None
+    bank = None
+    if use_memory_bank(args):
+        bank = x[2]
+        queue, queue_label, queue_valid = bank.snapshot()
 
     batch_size = feats.shape[0]
 
@@ -272,17 +211,22 @@ def ASPP_CONTRAST_Loss(args, epoch, epochs, x, labels=None, predict=None):
     feats_y = feats_y.contiguous().view(feats_y.shape[0], -1, feats_y.shape[-1])
 
     type = args.sample
-    feats_, feats_y_, labels_, feats_que_, feats_y_que_, labels_queue_ = Sampling(type, epoch, epochs, feats, feats_y, labels, predict)
+    with region("sampling"):
+        feats_, feats_y_, labels_, feats_que_, feats_y_que_, labels_queue_ = Sampling(type, epoch, epochs, feats, feats_y, labels, predict)
     # feats_, feats_y_, labels_ = Random_sampling(feats, feats_y, labels, predict)
 
     if feats_ != None:
-        loss = Contrastive(feats_, feats_y_, labels_, queue, queue_label)
-        if args.memory_size:
-            dequeue_and_enqueue_self_seri(args, feats_que_, feats_y_que_, labels_queue_,
-                                            encode_queue=queue_origin['encode_queue'],
-                                            encode_queue_ptr=queue_origin['encode_queue_ptr'],
-                                            code_queue_label=queue_origin['code_queue_label'])
+        with region("contrastive"):
+            loss = Contrastive(feats_, feats_y_, labels_, queue, queue_label, queue_valid, chunk_size=getattr(args, "contrast_chunk", 0))
     else:
         loss = 0
 
+    if bank is not None:
+        with region("enqueue"):
+            # 没有采样到特征的 rank 也要参与 all_gather
+            if getattr(args, "memory_gather", False):
+                feats_que_, labels_queue_ = all_gather_queue_samples(feats_que_, labels_queue_,
+                                                                     batch_size * args.num_classes, bank.dim)
+            bank.enqueue(feats_que_, labels_queue_)
+
     return loss
\ No newline at end of file
@@ -0,0 +1,105 @@
+import inspect
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+# torch>=1.11 才支持非重入的 checkpoint (可配合 autograd.grad 使用)
+_CHECKPOINT_KWARGS = {"use_reentrant": False} if "use_reentrant" in inspect.signature(checkpoint).parameters else {}
+
+
+def _contrastive_rows(anchor_feature, contrast_feature, anchor_labels, contrast_labels, row_offset,
+                      exclude_self: bool, subtract_max: bool, temperature: float, contrast_valid=None):
+    """
+    计算一组 anchor 行的正样本平均 log 概率 (mean_log_prob_pos).
+    label 相等的 mask 在这里按块即时生成 (bool), 不再构造 repeat 后的 float 稠密矩阵.
+    各输入可以带相同的前导维度 (如多层特征 [L, N, D]), 按层做批量矩阵乘;
+    contrast_valid 为 False 的对比列 (未写入的队列位置) 既不算正样本也不算负样本.
+    """
+    logits = torch.div(torch.matmul(anchor_feature, torch.transpose(contrast_feature, -2, -1)), temperature)
+    if subtract_max:
+        logits_max, _ = torch.max(logits, dim=-1, keepdim=True)
+        logits = logits - logits_max.detach()
+
+    # 基础mask
+    mask = torch.eq(anchor_labels.unsqueeze(-1), contrast_labels.unsqueeze(-2))
+    # 正样本mask (去掉与自身对比的对角线)
+    ops_mask = mask
+    if exclude_self:
+        rows = torch.arange(anchor_feature.shape[-2], device=logits.device) + row_offset
+        cols = torch.arange(contrast_feature.shape[-2], device=logits.device)
+        ops_mask = mask & (rows.view(-1, 1) != cols.view(1, -1))
+    neg_mask = mask
+    if contrast_valid is not None:
+        contrast_valid = contrast_valid.unsqueeze(-2)
+        ops_mask = ops_mask & contrast_valid
+        neg_mask = mask | ~contrast_valid
+
+    # 负样本对比总和
+    exp_logits = torch.exp(logits)
+    neg_logits = torch.where(neg_mask, torch.zeros_like(exp_logits), exp_logits).sum(-1, keepdim=True)
+
+    log_prob = logits - torch.log(exp_logits + neg_logits)
+    pos_log_prob = torch.where(ops_mask, log_prob, torch.zeros_like(log_prob)).sum(-1)
+    # 防止出现正样本个数为0的情况
+    ops_mask_num = ops_mask.sum(-1).clamp(min=1).to(pos_log_prob.dtype)
+
+    return pos_log_prob / ops_mask_num
+
+
+def contrastive_loss(anchor_feature, contrast_feature, anchor_labels, contrast_labels,
+                     queue_feature=None, queue_label=None, exclude_self: bool = True, subtract_max: bool = False,
+                     temperature: float = 0.1, base_temperature: float = 0.07, chunk_size: int = 0, queue_valid=None):
+    """
+    像素对比损失的公共实现.
+
+    Args:
+        anchor_feature (Tensor[N_a, D]) / anchor_labels (Tensor[N_a]): anchor 特征及其类别
+        contrast_feature (Tensor[N_c, D]) / contrast_labels (Tensor[N_c]): 对比特征及其类别,
+            第 i 个 anchor 与第 i 个 contrast 视为自身 (exclude_self=True 时不作为正样本)
+        queue_feature (Tensor[N_q, D], optional) / queue_label (Tensor[N_q]): 追加到对比集合的队列特征
+        queue_valid (Tensor[N_q], optional): 队列中已经写入过的位置, 其余位置不参与对比
+        subtract_max (bool): 是否对每行 logits 减去最大值
+        chunk_size (int): 大于 0 时按 anchor 行分块计算并在反向时重算, 显存只占用
+            chunk_size x (N_c + N_q) 的 logits, 不再完整保留 anchor x contrast 矩阵
+    特征可以带前导维度 L ([L, N, D], 多层特征一次计算), label 为 [N] (各层共用) 或 [L, N];
+    此时返回每层的损失 Tensor[L].
+    """
+    anchor_labels = anchor_labels.contiguous()
+    contrast_labels = contrast_labels.contiguous().to(anchor_labels.dtype)
+    if anchor_feature.dim() == 2:
+        anchor_labels = anchor_labels.view(-1)
+        contrast_labels = contrast_labels.view(-1)
+
+    contrast_valid = None
+    if queue_feature is not None:
+        queue_label = queue_label.contiguous().to(anchor_labels.dtype)
+        if anchor_feature.dim() == 2:
+            queue_label = queue_label.view(-1)
+        # 各层共用的 label 扩展到和队列 label 相同的前导维度
+        contrast_labels = contrast_labels.expand(queue_label.shape[:-1] + contrast_labels.shape[-1:])
+        if queue_valid is not None:
+            contrast_valid = torch.cat([torch.ones_like(contrast_labels, dtype=torch.bool),
+                                        queue_valid.expand(queue_label.shape)], dim=-1)
+        contrast_feature = torch.cat([contrast_feature, queue_feature.to(contrast_feature.dtype)], dim=-2)
+        contrast_labels = torch.cat([contrast_labels, queue_label], dim=-1)
+
+    num_anchor = anchor_feature.shape[-2]
+    if chunk_size <= 0 or chunk_size >= num_anchor:
+        mean_log_prob_pos = _contrastive_rows(anchor_feature, contrast_feature, anchor_labels, contrast_labels, 0,
+                                              exclude_self, subtract_max, temperature, contrast_valid)
+    else:
+        mean_log_prob_pos = []
+        for start in range(0, num_anchor, chunk_size):
+            end = min(start + chunk_size, num_anchor)
+            fn = lambda a, c, start=start, end=end: _contrastive_rows(a, c, anchor_labels[..., start:end], contrast_labels, start,
+                                                                      exclude_self, subtract_max, temperature, contrast_valid)
+            if torch.is_grad_enabled() and (anchor_feature.requires_grad or contrast_feature.requires_grad):
+                mean_log_prob_pos.append(checkpoint(fn, anchor_feature[..., start:end, :], contrast_feature, **_CHECKPOINT_KWARGS))
+            else:
+                mean_log_prob_pos.append(fn(anchor_feature[..., start:end, :], contrast_feature))
+        mean_log_prob_pos = torch.cat(mean_log_prob_pos, dim=-1)
+
+    loss = - (temperature / base_temperature) * mean_log_prob_pos
+    loss = loss.mean(-1)
+
+    return loss
@@ -1,5 +1,11 @@
 import torch
 import torch.nn as nn
+from Models.memory_bank import use_memory_bank
+from train_utils.distributed_utils import all_gather_queue_samples
+from train_utils.step_timer import region
+from .contrastive import contrastive_loss
+from .pyramid import downsample_labels
+from .SamplesModel import view_sampling, compact_views, self_pace3_view_keep, self_pace2_view_keep, hard_keep
 
 def Self_pace3_concat_sampling(epoch, epochs, X, Y, y_hat, y, ignore_label: int = 255, max_views: int = 50, max_samples: int = 1024):
     batch_size, feat_dim = X.shape[0], X.shape[-1]
@@ -16,14 +22,14 @@ def Self_pace3_concat_sampling(epoch, epochs, X, Y, y_hat, y, ignore_label: int
         total_classes += len(this_classes)
 
     if total_classes == 0:
-        return None, None
+        return None, None, None, None, None, None
 
     # n_view = max_samples // total_classes
     # n_view = min(n_view, max_views)
 
-    X_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.float).cuda()
-    Y_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
+    X_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.promote_types(X.dtype, torch.float), device=X.device)
+    Y_ = torch.zeros((total_classes, 1, feat_dim), dtype=torch.promote_types(X.dtype, torch.float), device=X.device)
+    y_ = torch.zeros(total_classes, dtype=torch.promote_types(X.dtype, torch.float), device=X.device)
     
 
     X_ptr = 0
@@ -66,219 +72,30 @@ def Self_pace3_concat_sampling(epoch, epochs, X, Y, y_hat, y, ignore_label: int
     return X_, Y_, y_, X_.detach(), X_.detach(), y_.detach()
 
 def Self_pace3_sampling(epoch, epochs, X, Y, y_hat, y, ignore_label: int = 255, max_views: int = 50, max_samples: int = 1024):
-    batch_size, feat_dim = X.shape[0], X.shape[-1]
-
-    classes = []
-    total_classes = 0
-    for ii in range(batch_size):
-        this_y = y_hat[ii]
-        this_classes = torch.unique(this_y)
-        this_classes = [x for x in this_classes if x != ignore_label]
-        this_classes = [x for x in this_classes if (this_y == x).nonzero().shape[0] > max_views]
-
-        classes.append(this_classes)
-        total_classes += len(this_classes)
-
-    if total_classes == 0:
-        return None, None
-
-    n_view = max_samples // total_classes
-    n_view = min(n_view, max_views)
-
-    X_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    Y_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
-    
-
-    X_ptr = 0
-    for ii in range(batch_size):
-        this_y_hat = y_hat[ii]
-        this_y = y[ii]
-        this_classes = classes[ii]
-
-        for cls_id in this_classes:
-            hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-            easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-
-            num_hard = hard_indices.shape[0]
-            num_easy = easy_indices.shape[0]
-
-            archor = epochs//3
-            if  archor > epoch:
-                num_hard_keep = 0
-                if num_easy > n_view:
-                    num_easy_keep = n_view
-                else:
-                    num_easy_keep = num_easy
-            elif 2*archor > epoch:
-                if num_hard >= n_view / 2 and num_easy >= n_view / 2:
-                    num_hard_keep = n_view // 2
-                    num_easy_keep = n_view - num_hard_keep
-                elif num_hard >= n_view / 2:
-                    num_easy_keep = num_easy
-                    num_hard_keep = n_view - num_easy_keep
-                elif num_easy >= n_view / 2:
-                    num_hard_keep = num_hard
-                    num_easy_keep = n_view - num_hard_keep
-                else:
-                    # Log.info('this shoud be never touched! {} {} {}'.format(num_hard, num_easy, n_view))
-                    raise Exception
-            else:
-                num_easy_keep = 0
-                if num_hard > n_view:
-                    num_hard_keep = n_view
-                else:
-                    num_hard_keep = num_hard
-
-            perm = torch.randperm(num_hard)
-            hard_indices = hard_indices[perm[:num_hard_keep]]
-            perm = torch.randperm(num_easy)
-            easy_indices = easy_indices[perm[:num_easy_keep]] 
-            indices = torch.cat((hard_indices, easy_indices), dim=0)
-
-            temp = indices.shape[0]
-            if temp != 0:
-                X_[X_ptr, 0:temp, :] = X[ii, indices, :].squeeze(1)
-                Y_[X_ptr, 0:temp, :] = Y[ii, indices, :].squeeze(1)
-                y_[X_ptr] = cls_id
-                X_ptr += 1
-
+    X_, Y_, y_, valid = view_sampling(X, Y, y_hat, y, self_pace3_view_keep(epoch, epochs), ignore_label, max_views, max_samples)
+    X_, Y_, y_ = compact_views(X_, Y_, y_, valid)
     return X_, Y_, y_, X_.detach(), X_.detach(), y_.detach()
 
 def Self_pace2_sampling(epoch, epochs, X, Y, y_hat, y, ignore_label: int = 255, max_views: int = 50, max_samples: int = 1024):
-    batch_size, feat_dim = X.shape[0], X.shape[-1]
-
-    classes = []
-    total_classes = 0
-    for ii in range(batch_size):
-        this_y = y_hat[ii]
-        this_classes = torch.unique(this_y)
-        this_classes = [x for x in this_classes if x != ignore_label]
-        this_classes = [x for x in this_classes if (this_y == x).nonzero().shape[0] > max_views]
-
-        classes.append(this_classes)
-        total_classes += len(this_classes)
-
-    if total_classes == 0:
-        return None, None
-
-    n_view = max_samples // total_classes
-    n_view = min(n_view, max_views)
-
-    X_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    Y_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
-
-    X_ptr = 0
-    for ii in range(batch_size):
-        this_y_hat = y_hat[ii]
-        this_y = y[ii]
-        this_classes = classes[ii]
-
-        for cls_id in this_classes:
-            hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-            easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-
-            num_hard = hard_indices.shape[0]
-            num_easy = easy_indices.shape[0]
-
-            archor = epochs//2
-            if  archor > epoch:
-                num_hard_keep = 0
-                if num_easy > n_view:
-                    num_easy_keep = n_view
-                else:
-                    num_easy_keep = num_easy
-            else:
-                if num_hard >= n_view / 2 and num_easy >= n_view / 2:
-                    num_hard_keep = n_view // 2
-                    num_easy_keep = n_view - num_hard_keep
-                elif num_hard >= n_view / 2:
-                    num_easy_keep = num_easy
-                    num_hard_keep = n_view - num_easy_keep
-                elif num_easy >= n_view / 2:
-                    num_hard_keep = num_hard
-                    num_easy_keep = n_view - num_hard_keep
-                else:
-                    # Log.info('this shoud be never touched! {} {} {}'.format(num_hard, num_easy, n_view))
-                    raise Exception
-
-            perm = torch.randperm(num_hard)
-            hard_indices = hard_indices[perm[:num_hard_keep]]
-            perm = torch.randperm(num_easy)
-            easy_indices = easy_indices[perm[:num_easy_keep]] 
-            indices = torch.cat((hard_indices, easy_indices), dim=0)
-
-            temp = indices.shape[0]
-            if temp != 0:
-                X_[X_ptr, 0:temp, :] = X[ii, indices, :].squeeze(1)
-                Y_[X_ptr, 0:temp, :] = Y[ii, indices, :].squeeze(1)
-                y_[X_ptr] = cls_id
-                X_ptr += 1
-
-    return X_, Y_, y_
+    X_, Y_, y_, valid = view_sampling(X, Y, y_hat, y, self_pace2_view_keep(epoch, epochs), ignore_label, max_views, max_samples)
+    return compact_views(X_, Y_, y_, valid)
 
 def Random_sampling(X, Y, y_hat, y, ignore_label: int = 255, max_views: int = 50, max_samples: int = 1024):
-    batch_size, feat_dim = X.shape[0], X.shape[-1]
-
-    classes = []
-    total_classes = 0
-    for ii in range(batch_size):
-        this_y = y_hat[ii]
-        this_classes = torch.unique(this_y)
-        this_classes = [x for x in this_classes if x != ignore_label]
-        this_classes = [x for x in this_classes if (this_y == x).nonzero().shape[0] > max_views]
+    # 不区分难/易, 每个类别随机取 n_view 个像素
+    X_, Y_, y_, valid = view_sampling(X, Y, y_hat, y, hard_keep, ignore_label, max_views, max_samples, split=False)
+    return compact_views(X_, Y_, y_, valid)
 
-        classes.append(this_classes)
-        total_classes += len(this_classes)
-
-    if total_classes == 0:
-        return None, None
-
-    n_view = max_samples // total_classes
-    n_view = min(n_view, max_views)
-
-    X_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    Y_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
-
-    X_ptr = 0
-    for ii in range(batch_size):
-        this_y_hat = y_hat[ii]
-        this_classes = classes[ii]
-
-        for cls_id in this_classes:
-            hard_indices = (this_y_hat == cls_id).nonzero()
-
-            num_hard = hard_indices.shape[0]
-
-            perm = torch.randperm(num_hard)
-            hard_indices = hard_indices[perm[:n_view]]
-            indices = hard_indices
-
-            X_[X_ptr, :, :] = X[ii, indices, :].squeeze(1)
-            Y_[X_ptr, :, :] = Y[ii, indices, :].squeeze(1)
-            y_[X_ptr] = cls_id
-            X_ptr += 1
-
-    return X_, Y_, y_
-
-def sample_negative(Q, Q_label):
+def sample_negative(Q, Q_label, Q_valid=None):
+    # 并行队列 [class_num, cache_size, feat_size] 展平成串行, 每个位置对应自己的 label
+    # 还没有写入过的位置不在这里去掉 (布尔索引需要同步), 返回展平的 valid 交给 contrastive_loss mask
     class_num, cache_size, feat_size = Q.shape
 
-    X_ = torch.zeros((class_num * cache_size, feat_size)).float().cuda()
-    y_ = torch.zeros((class_num * cache_size, 1)).float().cuda()
-    sample_ptr = 0
-    for ii in range(class_num):
-        # if ii == 0: continue
-        this_q = Q[ii, :cache_size, :]
-        # this_q_label = Q_label[ii, :cache_size]
+    X_ = Q.reshape(class_num * cache_size, feat_size)
+    y_ = Q_label.reshape(class_num * cache_size, 1)
+    if Q_valid is not None:
+        Q_valid = Q_valid.reshape(-1)
 
-        X_[sample_ptr:sample_ptr + cache_size, :] = this_q
-        y_[sample_ptr:sample_ptr + cache_size, :] = torch.transpose(Q_label, 0, 1)
-        sample_ptr += cache_size
-
-    return X_, y_
+    return X_, y_, Q_valid
 
 def dequeue_and_enqueue(args, keys, key_y, labels,
                         encode_queue, encode_queue_ptr,
@@ -408,111 +225,47 @@ def dequeue_and_enqueue_self_seri(args, keys, key_y, labels,
 
             code_queue_label[lb, ptr:ptr + K] = lbe
 
-def Contrastive(feats_, feats_y_, labels_, queue=None, queue_label=None, temperature: float = 0.1, base_temperature: float = 0.07):
-    anchor_num, n_view = feats_.shape[0], feats_.shape[1]
+def Contrastive(feats_, feats_y_, labels_, queue=None, queue_label=None, queue_valid=None, temperature: float = 0.1, base_temperature: float = 0.07, chunk_size: int = 0):
+    n_view = feats_.shape[1]
 
-    labels_ = labels_.contiguous().view(-1, 1)
+    labels_ = labels_.contiguous().view(-1)
     contrast_feature_y = torch.cat(torch.unbind(feats_y_, dim=1), dim=0)
 
     # 1*N
     anchor_feature = contrast_feature_y
     anchor_count = n_view
-    # n*n
-    # anchor_feature = contrast_feature
-    # anchor_count = contrast_count
-  
-    y_contrast = labels_
+
     contrast_count = n_view
     contrast_feature_x = torch.cat(torch.unbind(feats_, dim=1), dim=0)
-    # contrast_feature = torch.cat([contrast_feature_y, contrast_feature_x], dim=0)
     contrast_feature = contrast_feature_x
 
-    mask = torch.eq(labels_, torch.transpose(y_contrast, 0, 1)).float().cuda()
-    
-    mask = mask.repeat(anchor_count, contrast_count)
-    
-
+    X_contrast = None
+    y_contrast_queue = None
     if queue is not None:
-        X_contrast, y_contrast_queue = sample_negative(queue, queue_label) # 并行队列变形成串行
-
-        y_contrast_queue = y_contrast_queue.contiguous().view(-1, 1)
-        contrast_count_queue = 1
-        contrast_feature = torch.cat([contrast_feature, X_contrast], dim=0)
-        # contrast_feature = X_contrast
+        X_contrast, y_contrast_queue, queue_valid = sample_negative(queue, queue_label, queue_valid) # 并行队列变形成串行
 
-        mask_queue = torch.eq(labels_, torch.transpose(y_contrast_queue, 0, 1)).float().cuda()
-        mask_queue = mask_queue.repeat(anchor_count, contrast_count_queue)
-
-        mask = torch.cat([mask, mask_queue], dim=1)
-        # mask = mask_queue
-
-
-    anchor_dot_contrast = torch.div(torch.matmul(anchor_feature, torch.transpose(contrast_feature, 0, 1)),
-                                    temperature)
-    logits_max, _ = torch.max(anchor_dot_contrast, dim=1, keepdim=True)
-    logits = anchor_dot_contrast - logits_max.detach()
-
-    logits_mask = torch.ones_like(mask).scatter_(1,
-                                                torch.arange(anchor_num * anchor_count).view(-1, 1).cuda(),
-                                                0)
-    
-    ops_mask = mask * logits_mask
-    neg_mask = 1 - mask
-    
-    exp_logits = torch.exp(logits)
-
-    neg_logits = exp_logits * neg_mask
-    neg_logits = neg_logits.sum(1, keepdim=True)
-    
-
-    log_prob = logits - torch.log(exp_logits + neg_logits)
-
-    ops_mask_num = ops_mask.sum(1)
-    for i in range(len(ops_mask_num)):
-        if ops_mask_num[i] == 0:
-            ops_mask_num[i] = 1 
-
-    mean_log_prob_pos = (ops_mask * log_prob).sum(1) / ops_mask_num
-
-    loss = - (temperature / base_temperature) * mean_log_prob_pos
-    loss = loss.mean()
-
-    return loss
+    return contrastive_loss(anchor_feature, contrast_feature,
+                            labels_.repeat(anchor_count), labels_.repeat(contrast_count),
+                            X_contrast, y_contrast_queue,
+                            exclude_self=True, subtract_max=True,
+                            temperature=temperature, base_temperature=base_temperature, chunk_size=chunk_size,
+                            queue_valid=queue_valid)
 
 
 def EPOCHSELFPACEDoublePixelContrastLoss(args, epoch, epochs, x, labels=None, predict=None):
     feats = x[0]
     feats_y = x[1]
 
-    labels = labels.unsqueeze(1).float().clone()
-    labels = torch.nn.functional.interpolate(labels,
-                                                (feats.shape[2], feats.shape[3]), mode='nearest')
-    labels = labels.squeeze(1).long()
+    labels = downsample_labels(labels, feats.shape[2:])
     assert labels.shape[-1] == feats.shape[-1], '{} {}'.format(labels.shape, feats.shape)
 
     queue=None
     queue_label=None
-    if args.memory_size:
-        queue_origin = x[5]
-        # queue = queue_origin
-
-        if "encode_queue" in queue_origin:
-            encode_queue = queue_origin['encode_queue']
-            encode_queue_label = queue_origin['code_queue_label']
-        else:
-            encode_queue = None
-
-        # if "decode_queue" in queue:
-        #     decode_queue = queue['decode_queue']
-        #     decode_queue_label = queue['code_queue_label']
-        # else:
-        #     decode_queue = None
-
-        # if encode_queue is not None and decode_queue is not None:
-        #     queue = torch.cat((encode_queue, decode_queue), dim=1)
-        #     queue_label = torch.cat((encode_queue_label, decode_queue_label), dim=1)
-        queue = encode_queue
-        queue_label = encode_queue_label
+    queue_valid=None
+    bank = None
+    if use_memory_bank(args):
+        bank = x[5]
+        queue, queue_label, queue_valid = bank.snapshot()
 
     batch_size = feats.shape[0]
 
@@ -524,10 +277,15 @@ def EPOCHSELFPACEDoublePixelContrastLoss(args, epoch, epochs, x, labels=None, pr
     feats_y = feats_y.permute(0, 2, 3, 1)
     feats_y = feats_y.contiguous().view(feats_y.shape[0], -1, feats_y.shape[-1])
 
-    feats_, feats_y_, labels_, feats_que_, feats_y_que_, labels_queue_ = Self_pace3_concat_sampling(epoch, epochs, feats, feats_y, labels, predict)
+    with region("sampling"):
+        feats_, feats_y_, labels_, feats_que_, feats_y_que_, labels_queue_ = Self_pace3_concat_sampling(epoch, epochs, feats, feats_y, labels, predict)
     # feats_, feats_y_, labels_ = Random_sampling(feats, feats_y, labels, predict)
 
-    loss = Contrastive(feats_, feats_y_, labels_, queue, queue_label)
+    if feats_ is not None:
+        with region("contrastive"):
+            loss = Contrastive(feats_, feats_y_, labels_, queue, queue_label, queue_valid, chunk_size=getattr(args, "contrast_chunk", 0))
+    else:
+        loss = 0
 
     # 并行更新队列
     # if args.memory_size:
@@ -542,15 +300,11 @@ def EPOCHSELFPACEDoublePixelContrastLoss(args, epoch, epochs, x, labels=None, pr
     #                                 decode_queue=queue_origin['decode_queue'],
     #                                 decode_queue_ptr=queue_origin['decode_queue_ptr'])
 
-    if args.memory_size:
-        # dequeue_and_enqueue(args, feats_que, feats_y_que, labels_que,
-        #                     encode_queue=queue_origin['encode_queue'],
-        #                     encode_queue_ptr=queue_origin['encode_queue_ptr'],
-        #                     decode_queue=queue_origin['decode_queue'],
-        #                     decode_queue_ptr=queue_origin['decode_queue_ptr'])
-        dequeue_and_enqueue_self_seri(args, feats_que_, feats_y_que_, labels_queue_,
-                                        encode_queue=queue_origin['encode_queue'],
-                                        encode_queue_ptr=queue_origin['encode_queue_ptr'],
-                                        code_queue_label=queue_origin['code_queue_label'])
+    if bank is not None:
+        with region("enqueue"):
+            if getattr(args, "memory_gather", False):
+                feats_que_, labels_queue_ = all_gather_queue_samples(feats_que_, labels_queue_,
+                                                                     batch_size * args.num_classes, bank.dim)
+            bank.enqueue(feats_que_, labels_queue_)
 
     return loss
\ No newline at end of file
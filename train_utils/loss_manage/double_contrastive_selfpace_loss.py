@@ -1,88 +1,18 @@
 import torch
+from .pyramid import downsample_labels
+from .SamplesModel import view_sampling, compact_views, proportion_keep
 
 
 def Hard_anchor_sampling(X, Y, y_hat, y, ignore_label: int = 255, max_views: int = 50, max_samples: int = 1024):
-    batch_size, feat_dim = X.shape[0], X.shape[-1]
-
-    classes = []
-    total_classes = 0
-    for ii in range(batch_size):
-        this_y = y_hat[ii]
-        this_classes = torch.unique(this_y)
-        this_classes = [x for x in this_classes if x != ignore_label]
-        this_classes = [x for x in this_classes if (this_y == x).nonzero().shape[0] > max_views]
-
-        classes.append(this_classes)
-        total_classes += len(this_classes)
-
-    if total_classes == 0:
-        return None, None
-
-    n_view = max_samples // total_classes
-    n_view = min(n_view, max_views)
-
-    X_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    Y_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
-
-    X_ptr = 0
-    for ii in range(batch_size):
-        this_y_hat = y_hat[ii]
-        this_y = y[ii]
-        this_classes = classes[ii]
-
-        for cls_id in this_classes:
-            hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-            easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-
-            num_hard = hard_indices.shape[0]
-            num_easy = easy_indices.shape[0]
-            archor = (num_hard + num_easy)//3
-
-            if  archor > num_easy:
-                num_hard_keep = 0
-                if num_easy > n_view:
-                    num_easy_keep = n_view
-                else:
-                    num_easy_keep = num_easy
-            elif 2*archor > num_easy:
-                if num_hard >= n_view / 2 and num_easy >= n_view / 2:
-                    num_hard_keep = n_view // 2
-                    num_easy_keep = n_view - num_hard_keep
-                elif num_hard >= n_view / 2:
-                    num_easy_keep = num_easy
-                    num_hard_keep = n_view - num_easy_keep
-                elif num_easy >= n_view / 2:
-                    num_hard_keep = num_hard
-                    num_easy_keep = n_view - num_hard_keep
-                else:
-                    # Log.info('this shoud be never touched! {} {} {}'.format(num_hard, num_easy, n_view))
-                    raise Exception
-            else:
-                num_easy_keep = 0
-                if num_hard > n_view:
-                    num_easy_keep = n_view
-                else:
-                    num_easy_keep = num_hard
-
-            perm = torch.randperm(num_hard)
-            hard_indices = hard_indices[perm[:num_hard_keep]]
-            perm = torch.randperm(num_easy)
-            easy_indices = easy_indices[perm[:num_easy_keep]]
-            indices = torch.cat((hard_indices, easy_indices), dim=0)
-
-            X_[X_ptr, :, :] = X[ii, indices, :].squeeze(1)
-            Y_[X_ptr, :, :] = Y[ii, indices, :].squeeze(1)
-            y_[X_ptr] = cls_id
-            X_ptr += 1
-
-    return X_, Y_, y_
+    # 按类别中易样本的比例选择难/易样本 (proportion_keep)
+    X_, Y_, y_, valid = view_sampling(X, Y, y_hat, y, proportion_keep, ignore_label, max_views, max_samples)
+    return compact_views(X_, Y_, y_, valid)
 
 def Contrastive(feats_, feats_y_, labels_, temperature: float = 0.1, base_temperature: float = 0.07):
     anchor_num, n_view = feats_.shape[0], feats_.shape[1]
 
     labels_ = labels_.contiguous().view(-1, 1)
-    mask = torch.eq(labels_, torch.transpose(labels_, 0, 1)).float().cuda()
+    mask = torch.eq(labels_, torch.transpose(labels_, 0, 1)).float()
 
     contrast_count = n_view * 2
     contrast_feature_x = torch.cat(torch.unbind(feats_, dim=1), dim=0)
@@ -101,7 +31,7 @@ def Contrastive(feats_, feats_y_, labels_, temperature: float = 0.1, base_temper
     neg_mask = 1 - mask
 
     logits_mask = torch.ones_like(mask).scatter_(1,
-                                                torch.arange(anchor_num * anchor_count).view(-1, 1).cuda(),
+                                                torch.arange(anchor_num * anchor_count, device=mask.device).view(-1, 1),
                                                 0)
     mask = mask * logits_mask
 
@@ -123,10 +53,7 @@ def Contrastive(feats_, feats_y_, labels_, temperature: float = 0.1, base_temper
 def SELFPACEDoublePixelContrastLoss(x, labels=None, predict=None):
     feats = x[0]
     feats_y = x[1]
-    labels = labels.unsqueeze(1).float().clone()
-    labels = torch.nn.functional.interpolate(labels,
-                                                (feats.shape[2], feats.shape[3]), mode='nearest')
-    labels = labels.squeeze(1).long()
+    labels = downsample_labels(labels, feats.shape[2:])
     assert labels.shape[-1] == feats.shape[-1], '{} {}'.format(labels.shape, feats.shape)
 
     batch_size = feats.shape[0]
@@ -140,6 +67,9 @@ def SELFPACEDoublePixelContrastLoss(x, labels=None, predict=None):
     feats_y = feats_y.contiguous().view(feats_y.shape[0], -1, feats_y.shape[-1])
 
     feats_, feats_y_, labels_ = Hard_anchor_sampling(feats, feats_y, labels, predict)
+    if labels_.shape[0] == 0:
+        # 没有像素数大于 max_views 的类别, 不计算对比损失
+        return 0
 
     loss = Contrastive(feats_, feats_y_, labels_)
     return loss
\ No newline at end of file
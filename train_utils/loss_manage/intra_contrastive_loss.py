@@ -1,72 +1,19 @@
 import torch
+from train_utils.step_timer import region
+from .pyramid import downsample_labels
+from .SamplesModel import view_sampling, compact_views, balanced_keep
 
 
 def Hard_anchor_sampling(X, y_hat, y, ignore_label: int = 255, max_views: int = 100, max_samples: int = 1024):
-    batch_size, feat_dim = X.shape[0], X.shape[-1]
-
-    classes = []
-    total_classes = 0
-    for ii in range(batch_size):
-        this_y = y_hat[ii]
-        this_classes = torch.unique(this_y)
-        this_classes = [x for x in this_classes if x != ignore_label]
-        this_classes = [x for x in this_classes if (this_y == x).nonzero().shape[0] > max_views]
-
-        classes.append(this_classes)
-        total_classes += len(this_classes)
-
-    if total_classes == 0:
-        return None, None
-
-    n_view = max_samples // total_classes
-    n_view = min(n_view, max_views)
-
-    X_ = torch.zeros((total_classes, n_view, feat_dim), dtype=torch.float).cuda()
-    y_ = torch.zeros(total_classes, dtype=torch.float).cuda()
-
-    X_ptr = 0
-    for ii in range(batch_size):
-        this_y_hat = y_hat[ii]
-        this_y = y[ii]
-        this_classes = classes[ii]
-
-        for cls_id in this_classes:
-            hard_indices = ((this_y_hat == cls_id) & (this_y != cls_id)).nonzero()
-            easy_indices = ((this_y_hat == cls_id) & (this_y == cls_id)).nonzero()
-
-            num_hard = hard_indices.shape[0]
-            num_easy = easy_indices.shape[0]
-
-            if num_hard >= n_view / 2 and num_easy >= n_view / 2:
-                num_hard_keep = n_view // 2
-                num_easy_keep = n_view - num_hard_keep
-            elif num_hard >= n_view / 2:
-                num_easy_keep = num_easy
-                num_hard_keep = n_view - num_easy_keep
-            elif num_easy >= n_view / 2:
-                num_hard_keep = num_hard
-                num_easy_keep = n_view - num_hard_keep
-            else:
-                # Log.info('this shoud be never touched! {} {} {}'.format(num_hard, num_easy, n_view))
-                raise Exception
-
-            perm = torch.randperm(num_hard)
-            hard_indices = hard_indices[perm[:num_hard_keep]]
-            perm = torch.randperm(num_easy)
-            easy_indices = easy_indices[perm[:num_easy_keep]]
-            indices = torch.cat((hard_indices, easy_indices), dim=0)
-
-            X_[X_ptr, :, :] = X[ii, indices, :].squeeze(1)
-            y_[X_ptr] = cls_id
-            X_ptr += 1
-
+    X_, _, y_, valid = view_sampling(X, X, y_hat, y, balanced_keep, ignore_label, max_views, max_samples)
+    X_, _, y_ = compact_views(X_, X_, y_, valid)
     return X_, y_
 
 def Contrastive(feats_, labels_, temperature: float = 0.1, base_temperature: float = 0.07):
     anchor_num, n_view = feats_.shape[0], feats_.shape[1]
 
     labels_ = labels_.contiguous().view(-1, 1)
-    mask = torch.eq(labels_, torch.transpose(labels_, 0, 1)).float().cuda()
+    mask = torch.eq(labels_, torch.transpose(labels_, 0, 1)).float()
 
     contrast_count = n_view
     contrast_feature = torch.cat(torch.unbind(feats_, dim=1), dim=0)
@@ -83,7 +30,7 @@ def Contrastive(feats_, labels_, temperature: float = 0.1, base_temperature: flo
     neg_mask = 1 - mask
 
     logits_mask = torch.ones_like(mask).scatter_(1,
-                                                torch.arange(anchor_num * anchor_count).view(-1, 1).cuda(),
+                                                torch.arange(anchor_num * anchor_count, device=mask.device).view(-1, 1),
                                                 0)
     mask = mask * logits_mask
 
@@ -103,10 +50,9 @@ def Contrastive(feats_, labels_, temperature: float = 0.1, base_temperature: flo
 
 def IntraPixelContrastLoss(x, labels=None, predict=None):
     feats = x[1]
-    labels = labels.unsqueeze(1).float().clone()
-    labels = torch.nn.functional.interpolate(labels,
-                                                (feats.shape[2], feats.shape[3]), mode='nearest')
-    labels = labels.squeeze(1).long()
+    labels = downsample_labels(labels, feats.shape[2:])
+    # 预测按 x[0] 的分辨率给出, dc_net 的 x[1] 分辨率不同
+    predict = downsample_labels(predict, feats.shape[2:])
     assert labels.shape[-1] == feats.shape[-1], '{} {}'.format(labels.shape, feats.shape)
 
     batch_size = feats.shape[0]
@@ -116,7 +62,12 @@ def IntraPixelContrastLoss(x, labels=None, predict=None):
     feats = feats.permute(0, 2, 3, 1)
     feats = feats.contiguous().view(feats.shape[0], -1, feats.shape[-1])
 
-    feats_, labels_ = Hard_anchor_sampling(feats, labels, predict)
+    with region("sampling"):
+        feats_, labels_ = Hard_anchor_sampling(feats, labels, predict)
+    if labels_.shape[0] == 0:
+        # 没有像素数大于 max_views 的类别, 不计算对比损失
+        return 0
 
-    loss = Contrastive(feats_, labels_)
+    with region("contrastive"):
+        loss = Contrastive(feats_, labels_)
     return loss
\ No newline at end of file
@@ -7,7 +7,37 @@ from .double_contrastive_loss import  DoublePixelContrastLoss
 from .double_contrastive_selfpace_loss import  SELFPACEDoublePixelContrastLoss
 from .double_contrastive_selfpace_epoch_loss import  EPOCHSELFPACEDoublePixelContrastLoss
 from .aspp_loss import  ASPP_CONTRAST_Loss
+from .multi_level_loss import  MultiLevel_ASPP_CONTRAST_Loss
 from .simsiam_loss import  simsiam_loss
+from .pyramid import LabelPyramid
+from ..step_timer import region
+
+LEVELS = ["L1", "L2", "L3"]
+
+def multi_level_losses(args, inputs, pyramid, epoch):
+    """
+    --multi_level: aspp_loss 下 L1 / L2 / L3 特征分辨率相同时 (mep 系列模型) 一次采样、一次对比、一次入队,
+    返回 {层名: 加权后的对比损失}; 不满足条件时返回空 dict, 仍逐层计算.
+    """
+    if not getattr(args, "multi_level", False) or args.loss_name != "aspp_loss" or args.contrast > epoch:
+        return {}
+    names = [name for name in LEVELS if name in inputs]
+    if len(names) < 2 or len({tuple(inputs[name][0].shape) for name in names}) != 1:
+        return {}
+
+    losses = {}
+    weights = {name: getattr(args, name + "_loss") for name in names}
+    # 权重为 0 的层逐层计算时对总损失也没有贡献 (且没有 MemoryBank), 不参与
+    active = [name for name in names if weights[name] != 0]
+    if active:
+        labels, predict = pyramid(inputs[active[0]][0].shape[2:])
+        loss_contrast = MultiLevel_ASPP_CONTRAST_Loss(args, epoch, args.epochs, [inputs[name] for name in active],
+                                                      labels, predict)
+    for name in names:
+        x = inputs[name]
+        loss = loss_contrast[active.index(name)] * weights[name] if name in active else 0
+        losses[name] = loss + 0 * sum(f.mean() for f in x[:2])
+    return losses
 
 def criterion(args, inputs, target, epoch):
     losses = {}
@@ -17,36 +47,37 @@ def criterion(args, inputs, target, epoch):
     if args.contrast == -1:
         for name, x in inputs.items():
             # 忽略target中值为255的像素，255的像素是目标边缘或者padding填充
-            if name == "aux":
-                losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255) * 0.5
-            else:
-                losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255)
+            with region("ce"):
+                if name == "aux":
+                    losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255) * 0.5
+                else:
+                    losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255)
     else:
+        # 各层特征分辨率下的标注与预测, 每个 step 只算一次; 没有 logits 的模型用上采样后的 out
+        pyramid = LabelPyramid(target, inputs["logits"] if "logits" in inputs else inputs["out"])
+        losses.update(multi_level_losses(args, inputs, pyramid, epoch))
         for name, x in inputs.items():
             # 忽略target中值为255的像素，255的像素是目标边缘或者padding填充
             if name == "out":
-                pred_y = x
-                losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255)
+                with region("ce"):
+                    losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255)
             elif name == "aux":
-                losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255) * 0.5
+                with region("ce"):
+                    losses[name] = nn.functional.cross_entropy(x, target, ignore_index=255) * 0.5
+            elif name == "logits" or args.contrast > epoch or name in losses:
+                # logits 只用于 pyramid; 对比分支还没开始时不采样、不计算对比损失、不入队; 多层已经一起算过的层跳过
+                continue
             elif name == "simsiam_loss":
                 contrast_en = x["contrast_en"]
                 contrast_de = x["contrast_de"]
 
-                h, w = contrast_de.shape[2], contrast_de.shape[3]
-                targ = target.unsqueeze(1).float().clone()
-                targ = F.interpolate(targ, size=(h, w), mode='nearest')
-                targ = targ.squeeze(1).long()
+                targ = pyramid.labels(contrast_de.shape[2:])
 
-                criterion = nn.CosineSimilarity(dim=1).cuda(args.gpu)
+                criterion = nn.CosineSimilarity(dim=1)
                 loss = simsiam_loss(criterion, contrast_en, contrast_de, targ, ignore_index=255)
                 losses[name] = loss
             else:
-                proj_x = x[0]
-
-                h, w = proj_x.shape[2], proj_x.shape[3]
-                pred = F.interpolate(input=pred_y, size=(h, w), mode='bilinear', align_corners=False)
-                _, predict = torch.max(pred, 1)
+                labels, predict = pyramid(x[0].shape[2:])
                 
                 # # 每层的语义分割像素交叉熵损失
                 # h, w = target.size(1), target.size(2)
@@ -55,15 +86,15 @@ def criterion(args, inputs, target, epoch):
 
                 # 层内对比损失
                 if loss_name == "intra":
-                    loss_contrast = IntraPixelContrastLoss(x, target, predict)
+                    loss_contrast = IntraPixelContrastLoss(x, labels, predict)
                 elif loss_name == "inter":
-                    loss_contrast = InterPixelContrastLoss(x, target, predict)
+                    loss_contrast = InterPixelContrastLoss(x, labels, predict)
                 elif loss_name == "double":
                     # loss_contrast = DoublePixelContrastLoss(x, target, predict)
                     # loss_contrast = SELFPACEDoublePixelContrastLoss(x, target, predict)
-                    loss_contrast = EPOCHSELFPACEDoublePixelContrastLoss(args, epoch, epochs, x, target, predict)
+                    loss_contrast = EPOCHSELFPACEDoublePixelContrastLoss(args, epoch, epochs, x, labels, predict)
                 elif loss_name == "aspp_loss":
-                    loss_contrast = ASPP_CONTRAST_Loss(args, epoch, epochs, x, target, predict)
+                    loss_contrast = ASPP_CONTRAST_Loss(args, epoch, epochs, x, labels, predict)
                 else:
                     print("the name of loss is None !!!")
 
@@ -73,7 +104,9 @@ def criterion(args, inputs, target, epoch):
                     contrast_loss = args.L2_loss
                 elif name == "L3":
                     contrast_loss = args.L3_loss
-                losses[name] = loss_contrast * contrast_loss
+                # 采样为空时对比损失与特征无关; 让投影特征始终留在计算图中, 每个 step 对比分支的参数都有梯度,
+                # DDP 不需要 find_unused_parameters
+                losses[name] = loss_contrast * contrast_loss + 0 * sum(f.mean() for f in x[:2])
 
     if len(losses) == 1:
         return losses['out']
@@ -0,0 +1,82 @@
+import torch
+from Models.memory_bank import enqueue_levels, use_memory_bank
+from train_utils.distributed_utils import all_gather_queue_samples
+from train_utils.step_timer import region
+from .SamplesModel import Sampling
+from .contrastive import contrastive_loss
+from .pyramid import downsample_labels
+
+
+def _stack_queues(banks):
+    # 各层队列 [L, class_num * cache_size, dim] 及其 valid mask
+    snapshots = [bank.snapshot() for bank in banks]
+    queue = torch.stack([q.reshape(-1, q.shape[-1]) for q, _, _ in snapshots])
+    queue_label = torch.stack([l.reshape(-1) for _, l, _ in snapshots])
+    queue_valid = torch.stack([v.reshape(-1) for _, _, v in snapshots])
+    return queue, queue_label, queue_valid
+
+
+def MultiLevel_ASPP_CONTRAST_Loss(args, epoch, epochs, levels, labels=None, predict=None):
+    """
+    ASPP_CONTRAST_Loss 的多层版本: mep 系列模型的 L1 / L2 / L3 特征分辨率相同, 共用一次标注 / 预测.
+        采样: 各层特征在通道维拼接后只调用一次 Sampling (分组均值是逐通道的, 与逐层采样结果相同);
+        对比: 各层堆叠成 [L, N, D], 一次批量矩阵乘, 各层队列中未写入的位置用 mask 去掉;
+        入队: 各层队列用 enqueue_levels 一次更新.
+
+    Args:
+        levels (list): 各层的 [feats, feats_y, (MemoryBank)], 特征形状相同; 与 ASPP_CONTRAST_Loss 一样是 intra 对比
+    Returns:
+        Tensor[L]: 每层的对比损失 (未乘 L*_loss 权重)
+    """
+    num_levels = len(levels)
+    feats = torch.cat([x[0] for x in levels], dim=1)
+    feat_dim = levels[0][0].shape[1]
+
+    labels = downsample_labels(labels, feats.shape[2:])
+    assert labels.shape[-1] == feats.shape[-1], '{} {}'.format(labels.shape, feats.shape)
+
+    banks = None
+    if use_memory_bank(args):
+        banks = [x[2] for x in levels]
+
+    batch_size = feats.shape[0]
+
+    labels = labels.contiguous().view(batch_size, -1)
+    predict = predict.contiguous().view(batch_size, -1)
+
+    feats = feats.permute(0, 2, 3, 1)
+    feats = feats.contiguous().view(feats.shape[0], -1, feats.shape[-1])
+
+    # intra 对比与入队都只用到 feats, 不再拼接 / 采样 feats_y
+    type = args.sample
+    with region("sampling"):
+        feats_, _, labels_, feats_que_, _, labels_queue_ = Sampling(type, epoch, epochs, feats, feats, labels, predict)
+
+    if feats_ is not None:
+        with region("contrastive"):
+            # [N, V, L * D] -> [L, N * V, D], 与 Contrastive 中 torch.cat(torch.unbind(feats, dim=1)) 的顺序相同
+            n, n_view = feats_.shape[0], feats_.shape[1]
+            anchor_feature = feats_.view(n, n_view, num_levels, feat_dim).permute(2, 1, 0, 3).reshape(num_levels, -1, feat_dim)
+            anchor_labels = labels_.contiguous().view(-1).repeat(n_view)
+
+            queue, queue_label, queue_valid = None, None, None
+            if banks is not None:
+                queue, queue_label, queue_valid = _stack_queues(banks)
+            loss = contrastive_loss(anchor_feature, anchor_feature, anchor_labels, anchor_labels,
+                                    queue, queue_label, exclude_self=True, subtract_max=False,
+                                    chunk_size=getattr(args, "contrast_chunk", 0), queue_valid=queue_valid)
+    else:
+        loss = feats.new_zeros(num_levels)
+
+    if banks is not None:
+        with region("enqueue"):
+            # 各层拼在一起只 all_gather 一次
+            if getattr(args, "memory_gather", False):
+                feats_que_, labels_queue_ = all_gather_queue_samples(feats_que_, labels_queue_,
+                                                                     batch_size * args.num_classes, num_levels * feat_dim)
+            if feats_que_ is not None:
+                n_view = feats_que_.shape[1] if feats_que_.dim() == 3 else 1
+                feats_que_ = feats_que_.reshape(-1, n_view, num_levels, feat_dim).permute(2, 0, 1, 3)
+            enqueue_levels(banks, feats_que_, labels_queue_)
+
+    return loss
@@ -0,0 +1,44 @@
+import torch
+import torch.nn.functional as F
+
+
+def downsample_labels(labels, size):
+    """[B, H, W] 的标注最近邻缩放到 size = (h, w); 已经是该大小时直接返回"""
+    size = tuple(size)
+    if tuple(labels.shape[-2:]) == size:
+        return labels
+    labels = F.interpolate(labels.unsqueeze(1).float(), size, mode='nearest')
+    return labels.squeeze(1).long()
+
+
+class LabelPyramid(object):
+    """
+    每个 step 建一次, 多层对比损失共用: 各特征分辨率下的标注 (最近邻缩放) 与预测 (logits 双线性缩放后 argmax),
+    按 (h, w) 缓存, 分辨率相同的层 (如 mep 的 L1 / L2 / L3) 只算一次.
+
+    logits 为分类头在原始步长 (output stride 8 / 4) 上的输出, 即模型 result["logits"], 不是上采样到原图的 out;
+    特征与 logits 分辨率相同时预测就是 logits 的 argmax, 不做插值.
+    """
+    def __init__(self, target, logits):
+        self.target = target
+        self.logits = logits.detach()
+        self._labels = {}
+        self._predict = {}
+
+    def labels(self, size):
+        size = tuple(size)
+        if size not in self._labels:
+            self._labels[size] = downsample_labels(self.target, size)
+        return self._labels[size]
+
+    def predict(self, size):
+        size = tuple(size)
+        if size not in self._predict:
+            logits = self.logits
+            if tuple(logits.shape[-2:]) != size:
+                logits = F.interpolate(logits, size=size, mode='bilinear', align_corners=False)
+            self._predict[size] = torch.max(logits, 1)[1]
+        return self._predict[size]
+
+    def __call__(self, size):
+        return self.labels(size), self.predict(size)
@@ -0,0 +1,76 @@
+import os
+
+import torch
+
+from . import step_timer
+
+
+def parse_profile_steps(value):
+    """"start:end" -> (start, end), 训练开始后的第 start 个 step (从 0 计) 到第 end 个 step (不含)"""
+    start, end = (int(v) for v in value.split(":"))
+    assert 0 <= start < end, "--profile_steps should be start:end with 0 <= start < end, got {}".format(value)
+    return start, end
+
+
+class StepProfiler(object):
+    """
+    --profile_steps start:end: 训练的第 [start, end) 个 step (跨 epoch 连续计数) 用 torch.profiler 记录,
+    包括 input shapes、内存和调用栈; 窗口内 step_timer.region() 的各阶段 (sampling / contrastive / enqueue 等)
+    用 record_function 标出. 窗口结束后在 out_dir 下写 chrome trace 与按耗时 / 内存排序的前 row_limit 个算子表.
+    窗口跨 epoch 时中间的验证也会被记录. 没有 cuda 时只记录 CPU 活动.
+    """
+    def __init__(self, start, end, out_dir, row_limit=30, rank=-1):
+        self.start = start
+        self.end = end
+        self.out_dir = out_dir
+        self.row_limit = row_limit
+        self.suffix = "" if rank in [-1, 0] else "_rank{}".format(rank)
+        self.step = 0
+        self.prof = None
+
+    def begin(self):
+        # 每个 step 取到数据之后调用
+        if self.step == self.start and self.prof is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.prof = torch.profiler.profile(activities=activities, record_shapes=True,
+                                               profile_memory=True, with_stack=True)
+            self.prof.start()
+            step_timer.record_regions = True
+
+    def end_step(self):
+        if self.prof is not None:
+            self.prof.step()
+        self.step += 1
+        if self.step == self.end:
+            self.close()
+
+    def close(self):
+        # 训练在窗口结束前停止时也导出已经记录的部分
+        if self.prof is None:
+            return
+        step_timer.record_regions = False
+        self.prof.stop()
+        prof, self.prof = self.prof, None
+
+        os.makedirs(self.out_dir, exist_ok=True)
+        trace = os.path.join(self.out_dir, "profile_trace{}.json".format(self.suffix))
+        prof.export_chrome_trace(trace)
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        averages = prof.key_averages()
+        with open(os.path.join(self.out_dir, "profile_ops{}.txt".format(self.suffix)), "w") as f:
+            f.write("steps {}:{}\n\n".format(self.start, self.end))
+            f.write(averages.table(sort_by="self_{}_time_total".format(device), row_limit=self.row_limit))
+            f.write("\n\n")
+            f.write(averages.table(sort_by="self_{}_memory_usage".format(device), row_limit=self.row_limit))
+            f.write("\n")
+        print("profiler trace saved to {}".format(trace))
+
+
+def build_profiler(args):
+    value = getattr(args, "profile_steps", "")
+    if not value:
+        return None
+    start, end = parse_profile_steps(value)
+    return StepProfiler(start, end, args.checkpoint_dir, rank=args.rank)
@@ -0,0 +1,161 @@
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+import torch
+
+
+# train_one_epoch 开启 --step_timing 时设置, region() 在 loss 等模块内部打点; 为 None 时 region() 什么都不做
+_active = None
+# --profile_steps 的窗口内为 True, region() 同时用 record_function 给 profiler 打上标签
+record_regions = False
+
+
+@contextmanager
+def region(name):
+    timer = _active
+    if timer is None and not record_regions:
+        yield
+        return
+    label = torch.autograd.profiler.record_function(name) if record_regions else nullcontext()
+    with label:
+        if timer is not None:
+            timer.start(name)
+        try:
+            yield
+        finally:
+            if timer is not None:
+                timer.stop(name)
+
+
+class StepTimer(object):
+    """
+    train_one_epoch 每个 step 各阶段的耗时.
+
+    cuda 上每个阶段前后各记录一个 cuda Event, 不做同步; step 结束时只结算最后一个 Event 已经完成的 step
+    (Event.query(), 不阻塞), 剩下的在 epoch 结束时 summary() 里一次 synchronize 后结算. cpu 上直接用 perf_counter.
+    data 为主机等待 data_loader 的时间 (只计 next() 本身, 不含打印), head 由 forward - backbone 得到.
+    同一个阶段在一个 step 内出现多次 (如 L1 / L2 / L3 各一次对比损失) 时累加.
+    """
+    PHASES = ("data", "h2d", "forward", "backbone", "head", "criterion", "ce", "sampling", "contrastive",
+              "enqueue", "backward", "optimizer")
+
+    def __init__(self, device):
+        self.cuda = torch.device(device).type == "cuda"
+        self.steps = []
+        self._pending = []
+        self._open = {}
+        self._host = None
+        self._events = None
+
+    def _mark(self):
+        if self.cuda:
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def _elapsed(self, start, end):
+        if self.cuda:
+            return start.elapsed_time(end)
+        return (end - start) * 1000
+
+    def wrap(self, data_loader):
+        return _TimedLoader(self, data_loader)
+
+    def begin_step(self, data_ms):
+        self._host = {"data": data_ms}
+        self._events = []
+
+    def start(self, name):
+        if self._events is not None:
+            self._open[name] = self._mark()
+
+    def stop(self, name):
+        if self._events is not None and name in self._open:
+            self._events.append((name, self._open.pop(name), self._mark()))
+
+    def end_step(self):
+        self._pending.append((self._host, self._events))
+        self._host, self._events = None, None
+        self._resolve(block=False)
+
+    def _resolve(self, block):
+        if block and self.cuda:
+            torch.cuda.synchronize()
+        while self._pending:
+            host, events = self._pending[0]
+            if not block and self.cuda and events and not events[-1][2].query():
+                break
+            self._pending.pop(0)
+            step = dict(host)
+            for name, start, end in events:
+                step[name] = step.get(name, 0.0) + self._elapsed(start, end)
+            if "forward" in step and "backbone" in step:
+                step["head"] = step["forward"] - step["backbone"]
+            self.steps.append(step)
+
+    def hook_backbone(self, model):
+        # backbone 的前向时间, 模型没有 backbone 子模块时不记录 (head 也就没有)
+        backbone = getattr(model, "backbone", None)
+        if backbone is None:
+            return []
+        return [backbone.register_forward_pre_hook(lambda m, x: self.start("backbone")),
+                backbone.register_forward_hook(lambda m, x, y: self.stop("backbone"))]
+
+    def summary(self):
+        """返回 [(phase, mean_ms, p50_ms, p90_ms, p99_ms, steps)], 只包含出现过的阶段"""
+        self._resolve(block=True)
+        rows = []
+        for name in self.PHASES:
+            values = np.array([step[name] for step in self.steps if name in step])
+            if len(values) == 0:
+                continue
+            p50, p90, p99 = np.percentile(values, [50, 90, 99])
+            rows.append((name, values.mean(), p50, p90, p99, len(values)))
+        return rows
+
+    def write_csv(self, path, epoch):
+        rows = self.summary()
+        new_file = not os.path.exists(path)
+        with open(path, "a") as f:
+            if new_file:
+                f.write("epoch,phase,mean_ms,p50_ms,p90_ms,p99_ms,steps\n")
+            for name, mean, p50, p90, p99, n in rows:
+                f.write("{},{},{:.3f},{:.3f},{:.3f},{:.3f},{}\n".format(epoch, name, mean, p50, p90, p99, n))
+        return rows
+
+
+class _TimedLoader(object):
+    def __init__(self, timer, data_loader):
+        self.timer = timer
+        self.data_loader = data_loader
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __iter__(self):
+        it = iter(self.data_loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(it)
+            except StopIteration:
+                return
+            self.timer.begin_step((time.perf_counter() - start) * 1000)
+            yield batch
+
+
+@contextmanager
+def step_timing(timer, model):
+    """在 with 内把 timer 设为 region() 使用的计时器, 并给 model.backbone 挂上计时 hook"""
+    global _active
+    handles = timer.hook_backbone(model)
+    _active = timer
+    try:
+        yield timer
+    finally:
+        _active = None
+        for handle in handles:
+            handle.remove()
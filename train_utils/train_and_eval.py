@@ -3,76 +3,85 @@ import torch
 import train_utils.distributed_utils as utils
 
 from contextlib import nullcontext
-from collections import OrderedDict
 from train_utils.loss_manage import criterion
+from train_utils.step_timer import StepTimer, region, step_timing
+from train_utils.contrast_schedule import contrast_on
+from Models.memory_bank import use_memory_bank
 
 
-def train_one_epoch(args, model, optimizer, data_loader, device, epoch, epochs, lr_scheduler, print_freq=10, scaler=None):
+def train_one_epoch(args, model, optimizer, data_loader, device, epoch, epochs, lr_scheduler, print_freq=10, scaler=None,
+                    profiler=None):
     model.train()
-    metric_logger = utils.MetricLogger(delimiter="  ")
+    # loss 留在 device 上累计, 只在打印和 epoch 结束时同步
+    metric_logger = utils.DeviceMetricLogger(delimiter="  ")
     metric_logger.add_meter('lr', utils.SmoothedValue(window_size=1, fmt='{value:.6f}'))
     header = 'Train: [{}/{}]'.format(epoch, epochs)
 
     i = 1
     K = args.GAcc
+    model_without_ddp = model.module if hasattr(model, "module") else model
+    # --step_timing: 各阶段耗时, 每个 epoch 的分位数写到 metadata.csv 旁边的 step_timing.csv
+    timer = StepTimer(device) if getattr(args, "step_timing", False) else None
+    timing = step_timing(timer, model_without_ddp) if timer is not None else nullcontext()
+    loader = timer.wrap(data_loader) if timer is not None else data_loader
+    # args.contrast 之前不计算投影头 / 对比头 (is_eval=True 时各模型只输出 out / aux), 也不入队
+    contrast = contrast_on(args, epoch)
     optimizer.zero_grad()
-    for image, target in metric_logger.log_every(data_loader, print_freq, header, epoch, epochs):
-        image, target = image.to(device), target.to(device)
-        my_context = model.no_sync if args.rank != -1 and i % K != 0 else nullcontext
-        with my_context():
-            with torch.cuda.amp.autocast(enabled=scaler is not None):
+    with timing:
+        for image, target in metric_logger.log_every(loader, print_freq, header, epoch, epochs):
+            if profiler is not None:
+                profiler.begin()
+            with region("h2d"):
+                image, target = image.to(device), target.to(device)
+            my_context = model.no_sync if args.rank != -1 and i % K != 0 else nullcontext
+            with my_context():
+                with torch.cuda.amp.autocast(enabled=scaler is not None):
+                    
+                    with region("forward"):
+                        output = model(image, target, is_eval=not contrast)
                 
-                output = model(image, target)
-            
-                if args.contrast != -1 and args.memory_size >0:
-                    if args.L3_loss != 0:
-                        result3 = OrderedDict()
-                        result3['encode_queue'] = model.module.encode3_queue
-                        result3['encode_queue_ptr'] = model.module.encode3_queue_ptr
-                        # result3['decode_queue'] = model.module.decode3_queue
-                        # result3['decode_queue_ptr'] = model.module.decode3_queue_ptr
-                        result3['code_queue_label'] = model.module.code3_queue_label
-                        output["L3"].append(result3)
-                    if args.L2_loss != 0:
-                        result2 = OrderedDict()
-                        result2['encode_queue'] = model.module.encode2_queue
-                        result2['encode_queue_ptr'] = model.module.encode2_queue_ptr
-                        # result2['decode_queue'] = model.module.decode2_queue
-                        # result2['decode_queue_ptr'] = model.module.decode2_queue_ptr
-                        result2['code_queue_label'] = model.module.code2_queue_label
-                        output["L2"].append(result2)
-                    if args.L1_loss != 0:
-                        result1 = OrderedDict()
-                        result1['encode_queue'] = model.module.encode1_queue
-                        result1['encode_queue_ptr'] = model.module.encode1_queue_ptr
-                        # result1['decode_queue'] = model.module.decode1_queue
-                        # result1['decode_queue_ptr'] = model.module.decode1_queue_ptr
-                        result1['code_queue_label'] = model.module.code1_queue_label
-                        output["L1"].append(result1)
-                loss = criterion(args, output, target, epoch)
-            
-            if scaler is not None:
-                scaler.scale(loss).backward()
-            else:
-                loss.backward()
-        if i % K == 0:
-            if scaler is not None:
-                scaler.step(optimizer)
-                scaler.update()
-            else:
-                optimizer.step()
-
-            lr_scheduler.step()
-            optimizer.zero_grad()
-
-        lr = optimizer.param_groups[0]["lr"]
-        metric_logger.update(loss=loss.item(), lr=lr)
-        i += 1
+                    if contrast and use_memory_bank(args):
+                        # 每层的对比损失从 output 末尾取到对应的 MemoryBank
+                        if args.L3_loss != 0:
+                            output["L3"].append(model_without_ddp.bank3)
+                        if args.L2_loss != 0:
+                            output["L2"].append(model_without_ddp.bank2)
+                        if args.L1_loss != 0:
+                            output["L1"].append(model_without_ddp.bank1)
+                    with region("criterion"):
+                        loss = criterion(args, output, target, epoch)
+                
+                with region("backward"):
+                    if scaler is not None:
+                        scaler.scale(loss).backward()
+                    else:
+                        loss.backward()
+            if i % K == 0:
+                with region("optimizer"):
+                    if scaler is not None:
+                        scaler.step(optimizer)
+                        scaler.update()
+                    else:
+                        optimizer.step()
+
+                    lr_scheduler.step()
+                    optimizer.zero_grad()
+
+            lr = optimizer.param_groups[0]["lr"]
+            metric_logger.update(loss=loss.detach(), lr=lr)
+            if timer is not None:
+                timer.end_step()
+            if profiler is not None:
+                profiler.end_step()
+            i += 1
+
+    if timer is not None and args.rank in [-1, 0]:
+        timer.write_csv(args.checkpoint_dir + "/step_timing.csv", epoch)
 
     return metric_logger.meters["loss"].global_avg, lr
 
 
-def evaluate(model, data_loader, device, num_classes, epoch, epochs):
+def evaluate(model, data_loader, device, num_classes, epoch, epochs, inference=None):
     model.eval()
     confmat = utils.ConfusionMatrix(num_classes)
     metric_logger = utils.MetricLogger(delimiter="  ")
@@ -82,9 +91,12 @@ def evaluate(model, data_loader, device, num_classes, epoch, epochs):
         for image, target in metric_logger.log_every(data_loader, 30, header, epoch, epochs):
             image, target = image.to(device), target.to(device)
             
-            output = model(image, is_eval=True)
-           
-            output = output['out']
+            if inference is not None:
+                # 滑窗 / 多尺度 / 翻转推理 (train_utils.inference.SlidingWindowInference)
+                output = inference(image)
+            else:
+                output = model(image, is_eval=True)
+                output = output['out']
 
             confmat.update(target.flatten(), output.argmax(1).flatten())
 
@@ -1,62 +1,58 @@
 import os
 import torch
 
-from Models import fcn_resnet50
+from Models import prepare_inference
+from Models.model_build import create_model
+from Models.memory_bank import upgrade_queue_state_dict
 from train_utils import evaluate
-from Datasets.pascal_voc import VOCSegmentation
-import Datasets.transforms as T
-
-
-class SegmentationPresetEval:
-    def __init__(self, base_size, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
-        self.transforms = T.Compose([
-            T.RandomResize(base_size, base_size),
-            T.ToTensor(),
-            T.Normalize(mean=mean, std=std),
-        ])
-
-    def __call__(self, img, target):
-        return self.transforms(img, target)
+from train_utils.inference import build_inference
+from Datasets.dataset_build import datasets_load
 
 
 def main(args):
     device = torch.device(args.device if torch.cuda.is_available() else "cpu")
     assert os.path.exists(args.weights), f"weights {args.weights} not found."
 
-    # segmentation nun_classes + background
-    num_classes = args.num_classes + 1
+    # train_multi_GPU.py 保存的权重, 模型参数与数据集都按训练时的 args 构建
+    checkpoint = torch.load(args.weights, map_location='cpu')
+    train_args = checkpoint['args']
+    train_args.pre_trained = ""
+    num_classes = train_args.num_classes
+    data_path = args.data_path or "../../input/" + train_args.data_path
 
-    # VOCdevkit -> VOC2012 -> ImageSets -> Segmentation -> val.txt
-    val_dataset = VOCSegmentation(args.data_path,
-                                  year="2012",
-                                  transforms=SegmentationPresetEval(520),
-                                  txt_name="val.txt")
+    # VOCdevkit -> VOC2012 -> ImageSets -> Segmentation -> val.txt / Datasets/list/val.txt
+    _, val_dataset = datasets_load(train_args, data_path)
 
-    num_workers = 8
     val_loader = torch.utils.data.DataLoader(val_dataset,
                                              batch_size=1,
-                                             num_workers=num_workers,
+                                             num_workers=args.workers,
                                              pin_memory=True,
-                                             collate_fn=val_dataset.collate_fn)
+                                             collate_fn=getattr(val_dataset, "collate_fn", None))
 
-    model = fcn_resnet50(aux=args.aux, num_classes=num_classes)
-    model.load_state_dict(torch.load(args.weights, map_location=device)['model'])
+    model = create_model(train_args)
+    model.load_state_dict(upgrade_queue_state_dict(checkpoint['model']))
     model.to(device)
 
-    confmat = evaluate(model, val_loader, device=device, num_classes=num_classes)
+    # Conv-BN 折叠, 去掉投影头 / 对比头 / 辅助分类头 / MemoryBank, 只输出 out
+    example = torch.zeros(1, 3, 513, 513, device=device) if args.jit else None
+    model = prepare_inference(model, example=example)
+
+    # 训练时设置了 --val_crop / --val_scales / --val_flip 时同样用滑窗 / 多尺度 / 翻转推理
+    inference = build_inference(train_args, model, num_classes) or model
+    confmat = evaluate(model, val_loader, device=device, num_classes=num_classes, epoch=0, epochs=1,
+                       inference=inference)
     print(confmat)
 
 
 def parse_args():
     import argparse
-    parser = argparse.ArgumentParser(description="pytorch fcn training")
+    parser = argparse.ArgumentParser(description="pytorch segmentation validation")
 
-    parser.add_argument("--data-path", default="/data/", help="VOCdevkit root")
-    parser.add_argument("--weights", default="./save_weights/model_29.pth")
-    parser.add_argument("--num-classes", default=20, type=int)
-    parser.add_argument("--aux", default=True, type=bool, help="auxilier loss")
+    parser.add_argument("--data-path", default="", help="dataset root, default ../../input/ + data_path of training")
+    parser.add_argument("--weights", default="./save_weights/model_29.pth", help="checkpoint saved by train_multi_GPU.py")
+    parser.add_argument("--jit", action="store_true", help="torch.jit.trace + torch.jit.freeze the inference model")
     parser.add_argument("--device", default="cuda", help="training device")
-    parser.add_argument('--print-freq', default=10, type=int, help='print frequency')
+    parser.add_argument("--workers", default=8, type=int)
 
     args = parser.parse_args()
 
@@ -65,8 +61,4 @@ def parse_args():
 
 if __name__ == '__main__':
     args = parse_args()
-
-    if not os.path.exists("./save_weights"):
-        os.mkdir("./save_weights")
-
     main(args)